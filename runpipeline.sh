@@ -62,21 +62,10 @@ done
 
 printf "\n"
 
-# Unzip tar files into folders of json files.
-
-printf "We can attempt to untar the files automatically."
-printf "\nDo you want to extract the tar files? [Select number below]\n"
-select yn in "Yes" "No"; do
-    case $yn in
-        Yes ) find $STORAGE_PATH_TARS -type f -name "*.tar" -exec tar -xvf "{}" --skip-old-files --directory $STORAGE_PATH_TARS \;; break;;
-        No ) break;;
-    esac
-done
-
-printf "\n"
+# Tar files no longer need to be extracted. combinejson.py streams the json.gz files straight out of each tar.
 
 # Combine JSON files into larger Parquet files.
-printf "The next step involves combining json files into larger parquet files. This can take a long time."
+printf "The next step involves combining the json files inside the tars into larger parquet files. This can take a long time."
 printf "\nDo you want to combine the json files into parquet files? [Select number below]\n"
 select yn in "Yes" "No"; do
     case $yn in
@@ -121,9 +110,11 @@ done
 # Load parquet file data into postgres database. File naturally checks if should proceed.
 printf "\nThe next step involves loading data from the parquet files into the database. This can take a long time.\n"
 printf "\nDo you want to start loading data into the database? [Select number below]\n"
-select yn in "Yes" "No"; do
+printf "Bulk build is much faster for the initial build of the database, but replaces the video table and builds its indexes itself.\n"
+select yn in "Yes" "Bulk build" "No"; do
     case $yn in
         Yes ) python src/data/dataentry_from_parq.py; break;;
+        "Bulk build" ) python src/data/dataentry_from_parq.py --bulk-build; break;;
         No ) break;;
     esac
 done
@@ -139,7 +130,7 @@ select yn in "Yes" "No"; do
 done
 
 # Export pickle of statistics of the full database as a whole as well as grouped by category.
-printf "\nThe next step will export 2 pickle files of overall statistics of the database. This can take some time.\n"
+printf "\nThe next step will export 2 pickle files of overall statistics of the database. The first run reads every loaded parquet file, later runs only the new ones.\n"
 printf "\nDo you want to start exporting the statistics pickles? [Select number below]\n"
 select yn in "Yes" "No"; do
     case $yn in
@@ -148,12 +139,14 @@ select yn in "Yes" "No"; do
     esac
 done
 
-# Export CSV files
-printf "\nThe next step will export CSV files from the database. This can take a long time.\n"
-printf "\nDo you want to start exporting the csv files? [Select number below]\n"
+# Export training and testing sets
+# export_training_sets.py writes all of them as parquet files from two passes over the parquet files (a key scan, then a row scan).
+# psql_export_csv.sql can still be run through psql to export csv files from the database instead.
+printf "\nThe next step will export the training and testing sets from the parquet files. This can take some time.\n"
+printf "\nDo you want to start exporting the training and testing sets? [Select number below]\n"
 select yn in "Yes" "No"; do
     case $yn in
-        Yes ) PGPASSWORD=$DB_PW psql -h $DB_IP -d $DB_NAME -U $DB_USER -p $DB_PORT -a -q -f src/data/psql_export_csv.sql ; break;;
+        Yes ) python src/data/export_training_sets.py ; break;;
         No ) break;;
     esac
 done
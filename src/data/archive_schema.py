@@ -0,0 +1,172 @@
+# This file defines the Arrow schema of the Youtube_metadata_02_2019 records and helpers to read them from parquet.
+# combinejson.py writes every parquet file with this schema, and later stages read them back through read_archive_parquet()
+# so they only decode the columns they actually use. The bulky nested columns (formats, recommended_videos, credits, headline_badges)
+# are never decoded unless they are asked for.
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Columns of our postgres video table in the order of the table schema.
+# The archive calls desc_text "description" and the last three ratios are calculated in dataentry_from_parq.py.
+db_col_names = [
+    "id",
+    "fetch_date",
+    "uploader",
+    "uploader_id",
+    "upload_date",
+    "title",
+    "desc_text",
+    "category",
+    "tags",
+    "duration",
+    "age_limit",
+    "view_count",
+    "like_count",
+    "dislike_count",
+    "average_rating",
+    "allow_embed",
+    "is_crawlable",
+    "allow_sub_contrib",
+    "is_live_content",
+    "is_ads_enabled",
+    "is_comments_enabled",
+    "formats",
+    "credits",
+    "regions_allowed",
+    "recommended_videos",
+    "headline_badges",
+    "unavailable_message",
+    "license",
+    "view_like_ratio",
+    "view_dislike_ratio",
+    "like_dislike_ratio",
+]
+
+# Archive column names that differ from the database column names.
+db_col_renames = {"description": "desc_text"}
+
+# Arrow schema of the parquet files. Types are fixed-width and match the database column types where possible.
+# Dates are parsed from their archive strings, and low cardinality strings are dictionary encoded.
+archive_schema = pa.schema([
+    ("v", pa.int8()),
+    ("id", pa.string()),
+    ("fetch_date", pa.timestamp("s")),
+    ("uploader", pa.string()),
+    ("uploader_id", pa.string()),
+    ("upload_date", pa.date32()),
+    ("title", pa.string()),
+    ("description", pa.string()),
+    ("category", pa.dictionary(pa.int32(), pa.string())),
+    ("tags", pa.list_(pa.string())),
+    ("duration", pa.int32()),
+    ("age_limit", pa.int16()),
+    ("view_count", pa.int64()),
+    ("like_count", pa.int64()),
+    ("dislike_count", pa.int64()),
+    ("average_rating", pa.float32()),
+    ("allow_embed", pa.bool_()),
+    ("is_crawlable", pa.bool_()),
+    ("allow_sub_contrib", pa.bool_()),
+    ("is_live_content", pa.bool_()),
+    ("is_ads_enabled", pa.bool_()),
+    ("is_comments_enabled", pa.bool_()),
+    ("formats", pa.list_(pa.struct([
+        ("format_id", pa.string()),
+        ("ext", pa.string()),
+        ("height", pa.int32()),
+        ("width", pa.int32()),
+        ("format_note", pa.string()),
+        ("bitrate", pa.int64()),
+        ("fps", pa.int32()),
+        ("quality_label", pa.string()),
+    ]))),
+    ("credits", pa.list_(pa.struct([
+        ("title", pa.string()),
+        ("author", pa.string()),
+        ("url", pa.string()),
+    ]))),
+    ("regions_allowed", pa.list_(pa.string())),
+    ("recommended_videos", pa.list_(pa.struct([
+        ("video_id", pa.string()),
+        ("view_count", pa.int64()),
+    ]))),
+    ("headline_badges", pa.list_(pa.struct([
+        ("text", pa.string()),
+        ("url", pa.string()),
+    ]))),
+    ("unavailable_message", pa.string()),
+    ("license", pa.dictionary(pa.int32(), pa.string())),
+])
+
+# The json records hold dates and dictionary columns as plain strings.
+date_formats = {"fetch_date": "%Y%m%d%H%M%S", "upload_date": "%Y%m%d"}
+json_schema = pa.schema([
+    pa.field(f.name, pa.string()) if f.name in date_formats or pa.types.is_dictionary(f.type) else f
+    for f in archive_schema
+])
+
+# Parquet columns needed to fill the database table.
+db_source_columns = [
+    {v: k for k, v in db_col_renames.items()}.get(c, c)
+    for c in db_col_names
+    if c in archive_schema.names or c in db_col_renames.values()
+]
+
+# Parquet columns used by the model features and the training exports.
+feature_columns = [
+    "id",
+    "fetch_date",
+    "uploader",
+    "upload_date",
+    "title",
+    "description",
+    "category",
+    "duration",
+    "age_limit",
+    "view_count",
+    "like_count",
+    "dislike_count",
+    "average_rating",
+    "allow_embed",
+    "is_crawlable",
+    "allow_sub_contrib",
+    "is_live_content",
+    "is_ads_enabled",
+    "is_comments_enabled",
+]
+
+def to_archive_table(records):
+    """
+    Converts a list of json record dicts into an Arrow table with archive_schema.
+    Missing keys become nulls, and dates that fail to parse become nulls instead of raising.
+    """
+    table = pa.Table.from_pylist(records, schema=json_schema)
+    columns = []
+    for field in archive_schema:
+        column = table[field.name]
+        if field.name in date_formats:
+            column = pc.strptime(column, format=date_formats[field.name], unit="s", error_is_null=True).cast(field.type)
+        elif pa.types.is_dictionary(field.type):
+            column = column.dictionary_encode()
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=archive_schema)
+
+def read_archive_table(path, columns=None):
+    """
+    Reads a parquet file from the parq folder into an Arrow table, only decoding the requested columns.
+    """
+    return pq.read_table(path, columns=columns)
+
+def read_archive_parquet(path, columns=None):
+    """
+    Reads a parquet file from the parq folder into a dataframe, only decoding the requested columns.
+
+    Args:
+        path (str): Path to the parquet file.
+        columns (list): Parquet columns to read. Reads every column if None.
+
+    returns:
+        df - dataframe of the requested columns
+    """
+    return read_archive_table(path, columns=columns).to_pandas(date_as_object=False)
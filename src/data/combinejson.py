@@ -1,9 +1,16 @@
+import argparse
 import glob
+import gzip
+import json
 import numpy as np
-import pandas as pd
+import pyarrow.parquet as pq
 import pickle
+import tarfile
 import yaml
 import os
+from archive_schema import archive_schema, to_archive_table
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
 
 ROOT_DIR = os.path.abspath(os.curdir)
 config_path = os.path.join(ROOT_DIR,"config.yml")
@@ -11,9 +18,22 @@ config_path = os.path.join(ROOT_DIR,"config.yml")
 config = yaml.safe_load(open(config_path))
 storagepath = config["config"]["storepath"]
 
-pathlog_path = os.path.join(ROOT_DIR,"data/interim/pathlog.pickle")
+# Number of worker processes used to build parquet chunks. Defaults to one per core.
+workers = config["config"].get("workers", os.cpu_count())
+
+# Ledger of finished chunks, one json line per chunk. Only the coordinating process writes to it.
+ledger_path = os.path.join(ROOT_DIR,"data/interim/combine_ledger.jsonl")
 allpaths_path = os.path.join(ROOT_DIR,"data/interim/allpaths.pickle")
 
+# Number of rows buffered before they are flushed to the parquet file as one row group.
+# Peak memory of a chunk is roughly one row group plus one json.gz file, so lower this if you have less memory.
+row_group_size = 100000
+
+# Number of source files per parquet chunk. Each archive tar holds around 146 json.gz files,
+# so 3 tars per chunk is close to 500 extracted json.gz files per chunk.
+json_files_per_chunk = 500
+tars_per_chunk = 3
+
 
 def chunks(lst, n):
     """Yield successive n-sized chunks from lst.
@@ -22,65 +42,182 @@ def chunks(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
-def log_paths(paths):
-    # Based on code from stackoverflow https://stackoverflow.com/questions/26835477/pickle-load-variable-if-exists-or-create-and-save-it
+def read_ledger():
+    """
+    Reads the ledger of finished chunks.
+
+    returns:
+        dict - chunk number mapped to its ledger entry
+    """
+    done = {}
     try:
-        pathlist = pickle.load(open(pathlog_path, "rb"))
-        new_paths = paths
-        pathlist.extend(new_paths)
-        pickle.dump(pathlist, open(pathlog_path, "wb"))
+        with open(ledger_path) as f:
+            for line in f:
+                # A line cut off by a killed run is ignored and that chunk is simply rebuilt.
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                done[entry["chunk"]] = entry
     except (OSError, IOError) as e:
-        pathlist = paths
-        pickle.dump(pathlist, open(pathlog_path, "wb"))
+        pass
+    return done
+
+def record_chunk(entry):
+    """
+    Appends a finished chunk to the ledger and flushes it to disk.
+    """
+    with open(ledger_path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
 
 def get_file_paths(storagepath):
     # Based on code from stackoverflow https://stackoverflow.com/questions/26835477/pickle-load-variable-if-exists-or-create-and-save-it
     try:
         allpaths = pickle.load(open(allpaths_path, "rb"))
     except (OSError, IOError) as e:
-        allpaths = sorted(glob.glob(storagepath + "**/*.gz", recursive=True))
+        # Read the downloaded tars directly. Fall back to extracted json.gz files from older runs if there are no tars.
+        allpaths = sorted(glob.glob(storagepath + "*.tar"))
+        if not allpaths:
+            allpaths = sorted(glob.glob(storagepath + "**/*.gz", recursive=True))
         pickle.dump(allpaths, open(allpaths_path, "wb"))
     return allpaths
 
-def combine_json(storagepath):
+def read_json_records(fileobj):
+    """
+    Parses one json.gz file from the archive into a list of record dicts.
+    Takes a path or an open binary file object such as a tar member.
+    """
+    with gzip.open(fileobj, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def iter_json_records(path):
+    """
+    Yields the records of each json.gz file in a source path.
+
+    Tars are read as a stream, one member after another, and each json.gz member is decompressed in memory
+    so the tars never need to be extracted to disk. Plain json.gz paths yield a single list of records.
+    """
+    if path.endswith(".tar"):
+        with tarfile.open(path, mode="r|") as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith(".json.gz"):
+                    yield read_json_records(tar.extractfile(member))
+    else:
+        yield read_json_records(path)
+
+def write_parquet_chunk(paths, parq_save_path, row_group_size=row_group_size):
+    """
+    Streams a list of tars or json.gz files into a single parquet file.
+
+    Each json.gz file is parsed once and its records are buffered until a full row group is available,
+    which is then appended to the parquet file. Memory is bounded by one row group instead of the whole chunk,
+    and the cost per file stays the same no matter how large the chunk gets.
+    The file is written under a temporary name and renamed when complete so a killed run never leaves
+    a partial chunk that looks finished.
+
+    returns:
+        int - number of rows written
+    """
+    tmp_save_path = parq_save_path + ".tmp"
+    buffer = []
+    rows_written = 0
+
+    with pq.ParquetWriter(tmp_save_path, archive_schema) as writer:
+        for p in paths:
+            for records in iter_json_records(p):
+                buffer.extend(records)
+
+                while len(buffer) >= row_group_size:
+                    writer.write_table(to_archive_table(buffer[:row_group_size]))
+                    del buffer[:row_group_size]
+                    rows_written += row_group_size
+
+        if buffer:
+            writer.write_table(to_archive_table(buffer))
+            rows_written += len(buffer)
+
+    os.replace(tmp_save_path, parq_save_path)
+    return rows_written
+
+def process_chunk(yi, ypaths, storagepath):
+    """
+    Worker entry point. Builds the parquet file for one chunk of json.gz files.
+    Chunks never share files, so workers do not need to coordinate with each other.
+
+    returns:
+        dict - ledger entry for the finished chunk
+    """
+    start_time = perf_counter()
+    parq_save_path = f"{storagepath}/parq/{yi}.parquet"
+    rows_written = write_parquet_chunk(ypaths, parq_save_path)
+    return {
+        "chunk": yi,
+        "parquet": parq_save_path,
+        "paths": ypaths,
+        "rows": rows_written,
+        "seconds": round(perf_counter() - start_time, 2),
+    }
+
+def combine_json(storagepath, workers=workers):
 
     youtubefilepaths = get_file_paths(storagepath)
     youtube_len = len(youtubefilepaths)
-    chunksize = 500
+    chunksize = tars_per_chunk if youtubefilepaths and youtubefilepaths[0].endswith(".tar") else json_files_per_chunk
     print(f"Total files is {youtube_len}")
 
-    # Check for already done chunks based on the parquet file
-    try:
-        chunksdone = sorted(glob.glob(storagepath + "/parq/*.parquet", recursive=True))
-        chunknumbers = [int(x.split("/parq/")[1].split(".")[0]) for x in chunksdone]
-        print(f"Chunks done already: {chunknumbers}")
-    except:
-        chunknumbers = []
-
-    # Chunk the json.gz into 400 files at a time for processing. You can change that batch size if you have less memory.
-    for yi, ypaths in enumerate(chunks(youtubefilepaths,chunksize)):
-
-        if yi in chunknumbers:
-            print("This chunk is already done. Skipping.")
-        else:
-            print(f"Beginning Chunk #{yi}")
-            youtube201902_df = None
-            for i, p in enumerate(ypaths):
-                if i == 0:
-                    youtube201902_df = pd.read_json(p, compression='gzip')
-                else:
-                    youtube201902_df = pd.concat([youtube201902_df, pd.read_json(p, compression='gzip')],axis=0,join='outer')
-
-                if i % 50 == 0:
-                    print(f"Got {i} files out of {len(ypaths)} in this chunk")
-
-            parq_save_path = f"{storagepath}/parq/{yi}.parquet"
-            youtube201902_df.to_parquet(parq_save_path)
-
-            # Log which paths we have already done
-            log_paths(ypaths)
+    os.makedirs(f"{storagepath}/parq", exist_ok=True)
+
+    # Chunk the tars (or json.gz files) into groups for processing. Memory is bounded by row_group_size per worker, not the chunk size.
+    allchunks = dict(enumerate(chunks(youtubefilepaths,chunksize)))
+
+    # Check for already done chunks based on the ledger. A chunk only counts as done if it was built from the same paths,
+    # since a regenerated allpaths.pickle or a different chunk size gives the same chunk numbers to other files.
+    ledger = read_ledger()
+    chunknumbers = set(ledger)
+    mismatched = [yi for yi, entry in ledger.items() if allchunks.get(yi) != entry["paths"]]
+
+    # Parquet files are only renamed into place once complete, so any that exist from older runs count as done too.
+    # Those runs had no ledger and only read extracted json.gz files, so they cannot be chunks of tars.
+    chunksdone = sorted(glob.glob(storagepath + "/parq/*.parquet", recursive=True))
+    unrecorded = {int(x.split("/parq/")[1].split(".")[0]) for x in chunksdone} - chunknumbers
+    if chunksize == tars_per_chunk:
+        mismatched += sorted(unrecorded)
+    chunknumbers.update(unrecorded)
+    if mismatched:
+        print(f"Chunks {sorted(mismatched)} in {storagepath}parq were built from other files than the current chunks of {allpaths_path}.")
+        print(f"Stopping so that no rows are missing or duplicated. Restore the old {allpaths_path}, or remove the parq folder and {ledger_path} to rebuild every chunk.")
+        return
+    print(f"Chunks done already: {sorted(chunknumbers)}")
+
+    pending = [(yi, ypaths) for yi, ypaths in allchunks.items() if yi not in chunknumbers]
+    print(f"Chunks to process: {len(pending)} using {workers} workers")
+
+    failed = []
+    start_time = perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_chunk, yi, ypaths, storagepath): yi for yi, ypaths in pending}
+        for future in as_completed(futures):
+            yi = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                print(f"Error processing chunk #{yi}")
+                print(e)
+                failed.append(yi)
+                continue
+
+            # Log which chunks and paths we have already done
+            record_chunk(entry)
+            print(f"Finished chunk #{yi}: {entry['rows']} rows in {entry['seconds']}s")
+
+    print(f"Processed {len(pending) - len(failed)} chunks in {round(perf_counter() - start_time, 2)}s")
+    if failed:
+        print(f"Failed chunks (rerun to retry): {sorted(failed)}")
 
 if __name__ == "__main__":
-    combine_json(storagepath)
-
-
+    parser = argparse.ArgumentParser(description="Combine archive json.gz files into parquet files.")
+    parser.add_argument("--workers", type=int, default=workers, help="Number of worker processes.")
+    args = parser.parse_args()
+    combine_json(storagepath, workers=args.workers)
@@ -1,4 +1,5 @@
 -- DROP TABLE IF EXISTS video_data CASCADE;
+-- For a table partitioned by upload_date or category, set partition_by in config.yml and use the bulk build of dataentry_from_parq.py.
 
 CREATE TABLE IF NOT EXISTS video_data (
     row_id SERIAL PRIMARY KEY,
@@ -1,19 +1,23 @@
 ## This file is intended to connect to the database, read parquet files from our storage server,
-## load it into pandas, then insert that into the postgres table.
+## convert them with pyarrow, then stream them into the postgres table with COPY.
 
 import yaml
 import glob
-import numpy as np
-import pandas as pd
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+import io
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import psycopg2
 import json
 import pickle
 from tqdm import tqdm
-from psycopg2.extensions import register_adapter, AsIs
 from datetime import datetime
+from time import perf_counter
+import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from archive_schema import db_col_names, db_col_renames, db_source_columns, date_formats, read_archive_table
+from video_partitions import check_partition_by, partition_clause, unique_key_sql, get_partitions, get_partition_names, attach_month_sql
 
 ROOT_DIR = os.path.abspath(os.curdir)
 config_path = os.path.join(ROOT_DIR,"config.yml")
@@ -24,54 +28,73 @@ database = config["config"]["dbname"]
 user = config["config"]["dbuser"]
 pw = config["config"]["dbpw"]
 video_table_name = config["config"]["dbvideotable"]
-
-
-db_col_names = [
-    "id",
-    "fetch_date",
-    "uploader",
-    "uploader_id",
-    "upload_date",
-    "title",
-    "desc_text",
-    "category",
-    "tags",
-    "duration",
-    "age_limit",
-    "view_count",
-    "like_count",
-    "dislike_count",
-    "average_rating",
-    "allow_embed",
-    "is_crawlable",
-    "allow_sub_contrib",
-    "is_live_content",
-    "is_ads_enabled",
-    "is_comments_enabled",
-    "formats",
-    "credits",
-    "regions_allowed",
-    "recommended_videos",
-    "headline_badges",
-    "unavailable_message",
-    "license",
-    "view_like_ratio",
-    "view_dislike_ratio",
-    "like_dislike_ratio",
-]
-
+port = config["config"].get("dbport", 5432)
+
+# Number of rows sent to the server per COPY batch. Every batch of a file runs in the same transaction.
+copy_batch_size = 100000
+
+# Parallel workers used to load files. Each worker loads whole files over its own connection, so the default is capped
+# at max_load_workers, and any number of workers is capped to a quarter of the server's max_connections.
+max_load_workers = 8
+load_workers = config["config"].get("load_workers", min(os.cpu_count(), max_load_workers))
+
+# Optional partition key of the video table built by the bulk build: upload_date, category, or None for a single table.
+partition_by = config["config"].get("partition_by")
+check_partition_by(partition_by)
+
+# Column definitions of the video table (see create_video_table.sql), without row_id and the generated dislike_like_ratio.
+video_columns_sql = """
+    id TEXT NOT NULL,
+    fetch_date TIMESTAMP,
+    uploader TEXT,
+    uploader_id TEXT,
+    upload_date DATE,
+    title TEXT,
+    desc_text TEXT,
+    category TEXT,
+    tags TEXT,
+    duration INTEGER,
+    age_limit INTEGER,
+    view_count BIGINT,
+    like_count BIGINT,
+    dislike_count BIGINT,
+    average_rating REAL,
+    allow_embed BOOLEAN,
+    is_crawlable BOOLEAN,
+    allow_sub_contrib BOOLEAN,
+    is_live_content BOOLEAN,
+    is_ads_enabled BOOLEAN,
+    is_comments_enabled BOOLEAN,
+    formats JSONB,
+    credits JSONB,
+    regions_allowed TEXT,
+    recommended_videos JSONB,
+    headline_badges JSONB,
+    unavailable_message TEXT,
+    license TEXT,
+    view_like_ratio REAL,
+    view_dislike_ratio REAL,
+    like_dislike_ratio REAL"""
+
+# Columns holding nested data that postgres stores as JSONB, and lists that are stored as array text.
+cols_to_convert_json = ['formats','credits','recommended_videos','headline_badges']
+cols_to_convert_list = ["tags","regions_allowed"]
+
+# Array elements postgres would quote: empty, NULL, or containing braces, commas, quotes, backslashes or whitespace.
+pg_array_quote_pattern = r'^$|^[Nn][Uu][Ll][Ll]$|[{},"\\\s]'
+
+# Loaded files are recorded in this table in the same transaction as their rows, so a crash can never
+# leave a file loaded but unrecorded (or recorded but not loaded).
+ledger_table_name = "load_ledger"
+
+# Temporary table each file is copied into before its latest fetches are written to the video table.
+load_table_name = "video_load"
+
+# Log of loaded files from older runs. It is copied into the ledger table the first time the ledger is used.
 insertedlog_path = os.path.join(ROOT_DIR,"data/interim/insertedlog.pickle")
 
-def log_paths(paths):
-    # Based on code from stackoverflow https://stackoverflow.com/questions/26835477/pickle-load-variable-if-exists-or-create-and-save-it
-    try:
-        pathlist = pickle.load(open(insertedlog_path, "rb"))
-        new_paths = paths
-        pathlist.extend(new_paths)
-        pickle.dump(pathlist, open(insertedlog_path, "wb"))
-    except (OSError, IOError) as e:
-        pathlist = paths
-        pickle.dump(pathlist, open(insertedlog_path, "wb"))
+# Connection held by each worker process for its whole life. Set up by init_worker.
+worker_conn = None
 
 def chunks(lst, n):
     """Yield successive n-sized chunks from lst.
@@ -80,111 +103,453 @@ def chunks(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
-def get_data_video():
+def get_connection():
+    """
+    Opens a psycopg2 connection to the database from the config.
+    """
+    return psycopg2.connect(host=host, port=port, dbname=database, user=user, password=pw)
+
+def init_worker():
+    global worker_conn
+    worker_conn = get_connection()
+
+def cap_workers(conn, workers):
+    """
+    returns:
+        int - workers, capped to a quarter of the max_connections of the server
+    """
+    with conn.cursor() as cur:
+        cur.execute("SHOW max_connections")
+        limit = max(1, int(cur.fetchone()[0]) // 4)
+    if workers > limit:
+        print(f"Using {limit} workers instead of {workers}, a quarter of the server's max_connections")
+        return limit
+    return workers
+
+def get_loaded_paths(conn):
+    """
+    Creates the ledger table if needed and returns the set of parquet paths already loaded.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""CREATE TABLE IF NOT EXISTS {ledger_table_name} (
+            path TEXT PRIMARY KEY,
+            row_count BIGINT,
+            loaded_at TIMESTAMP DEFAULT now()
+            )""")
+        cur.execute(f"SELECT path FROM {ledger_table_name}")
+        loaded = {row[0] for row in cur.fetchall()}
+
+        if not loaded:
+            try:
+                insertedlog = pickle.load(open(insertedlog_path, "rb"))
+                print(f"Copying {len(insertedlog)} paths from {insertedlog_path} into {ledger_table_name}")
+                cur.executemany(f"INSERT INTO {ledger_table_name} (path) VALUES (%s) ON CONFLICT DO NOTHING", [(p,) for p in insertedlog])
+                loaded = set(insertedlog)
+            except (OSError, IOError) as e:
+                pass
+    conn.commit()
+    return loaded
+
+def to_pg_array(column):
+    """
+    Formats a list column as postgres array text such as {a,b,"c d"} in one columnar pass.
+    This is the same text the TEXT columns received when psycopg2 adapted python lists during to_sql.
+    """
+    column = column.combine_chunks()
+    values = pc.cast(column.values, pa.string())
+    escaped = pc.replace_substring(pc.replace_substring(values, "\\", "\\\\"), '"', '\\"')
+    quoted = pc.binary_join_element_wise('"', escaped, '"', "")
+    values = pc.fill_null(pc.if_else(pc.match_substring_regex(values, pg_array_quote_pattern), quoted, values), "NULL")
+    joined = pc.binary_join(pa.ListArray.from_arrays(column.offsets, values, mask=column.is_null()), ",")
+    return pc.binary_join_element_wise("{", joined, "}", "")
+
+def to_json_literals(values):
+    """
+    Formats a flat array as json literals (strings quoted and escaped, nulls as null).
+
+    returns:
+        pa.Array - string array of json literals, or None if the type is not supported
+    """
+    if pa.types.is_string(values.type) or pa.types.is_large_string(values.type):
+        literals = pc.replace_substring(values, "\\", "\\\\")
+        literals = pc.replace_substring(literals, '"', '\\"')
+        for char, code in (("\n", "\\n"), ("\r", "\\r"), ("\t", "\\t")):
+            literals = pc.replace_substring(literals, char, code)
+        literals = pc.binary_join_element_wise('"', literals, '"', "")
+
+        # Other control characters are rare, so only those strings go through the json module
+        rare = pc.fill_null(pc.match_substring_regex(values, "[\\x00-\\x08\\x0b\\x0c\\x0e-\\x1f]"), False)
+        if pc.any(rare).as_py():
+            fixed = pa.array([json.dumps(v) for v in pc.filter(values, rare).to_pylist()], type=pa.string())
+            literals = pc.replace_with_mask(literals, rare, fixed)
+    elif pa.types.is_integer(values.type) or pa.types.is_boolean(values.type):
+        literals = pc.cast(values, pa.string())
+    elif pa.types.is_floating(values.type):
+        # json has no inf or NaN
+        literals = pc.if_else(pc.is_finite(values), pc.cast(values, pa.string()), pa.scalar(None, pa.string()))
+    else:
+        return None
+    return pc.fill_null(literals, "null")
+
+def to_json_text(column):
+    """
+    Encodes a nested column as json text for a JSONB column. Nulls stay null instead of becoming 'null'.
+
+    Lists of structs with flat fields are encoded with Arrow string kernels: every field becomes a "key": value fragment,
+    the fragments are joined into objects, and the objects are joined per row. Other types fall back to the json module.
+    """
+    column = column.combine_chunks()
+    if pa.types.is_list(column.type) and pa.types.is_struct(column.type.value_type):
+        structs = column.values
+        fields = [to_json_literals(structs.field(i)) for i in range(structs.type.num_fields)]
+        if fields and all(f is not None for f in fields):
+            parts = [
+                pc.binary_join_element_wise(json.dumps(structs.type.field(i).name) + ": ", f, "")
+                for i, f in enumerate(fields)
+            ]
+            objects = pc.binary_join_element_wise("{", pc.binary_join_element_wise(*parts, ", "), "}", "")
+            objects = pc.if_else(structs.is_null(), "null", objects)
+            rows = pc.binary_join(pa.ListArray.from_arrays(column.offsets, objects, mask=column.is_null()), ", ")
+            return pc.binary_join_element_wise("[", rows, "]", "")
+
+    encode = json.JSONEncoder().encode
+    return pa.array([None if v is None else encode(v) for v in column.to_pylist()], type=pa.string())
+
+def to_timestamp(column, name):
+    """
+    Parses dates from older parquet files that stored them as numbers or strings. Unparseable dates become null.
+    """
+    if pa.types.is_timestamp(column.type) or pa.types.is_date(column.type):
+        return column
+    if pa.types.is_floating(column.type):
+        column = pc.cast(column, pa.int64())
+    return pc.strptime(pc.cast(column, pa.string()), format=date_formats[name], unit="s", error_is_null=True)
+
+def prepare_video_table(table):
+    """
+    Transforms a parquet table into rows of the video table as a columnar batch.
 
-    # Open database connection session
-    engine = create_engine(f'postgresql+psycopg2://{user}:{pw}@{host}:5432/{database}')
+    Calculates the ratios, drops rows where like_dislike_ratio is inf or NaN, then converts the remaining rows:
+    dates are parsed, nested columns become json text, lists become postgres array text,
+    and columns are renamed and ordered as per the database schema.
 
+    returns:
+        pa.Table - table with db_col_names columns
+    """
+    view_count = pc.cast(table["view_count"], pa.float64())
+    like_count = pc.cast(table["like_count"], pa.float64())
+    dislike_count = pc.cast(table["dislike_count"], pa.float64())
+    table = table.append_column("view_like_ratio", pc.divide(view_count, like_count))
+    table = table.append_column("view_dislike_ratio", pc.divide(view_count, dislike_count))
+    table = table.append_column("like_dislike_ratio", pc.divide(like_count, dislike_count))
+
+    # Drop inf and NA rows before converting anything else
+    table = table.filter(pc.is_finite(table["like_dislike_ratio"]))
+
+    source_names = {v: k for k, v in db_col_renames.items()}
+    columns = []
+    for name in db_col_names:
+        column = table[source_names.get(name, name)]
+        if name in date_formats:
+            column = to_timestamp(column, name)
+            if name == "upload_date":
+                column = pc.cast(column, pa.date32())
+        elif name in cols_to_convert_json:
+            column = to_json_text(column)
+        elif name in cols_to_convert_list:
+            column = to_pg_array(column)
+        elif pa.types.is_dictionary(column.type):
+            column = pc.cast(column, pa.string())
+        columns.append(column)
+
+    return pa.table(columns, names=db_col_names)
+
+def get_data_video(workers=load_workers):
+    """
+    Loads every parquet file that is not in the ledger yet into the video table.
+    Workers load one file per transaction, and the file is recorded in the ledger inside that same transaction,
+    so resuming after a crash loads exactly the files that are missing.
+    """
     storagepath = config["config"]["storepath"]
 
     youtubefilepaths = sorted(glob.glob(storagepath + "parq/*.parquet", recursive=True))
     youtube_len = len(youtubefilepaths)
     print(f"Total files is {youtube_len}")
 
-    try:
-        insertedlog = pickle.load(open(insertedlog_path, "rb"))
-        print(insertedlog)
-    except:
-        insertedlog = []
-
-    for yi, ypaths in enumerate(tqdm(youtubefilepaths)):
-
-        thetime = datetime.now().strftime("%H:%M:%S")
-        print(f"Time is: {thetime}")
-
-        if ypaths not in insertedlog:
-            youtube201902_df = None
-            youtube201902_df = pd.read_parquet(ypaths)
-            print(f"Loaded data from {ypaths} into dataframe")
-
-            # Convert dates to timestamp
-            youtube201902_df["fetch_date"] = pd.to_datetime(youtube201902_df["fetch_date"], format='%Y%m%d%H%M%S', errors='coerce')
-            youtube201902_df["upload_date"] = pd.to_datetime(youtube201902_df["upload_date"], format='%Y%m%d', errors='coerce')
-
-            # convert dict to object that postgres can accept
-            cols_to_convert_json = ['formats','credits','recommended_videos','headline_badges']
-            cols_to_convert_list = ["tags","regions_allowed"]
-
-            def dump_json(row):
-                try:
-                    return json.dumps(row.tolist())
-                except:
-                    return None
-
-            def convert_list(row):
-                try:
-                    return list(row)
-                except:
-                    return None
-
-            for c in cols_to_convert_json:
-                youtube201902_df[c] = youtube201902_df[c].apply(dump_json)
-
-            for c in cols_to_convert_list:
-                youtube201902_df[c] = youtube201902_df[c].apply(convert_list)
-            
-            youtube201902_df["view_like_ratio"] = youtube201902_df["view_count"] / youtube201902_df["like_count"]
-            youtube201902_df["view_dislike_ratio"] = youtube201902_df["view_count"] / youtube201902_df["dislike_count"]
-            youtube201902_df["like_dislike_ratio"] = youtube201902_df["like_count"] / youtube201902_df["dislike_count"]
-
-            # Drop inf rows
-            youtube201902_df = youtube201902_df[youtube201902_df["like_dislike_ratio"]!= np.inf]
-            
-            # Drop NA values
-            youtube201902_df = youtube201902_df.dropna(subset=["like_dislike_ratio"])
-
-            # Rename description column to match database table
-            youtube201902_df = youtube201902_df.rename(columns={"description":"desc_text"})
-
-            # Order columns as per the database schema
-            youtube201902_df = youtube201902_df[db_col_names]
-
-            # Enter data into database and log the paths completed
-            enter_data_video(youtube201902_df)
-            log_paths([ypaths])
-            del youtube201902_df
-        else:
-            print(f"{ypaths} already inserted. Skipping.")
-
+    conn = get_connection()
+    loaded = get_loaded_paths(conn)
+    workers = cap_workers(conn, workers)
+    conn.close()
+    pending = [p for p in youtubefilepaths if p not in loaded]
+    print(f"{youtube_len - len(pending)} files already inserted. Loading {len(pending)} files using {workers} workers.")
+
+    start_time = perf_counter()
+    total_rows = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = {executor.submit(load_file, p, video_table_name, True, True): p for p in pending}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            # Files that fail are rolled back and not in the ledger, so they are retried next run.
+            try:
+                total_rows += future.result()
+            except Exception as e:
+                print(f"Error writing {futures[future]} to DB")
+                print("Error is:")
+                print(e)
+                failed.append(futures[future])
+
+    seconds = perf_counter() - start_time
+    print(f"Loaded {total_rows} rows in {round(seconds, 2)}s ({int(total_rows / max(seconds, 1e-9))} rows/s)")
+    if failed:
+        print(f"Failed files (rerun to retry): {failed}")
     print("Data entry process completed")
 
 
-def enter_data_video(df):
-    
-    # # Get data
-    # df = get_data_video()
+def latest_fetch_sql(table_name, column_list, partitioned):
+    """
+    Statements moving the rows of the load table into table_name, keeping the latest fetch of every id like the bulk build.
+    Rows of the load table are only written if their id is new or their fetch_date is later than the row in the table.
+
+    returns:
+        list - sql statements, the last one being the insert
+    """
+    latest = f"""SELECT DISTINCT ON (id) {column_list} FROM {load_table_name} ORDER BY id, fetch_date DESC NULLS LAST"""
+    if not partitioned:
+        updates = ", ".join(f"{c} = excluded.{c}" for c in column_list.split(",") if c != "id")
+        return [f"""INSERT INTO {table_name} ({column_list}) {latest}
+            ON CONFLICT (id) DO UPDATE SET {updates}
+            WHERE excluded.fetch_date IS NOT NULL AND ({table_name}.fetch_date IS NULL OR excluded.fetch_date > {table_name}.fetch_date)"""]
+
+    # The unique id of a partitioned table also holds the partition key, so ON CONFLICT (id) is not possible and a fetch
+    # with a new upload_date or category would land in another partition. Older fetches of the ids are deleted and new ids
+    # are checked by hand instead, with the table locked so that workers cannot insert the same id at the same time.
+    return [
+        f"LOCK TABLE {table_name} IN SHARE ROW EXCLUSIVE MODE",
+        f"""DELETE FROM {table_name} USING {load_table_name}
+            WHERE {table_name}.id = {load_table_name}.id AND {load_table_name}.fetch_date IS NOT NULL
+            AND ({table_name}.fetch_date IS NULL OR {load_table_name}.fetch_date > {table_name}.fetch_date)""",
+        f"""INSERT INTO {table_name} ({column_list})
+            SELECT {column_list} FROM ({latest}) latest
+            WHERE NOT EXISTS (SELECT 1 FROM {table_name} WHERE {table_name}.id = latest.id)""",
+    ]
+
+def enter_data_video(table, conn, table_name=video_table_name, ledger_path=None, keep_latest=False):
+    """
+    Streams a table into the video table (or table_name) with COPY ... FROM STDIN in csv format.
+
+    Rows are sent in batches of copy_batch_size inside one transaction, so a file is either fully loaded or not at all.
+    With keep_latest the rows are copied into a temporary table first, then written with latest_fetch_sql, so an id
+    already in the table (or repeated in the file) keeps its latest fetch instead of failing the file.
+    If ledger_path is given it is recorded in the ledger table in the same transaction.
+    If a batch fails the transaction is rolled back and the error is raised with the batch that failed.
 
-    # Get database connection engine
-    # print("Creating Engine...")
-    engine = create_engine(f'postgresql://{user}:{pw}@{host}:5432/{database}')
-    print("Created Engine")
+    returns:
+        int - number of rows written
+    """
+    column_list = ",".join(table.column_names)
+    copy_table = load_table_name if keep_latest else table_name
+    copy_sql = f"""COPY {copy_table} ({column_list}) FROM STDIN WITH (FORMAT csv)"""
+    write_options = pacsv.WriteOptions(include_header=False)
 
-    # Open session and write data to database
     print("Attempting to write to DB...")
-    with Session(engine) as session:
+    start_time = perf_counter()
+    rows_written = table.num_rows
+    with conn.cursor() as cur:
+        if keep_latest:
+            try:
+                cur.execute(f"CREATE TEMP TABLE {copy_table} ({video_columns_sql}) ON COMMIT DROP")
+            except Exception as e:
+                conn.rollback()
+                raise
+        for bi, start in enumerate(range(0, table.num_rows, copy_batch_size)):
+            # Strings are always quoted and nulls are left empty, which is how COPY csv tells them apart
+            buffer = io.BytesIO()
+            pacsv.write_csv(table.slice(start, copy_batch_size), buffer, write_options)
+            buffer.seek(0)
+            try:
+                cur.copy_expert(copy_sql, buffer)
+            except Exception as e:
+                conn.rollback()
+                raise RuntimeError(f"COPY batch {bi} (rows {start} to {start + copy_batch_size}) failed: {e}")
+
         try:
-            df.to_sql(video_table_name,con=engine,if_exists='append',index=False,method='multi',chunksize=10000)
+            if keep_latest:
+                cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", (table_name,))
+                for statement in latest_fetch_sql(table_name, column_list, cur.fetchone()[0]):
+                    cur.execute(statement)
+                rows_written = cur.rowcount
+            if ledger_path is not None:
+                cur.execute(f"INSERT INTO {ledger_table_name} (path, row_count) VALUES (%s, %s)", (ledger_path, rows_written))
         except Exception as e:
-            print("Error writing to DB")
-            print("Error is:")
-            print(e)
+            conn.rollback()
+            raise
+    conn.commit()
+
+    seconds = perf_counter() - start_time
+    skipped = f", skipped {table.num_rows - rows_written} older fetches" if rows_written < table.num_rows else ""
+    print(f"Finished writing {rows_written} rows to DB in {round(seconds, 2)}s ({int(table.num_rows / max(seconds, 1e-9))} rows/s){skipped}")
+    return rows_written
+
+def load_file(path, table_name, record=False, keep_latest=False):
+    """
+    Worker entry point. Loads one parquet file into table_name over the worker's connection.
+    If record is True the file is recorded in the ledger in the same transaction.
+    If keep_latest is True every id keeps its latest fetch instead of failing on ids already in table_name (see enter_data_video).
+
+    returns:
+        int - number of rows written
+    """
+    table = prepare_video_table(read_archive_table(path, columns=db_source_columns))
+    return enter_data_video(table, worker_conn, table_name=table_name, ledger_path=path if record else None, keep_latest=keep_latest)
 
-    print("Finished writing to DB")
+def run_sql(conn, statements):
+    """
+    Runs sql statements in order, printing how long each one took, and commits.
+    A statement can be a (sql, params) tuple to pass parameters.
+    """
+    with conn.cursor() as cur:
+        for statement in statements:
+            statement, params = statement if isinstance(statement, tuple) else (statement, None)
+            print(statement.strip().splitlines()[0])
+            start_time = perf_counter()
+            cur.execute(statement, params)
+            print(f"Took {round(perf_counter() - start_time, 2)}s")
+    conn.commit()
+
+def bulk_build(workers=load_workers):
+    """
+    Builds the video table from scratch, much faster than loading into the finished table.
+
+    1. Loads every parquet file in parallel into an UNLOGGED staging table with no indexes or constraints.
+    2. Removes duplicate ids in one set-based pass (keeping the latest fetch) while copying into a new table,
+       which computes dislike_like_ratio for all rows in the same statement.
+    3. Swaps the new table in for the old one.
+    4. Builds the primary key, unique id and optimizedb.sql indexes with parallel maintenance workers, then ANALYZE.
+
+    If partition_by is set in config.yml the new table is partitioned by it (see video_partitions.py),
+    with partitions covering every upload_date or category found in the staging table.
+
+    This replaces the existing video table, so it is meant for the initial build of the database.
+    """
+    staging_table = f"{video_table_name}_staging"
+    new_table = f"{video_table_name}_new"
+
+    storagepath = config["config"]["storepath"]
+    youtubefilepaths = sorted(glob.glob(storagepath + "parq/*.parquet", recursive=True))
+    print(f"Total files is {len(youtubefilepaths)}")
+
+    conn = get_connection()
+    get_loaded_paths(conn)
+    workers = cap_workers(conn, workers)
+    run_sql(conn, [
+        f"DROP TABLE IF EXISTS {staging_table}",
+        f"CREATE UNLOGGED TABLE {staging_table} ({video_columns_sql})",
+    ])
+
+    print(f"Loading files into {staging_table} using {workers} workers")
+    start_time = perf_counter()
+    total_rows = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = {executor.submit(load_file, p, staging_table): p for p in youtubefilepaths}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                total_rows += future.result()
+            except Exception as e:
+                print(f"Error writing {futures[future]} to DB")
+                print(e)
+                failed.append(futures[future])
+
+    seconds = perf_counter() - start_time
+    print(f"Loaded {total_rows} rows in {round(seconds, 2)}s ({int(total_rows / max(seconds, 1e-9))} rows/s)")
+    if failed:
+        # Swapping in a table with missing files would silently lose data
+        conn.close()
+        print(f"Failed files: {failed}")
+        print("Stopping before the swap. Fix the errors and rerun the bulk build.")
+        return
+
+    # A partitioned parent holds no rows itself, so it is the partitions that are created unlogged and set logged
+    partitions = get_partitions(conn, staging_table, partition_by) if partition_by else []
+    logged_tables = [f"{new_table}_{suffix}" for suffix, bound, params in partitions] or [new_table]
+
+    column_list = ",".join(db_col_names)
+    run_sql(conn, [
+        f"DROP TABLE IF EXISTS {new_table}",
+        f"""CREATE {"" if partition_by else "UNLOGGED "}TABLE {new_table} (
+    row_id SERIAL,{video_columns_sql},
+    dislike_like_ratio DECIMAL GENERATED ALWAYS AS ((CAST(dislike_count AS DECIMAL)+1.00) / (CAST(like_count AS DECIMAL)+1.00)) STORED
+    ) {partition_clause(partition_by)}""",
+    ] + [
+        (f"CREATE UNLOGGED TABLE {new_table}_{suffix} PARTITION OF {new_table} {bound}", params)
+        for suffix, bound, params in partitions
+    ] + [
+        f"""INSERT INTO {new_table} ({column_list})
+    SELECT DISTINCT ON (id) {column_list} FROM {staging_table}
+    ORDER BY id, fetch_date DESC NULLS LAST""",
+        f"DROP TABLE {staging_table}",
+    ] + [
+        f"ALTER TABLE {t} SET LOGGED" for t in logged_tables
+    ] + [
+        f"DROP TABLE IF EXISTS {video_table_name} CASCADE",
+        f"ALTER TABLE {new_table} RENAME TO {video_table_name}",
+        f"ALTER SEQUENCE {new_table}_row_id_seq RENAME TO {video_table_name}_row_id_seq",
+    ] + [
+        f"ALTER TABLE {new_table}_{suffix} RENAME TO {video_table_name}_{suffix}" for suffix, bound, params in partitions
+    ] + [
+        # Every file is now in the table, so the ledger is rewritten in the same transaction as the swap
+        f"TRUNCATE {ledger_table_name}",
+        (f"INSERT INTO {ledger_table_name} (path) SELECT unnest(%s::TEXT[])", (youtubefilepaths,)),
+    ])
+
+    run_sql(conn, [
+        f"SET max_parallel_maintenance_workers = {workers}",
+        "SET maintenance_work_mem = '1GB'",
+    ] + unique_key_sql(video_table_name, partition_by) + [
+        # Indexes on a partitioned table are built on every partition
+        f"CREATE INDEX idx_views ON {video_table_name}(view_count)",
+        f"CREATE INDEX idx_likes ON {video_table_name}(like_count)",
+        f"CREATE INDEX idx_dislikes ON {video_table_name}(dislike_count)",
+        f"CREATE INDEX idx_dislike_like_ratio ON {video_table_name}(dislike_like_ratio)",
+        f"ANALYZE {video_table_name}",
+    ])
+    conn.close()
+    print("Bulk build completed")
+
+def attach_month(month):
+    """
+    Adds the upload_date partition for a new month (a datetime in that month) to the partitioned video table.
+    Attach the partition before loading the month, otherwise its rows land in the default partition and the attach fails.
+    """
+    if partition_by != "upload_date":
+        raise ValueError("--attach-month needs partition_by: upload_date in config.yml")
+    conn = get_connection()
+    run_sql(conn, attach_month_sql(video_table_name, month))
+    print(f"Partitions of {video_table_name}: {get_partition_names(conn, video_table_name)}")
+    conn.close()
 
 if __name__ == "__main__":
-    verify_video = input("""Type 'yes' if you want to enter video data to database: """)
-    if verify_video.lower() == "yes":
-        print("Beginning video data entry.")
-        get_data_video()
+    parser = argparse.ArgumentParser(description="Load parquet files into the video table.")
+    parser.add_argument("--bulk-build", action="store_true",
+        help="Rebuild the video table from scratch: parallel load into an unlogged staging table, dedupe, swap, then index.")
+    parser.add_argument("--attach-month", type=lambda m: datetime.strptime(m, "%Y-%m"), default=None,
+        help="Add the partition for a new month (YYYY-MM) to a video table partitioned by upload_date, then exit.")
+    parser.add_argument("--workers", type=int, default=load_workers, help="Number of parallel workers, each loading whole files over its own connection.")
+    args = parser.parse_args()
+
+    if args.attach_month is not None:
+        attach_month(args.attach_month)
+    elif args.bulk_build:
+        verify_video = input("""Type 'yes' if you want to replace the video table with a bulk build of all parquet files: """)
+        if verify_video.lower() == "yes":
+            print("Beginning bulk build.")
+            bulk_build(workers=args.workers)
+        else:
+            print("Skipping bulk build.")
     else:
-        print("Skipping video data entry.")
+        verify_video = input("""Type 'yes' if you want to enter video data to database: """)
+        if verify_video.lower() == "yes":
+            print("Beginning video data entry.")
+            get_data_video(workers=args.workers)
+        else:
+            print("Skipping video data entry.")
@@ -63,9 +63,16 @@ def run_script(start_from, should_convert_to_text_file,csv_filename):
     COMMENTS_DOWNLOAD_PATH_CSV = os.path.join(ROOT_DIR,f"data/processed/comments_csv/")
 
 
+    # Exports written by export_training_sets.py are parquet files with the same name
+    ORIGINAL_PARQUET_PATH = os.path.join(ROOT_DIR,f"data/processed/{csv_filename}.parquet")
+
     if (should_convert_to_text_file == 'y') or (should_convert_to_text_file == 'yes'):
-        print(f"Opening {csv_filename}.csv")
-        df = pd.read_csv(ORIGINAL_CSV_PATH)['id']
+        if os.path.exists(ORIGINAL_PARQUET_PATH):
+            print(f"Opening {csv_filename}.parquet")
+            df = pd.read_parquet(ORIGINAL_PARQUET_PATH, columns=['id'])['id']
+        else:
+            print(f"Opening {csv_filename}.csv")
+            df = pd.read_csv(ORIGINAL_CSV_PATH, usecols=['id'])['id']
         
         with open(VIDEO_IDS_LIST_PATH, 'w') as file:
             for id in list(df):
@@ -1,54 +1,249 @@
 # This file is a wrapper to download files from the internet archive.
-# It is specifically coded to download files from the youtube 2019-02, 
+# It is specifically coded to download files from the youtube 2019-02,
 # but could be adapted to other archives with some simple adjustments to the tar file names.
 
 # Iterates through urls and downloads tars
 # Example url is https://archive.org/download/Youtube_metadata_02_2019/0000.tar
 
-# Based on code from stack overflow
+# Several tars are downloaded at the same time. Unfinished downloads are kept as .part files and resumed
+# with HTTP Range requests, and every finished tar is checked against the size and md5 listed in the archive.org
+# file manifest before it is renamed to .tar and recorded in a json ledger.
+# The base url can be pointed at a local http server (e.g. python -m http.server) for testing.
 
-import wget
-import glob
-import ssl
+import argparse
+import hashlib
+import json
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
 import yaml
 import os
 
 ROOT_DIR = os.path.abspath(os.curdir)
 config_path = os.path.join(ROOT_DIR,"config.yml")
 
+baseurl = "https://archive.org/download/Youtube_metadata_02_2019/"
 
-def downloadtars():
+# archive.org lists the size and checksums of every file of an item in <item>_files.xml
+manifest_name = "Youtube_metadata_02_2019_files.xml"
+
+# Ledger of verified downloads, rewritten after every finished tar.
+ledger_path = os.path.join(ROOT_DIR,"data/interim/download_ledger.json")
+ledger_lock = threading.Lock()
+
+# Size of the pieces streamed to disk per read.
+download_chunk_size = 1024 * 1024
+
+def get_tar_names(numfiles=5000):
+    """
+    Returns the names of the tars we download.
+    Due to the enormous amount of data, we will only download every 5th file to get a more diverse but large dataset
+    """
+    return [str(i).zfill(4) + ".tar" for i in range(numfiles) if i % 5 == 0]
+
+def get_manifest(session, baseurl):
+    """
+    Downloads the file manifest of the archive item.
+
+    returns:
+        dict - file name mapped to a dict with its size and md5. Empty if the manifest is not available.
+    """
+    try:
+        response = session.get(baseurl + manifest_name, timeout=60)
+        response.raise_for_status()
+        root = ET.fromstring(response.content)
+    except (requests.RequestException, ET.ParseError) as e:
+        print("Could not load the file manifest. Downloads will not be verified.")
+        print(e)
+        return {}
+
+    manifest = {}
+    for f in root.iter("file"):
+        size = f.findtext("size")
+        manifest[f.get("name")] = {
+            "size": int(size) if size else None,
+            "md5": f.findtext("md5"),
+        }
+    return manifest
+
+def load_ledger():
+    try:
+        with open(ledger_path) as f:
+            return json.load(f)
+    except (OSError, IOError, ValueError) as e:
+        return {}
+
+def record_download(ledger, name, entry):
+    """
+    Adds a verified tar to the ledger and writes it to disk.
+    The ledger is written to a temporary file and renamed so a killed run cannot corrupt it.
+    """
+    with ledger_lock:
+        ledger[name] = entry
+        tmp_path = ledger_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(ledger, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, ledger_path)
+
+def md5sum(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(download_chunk_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+def verify_file(path, expected):
+    """
+    Checks a downloaded file against its manifest entry. Size is checked first since it is free.
+
+    returns:
+        bool - True if the file matches, or if there is nothing to check against
+    """
+    if expected.get("size") is not None and os.path.getsize(path) != expected["size"]:
+        return False
+    if expected.get("md5") and md5sum(path) != expected["md5"]:
+        return False
+    return True
+
+def download_file(session, url, part_path, expected_size=None, retries=5):
+    """
+    Downloads a url into part_path, resuming from the bytes already in part_path with a Range request.
+    Retries with a growing wait if the connection drops, or if the body ends before expected_size bytes.
+    Only attempts that receive no new bytes count towards retries.
+    """
+    attempt = 0
+    while attempt < retries:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if expected_size is not None and offset >= expected_size:
+            return
+
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=60) as response:
+                # 416 means we already have every byte
+                if response.status_code == 416:
+                    return
+                response.raise_for_status()
+
+                # The server ignored the range, so start again from the beginning
+                if offset and response.status_code != 206:
+                    offset = 0
+
+                with open(part_path, "ab" if offset else "wb") as f:
+                    for block in response.iter_content(download_chunk_size):
+                        f.write(block)
+
+            # Some versions of urllib3 do not check the length of the body, so a dropped connection can end the stream early
+            size = os.path.getsize(part_path)
+            if expected_size is None or size >= expected_size:
+                return
+            error = f"body ended at {size} of {expected_size} bytes"
+        except requests.RequestException as e:
+            # Missing files and other client errors will not fix themselves
+            if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500:
+                raise
+            error = e
+
+        if os.path.exists(part_path) and os.path.getsize(part_path) > offset:
+            # Bytes were received, so resume straight away
+            attempt = 0
+            wait = 0
+        else:
+            wait = 2 ** attempt
+            attempt += 1
+        print(f"Error downloading {url}, retrying in {wait}s")
+        print(error)
+        time.sleep(wait)
+
+    raise IOError(f"Could not download {url} after {retries} attempts")
+
+def fetch_tar(name, storelocation, baseurl, manifest, ledger, verify_ssl=True):
+    """
+    Downloads and verifies one tar. Runs inside a worker thread.
+
+    returns:
+        str - name of the tar
+    """
+    expected = manifest.get(name, {})
+    fileurl = storelocation + name
+    part_path = fileurl + ".part"
+
+    # Tars from older runs were only checked by name. A partial one is moved back to .part and resumed.
+    if os.path.exists(fileurl):
+        if verify_file(fileurl, expected):
+            record_download(ledger, name, {"size": os.path.getsize(fileurl), "md5": expected.get("md5")})
+            return name
+        print(f"{name} failed verification, resuming it")
+        os.replace(fileurl, part_path)
+
+    session = requests.Session()
+    session.verify = verify_ssl
+
+    durl = baseurl + name
+    print(f"Downloading {durl}")
+    download_file(session, durl, part_path, expected_size=expected.get("size"))
+
+    # An incomplete download is kept so the next run resumes it
+    size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if expected.get("size") is not None and size < expected["size"]:
+        raise IOError(f"{name} is incomplete ({size} of {expected['size']} bytes), rerun to resume it")
+
+    if not verify_file(part_path, expected):
+        # A complete (or too large) download that does not match cannot be resumed, so remove it and let the next run start over
+        os.remove(part_path)
+        raise ValueError(f"{name} does not match the manifest size or md5")
+
+    os.replace(part_path, fileurl)
+    record_download(ledger, name, {"size": os.path.getsize(fileurl), "md5": expected.get("md5")})
+    print(f"Finished downloading {name}")
+    return name
+
+def downloadtars(baseurl=baseurl, storelocation=None, workers=None, numfiles=5000):
 
     # Get config yaml for path variable
     config = yaml.safe_load(open(config_path))
 
-    #get past certificate verified failed issue
-    ssl._create_default_https_context = ssl._create_unverified_context
+    if storelocation is None:
+        storelocation = config["config"]["storepath"]
+    if workers is None:
+        workers = config["config"].get("download_workers", 4)
 
-    print('Beginning file downloads with wget module')
-    numfiles = 5000
-    baseurl = "https://archive.org/download/Youtube_metadata_02_2019/"
-    storelocation = config["config"]["storepath"]
+    # Set verify_ssl: false in config.yml to get past certificate verified failed issue
+    verify_ssl = config["config"].get("verify_ssl", True)
+
+    print('Beginning file downloads')
     print(f"Store Location is: {storelocation}")
 
-    # Check for existing files so we don't redownload the same files
-    existing_file_paths = glob.glob(storelocation+"*.tar")
-    existing_files = [f[-8:-4] for f in existing_file_paths]
-    print(existing_files)
-
-    for i in range(numfiles):
-        # Due to the enormous amount of data, we will only download every 5th file to get a more diverse but large dataset
-        if i % 5 == 0:
-            filenumber = str(i).zfill(4)
-            print(filenumber)
-            if filenumber not in existing_files:
-                durl = baseurl + filenumber + ".tar"
-                print(f"Downloading {durl}")
-                fileurl = storelocation + filenumber + ".tar"
-                wget.download(durl, fileurl)
-                print(f"Finished downloading {filenumber}")
+    session = requests.Session()
+    session.verify = verify_ssl
+    manifest = get_manifest(session, baseurl)
+
+    # Check the ledger for verified files so we don't redownload the same files
+    ledger = load_ledger()
+    pending = [name for name in get_tar_names(numfiles) if not (name in ledger and os.path.exists(storelocation + name))]
+    print(f"{len(pending)} tars to download using {workers} concurrent downloads")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_tar, name, storelocation, baseurl, manifest, ledger, verify_ssl): name for name in pending}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error downloading {futures[future]}")
+                print(e)
+                failed.append(futures[future])
 
+    if failed:
+        print(f"Failed downloads (rerun to resume): {sorted(failed)}")
     print("Finished downloading")
 
 if __name__ == "__main__":
-    downloadtars()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download the archive tars.")
+    parser.add_argument("--baseurl", default=baseurl, help="Base url of the archive item.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of concurrent downloads.")
+    parser.add_argument("--numfiles", type=int, default=5000, help="Number of tars in the archive item.")
+    args = parser.parse_args()
+    downloadtars(baseurl=args.baseurl, workers=args.workers, numfiles=args.numfiles)
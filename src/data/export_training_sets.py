@@ -0,0 +1,284 @@
+# This file exports the training and testing sets (the psql_export_csv.sql exports) in two passes over the parquet files,
+# instead of a full scan of the table per export.
+# 1. The key scan only reads the columns that select the rows (id, fetch_date and the counts of dislike_like_ratio). The keys of
+#    every file (dislike_like_ratio, id, fetch_date, file index and row number) are split by a hash of the id into key_buckets
+#    bucket files in data/interim/export_keys, so every fetch of an id lands in the same bucket. Each bucket is then reduced
+#    to the latest fetch of every id, like the bulk build of dataentry_from_parq.py and the UNIQUE(id) video table, and gives
+#    its candidates for every export at the same time:
+#    - top/bottom K exports keep the K highest or lowest dislike_like_ratio rows of the bucket, which are merged into a running
+#      K row table, so memory is bounded by K and the size of a bucket no matter how many files there are.
+#    - percent samples keep each id with the given probability, like TABLESAMPLE BERNOULLI.
+#    - fixed size samples give each id a random key and keep the K ids with the lowest keys, which is a reservoir sample
+#      that can be merged across buckets the same way as the top K.
+# 2. The row scan reads the full rows of the selected keys from every file holding one of them, so the nested columns of the
+#    other rows are never sent back from the workers.
+#
+# The random keys are hashes of the id, seeded per export, so the samples are the same on every run whatever the order in
+# which workers finish. The exports are written as zstd compressed parquet files with typed columns.
+#
+# Rows and columns are the same as the video table (rows where like_dislike_ratio is inf or NaN are dropped, and the ratios
+# and dislike_like_ratio are calculated), except that row_id is not included and nested columns keep their parquet types.
+
+import argparse
+import glob
+import hashlib
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import yaml
+from tqdm import tqdm
+from archive_schema import db_col_names, db_col_renames, db_source_columns, read_archive_table
+
+ROOT_DIR = os.path.abspath(os.curdir)
+config_path = os.path.join(ROOT_DIR,"config.yml")
+config = yaml.safe_load(open(config_path))
+
+storagepath = config["config"]["storepath"]
+workers = config["config"].get("workers", os.cpu_count())
+processed_path = os.path.join(ROOT_DIR,"data/processed/")
+
+# Keys of the key scan, split by id into key_buckets directories. Removed once the exports are written.
+keys_path = os.path.join(ROOT_DIR,"data/interim/export_keys/")
+key_buckets = 64
+
+# Exports written to data/processed/<name>.parquet.
+# "top" keeps the rows with the highest (descending) or lowest (ascending) dislike_like_ratio,
+# "percent" is a Bernoulli sample and "sample_size" a reservoir sample of a fixed number of rows.
+exports = {
+    "mostdisliked_500000": {"top": 500000, "order": "descending"},
+    "mostliked_500000": {"top": 500000, "order": "ascending"},
+    "random_percent_1": {"percent": 1},
+    "random_percent_point2": {"percent": 0.2},
+}
+
+default_seed = 42
+
+# Columns used to order the candidates. id breaks ties so that the exports are the same on every run.
+sort_column = "dislike_like_ratio"
+sample_key_column = "sample_key"
+
+# Columns of the candidate keys locating every row in its parquet file
+file_column = "file"
+row_column = "row"
+
+# Parquet columns read to select the rows
+key_source_columns = ["id", "fetch_date", "like_count", "dislike_count"]
+
+def prepare_export_table(table):
+    """
+    Turns a parquet table into rows of the video table, keeping the parquet types.
+    """
+    view_count = pc.cast(table["view_count"], pa.float64())
+    like_count = pc.cast(table["like_count"], pa.float64())
+    dislike_count = pc.cast(table["dislike_count"], pa.float64())
+    like_dislike_ratio = pc.divide(like_count, dislike_count)
+    ratios = {
+        "view_like_ratio": pc.cast(pc.divide(view_count, like_count), pa.float32()),
+        "view_dislike_ratio": pc.cast(pc.divide(view_count, dislike_count), pa.float32()),
+        "like_dislike_ratio": pc.cast(like_dislike_ratio, pa.float32()),
+    }
+
+    source_names = {v: k for k, v in db_col_renames.items()}
+    columns = [ratios[name] if name in ratios else table[source_names.get(name, name)] for name in db_col_names]
+    columns.append(pc.divide(pc.add(dislike_count, 1.0), pc.add(like_count, 1.0)))
+    export_table = pa.table(columns, names=db_col_names + [sort_column])
+
+    # Drop inf and NA rows like dataentry_from_parq.py
+    return export_table.filter(pc.is_finite(like_dislike_ratio))
+
+def sample_keys(ids, seed, export_name):
+    """
+    Random keys in [0, 1) of an array of ids for one export. Every fetch of an id gets the same key.
+    """
+    hash_key = hashlib.md5(f"{seed}:{export_name}".encode()).hexdigest()[:16]
+    hashes = pd.util.hash_array(np.asarray(ids, dtype=object), hash_key=hash_key)
+    return (hashes >> np.uint64(11)).astype(np.float64) / 2 ** 53
+
+def dedupe_ids(table):
+    """
+    Keeps one row of every id of a key table, the one with the latest fetch_date.
+    Ties are broken by file and row number so that the same row is kept on every run.
+    """
+    if table.num_rows < 2:
+        return table
+    table = table.take(pc.sort_indices(table, sort_keys=[("id", "ascending"), ("fetch_date", "descending"), (file_column, "descending"), (row_column, "descending")]))
+    ids = table["id"]
+    first = pc.fill_null(pc.not_equal(ids.slice(1), ids.slice(0, table.num_rows - 1)), True)
+    return table.filter(pa.concat_arrays([pa.array([True])] + first.chunks))
+
+def select_k(table, k, sort_keys):
+    """
+    Keeps the first k rows of table in sort_keys order.
+    """
+    if table.num_rows <= k:
+        return table
+    return table.take(pc.select_k_unstable(table, k, sort_keys=sort_keys))
+
+def export_sort_keys(spec):
+    """
+    returns:
+        list - sort keys of a top or reservoir export, or None for a Bernoulli sample
+    """
+    if "top" in spec:
+        return [(sort_column, spec["order"]), ("id", "ascending")]
+    if "sample_size" in spec:
+        return [(sample_key_column, "ascending"), ("id", "ascending")]
+    return None
+
+def export_limit(spec):
+    return spec.get("top", spec.get("sample_size"))
+
+def file_keys(path, file_index):
+    """
+    Reads the columns of one parquet file that select its rows.
+
+    returns:
+        pa.Table - id, fetch_date, dislike_like_ratio, file index and row number of the rows dataentry_from_parq.py keeps
+    """
+    table = read_archive_table(path, columns=key_source_columns)
+    like_count = pc.cast(table["like_count"], pa.float64())
+    dislike_count = pc.cast(table["dislike_count"], pa.float64())
+    keys = pa.table({
+        "id": table["id"],
+        "fetch_date": table["fetch_date"],
+        sort_column: pc.divide(pc.add(dislike_count, 1.0), pc.add(like_count, 1.0)),
+        file_column: pa.array(np.full(table.num_rows, file_index, dtype=np.int32)),
+        row_column: pa.array(np.arange(table.num_rows, dtype=np.int64)),
+    })
+    return keys.filter(pc.is_finite(pc.divide(like_count, dislike_count)))
+
+def id_buckets(ids):
+    """
+    returns:
+        np.ndarray - bucket of every id, the same for every fetch of an id
+    """
+    return (pd.util.hash_array(np.asarray(ids, dtype=object)) % np.uint64(key_buckets)).astype(np.int64)
+
+def write_file_keys(path, file_index, keys_dir):
+    """
+    Key scan of one parquet file. Writes the keys of the latest fetch of every id in the file to the bucket directories.
+
+    returns:
+        int - number of keys written
+    """
+    keys = dedupe_ids(file_keys(path, file_index))
+    buckets = id_buckets(keys["id"])
+    order = np.argsort(buckets, kind="stable")
+    keys, buckets = keys.take(pa.array(order)), buckets[order]
+    for bucket in np.unique(buckets):
+        start, end = np.searchsorted(buckets, [bucket, bucket + 1])
+        pq.write_table(keys.slice(start, end - start), os.path.join(keys_dir, str(bucket), f"{file_index}.parquet"))
+    return keys.num_rows
+
+def bucket_candidates(bucket_dir, seed):
+    """
+    Reduces the keys of one bucket to the latest fetch of every id, then selects its candidate keys for every export.
+
+    returns:
+        dict - export name mapped to the candidate key table of the bucket
+    """
+    keys = dedupe_ids(pa.concat_tables([pq.read_table(p) for p in sorted(glob.glob(os.path.join(bucket_dir, "*.parquet")))]))
+    candidates = {}
+    for name, spec in exports.items():
+        if "percent" in spec:
+            candidates[name] = keys.filter(pa.array(sample_keys(keys["id"], seed, name) < spec["percent"] / 100))
+            continue
+        candidate_table = keys
+        if "sample_size" in spec:
+            candidate_table = keys.append_column(sample_key_column, pa.array(sample_keys(keys["id"], seed, name)))
+        candidates[name] = select_k(candidate_table, export_limit(spec), export_sort_keys(spec))
+    return candidates
+
+def merge_candidates(name, merged, candidates):
+    """
+    Adds the candidates of a bucket to the running key table of an export, keeping at most k ids for top and reservoir exports.
+    Buckets hold different ids, so the merged table has one row per id.
+    """
+    table = candidates if merged is None else pa.concat_tables([merged, candidates])
+    spec = exports[name]
+    sort_keys = export_sort_keys(spec)
+    if sort_keys is None:
+        return table
+    return select_k(table, export_limit(spec), sort_keys)
+
+def file_rows(path, rows):
+    """
+    Reads the full rows of one parquet file at the given row numbers, in that order.
+    """
+    return prepare_export_table(read_archive_table(path, columns=db_source_columns).take(pa.array(rows)))
+
+def row_codes(keys):
+    """
+    Combines the file index and row number of a key table into one int64 per row.
+    """
+    return (keys[file_column].to_numpy().astype(np.int64) << 40) | keys[row_column].to_numpy()
+
+def export_training_sets(seed=default_seed, workers=workers):
+    """
+    Selects the rows of all exports with the key scan, reads their full rows with the row scan and writes the exports.
+    """
+    paths = sorted(glob.glob(storagepath + "parq/*.parquet"))
+    print(f"Exporting {list(exports)} from {len(paths)} files using {workers} workers with seed {seed}")
+
+    start_time = perf_counter()
+    shutil.rmtree(keys_path, ignore_errors=True)
+    bucket_dirs = [os.path.join(keys_path, str(b)) for b in range(key_buckets)]
+    for bucket_dir in bucket_dirs:
+        os.makedirs(bucket_dir)
+
+    merged = {name: None for name in exports}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        print("Key scan")
+        futures = [executor.submit(write_file_keys, p, i, keys_path) for i, p in enumerate(paths)]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+
+        print(f"Selecting rows from {key_buckets} key buckets")
+        futures = [executor.submit(bucket_candidates, d, seed) for d in bucket_dirs if os.listdir(d)]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            for name, candidates in future.result().items():
+                merged[name] = merge_candidates(name, merged[name], candidates)
+
+        selected = {}
+        for name, keys in merged.items():
+            if keys is None:
+                continue
+            # Bernoulli samples are put in a fixed order since files finish in any order
+            sort_keys = export_sort_keys(exports[name]) or [("id", "ascending")]
+            selected[name] = keys.take(pc.sort_indices(keys, sort_keys=sort_keys))
+
+        # Full rows of every selected key, read once per file even if the row is in several exports
+        codes = np.unique(np.concatenate([row_codes(keys) for keys in selected.values()])) if selected else np.array([], dtype=np.int64)
+        files = codes >> 40
+        print(f"Row scan of {len(codes)} selected rows")
+        futures = {}
+        for i in np.unique(files):
+            futures[i] = executor.submit(file_rows, paths[i], codes[files == i] & ((1 << 40) - 1))
+        if futures:
+            rows_table = pa.concat_tables([futures[i].result() for i in sorted(futures)])
+        elif paths:
+            rows_table = prepare_export_table(pq.read_schema(paths[0]).empty_table().select(db_source_columns))
+
+    os.makedirs(processed_path, exist_ok=True)
+    for name, keys in selected.items():
+        table = rows_table.take(pa.array(np.searchsorted(codes, row_codes(keys))))
+        save_path = os.path.join(processed_path, name + ".parquet")
+        tmp_path = save_path + ".tmp"
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, save_path)
+        print(f"Saved {table.num_rows} rows to {save_path}")
+    shutil.rmtree(keys_path, ignore_errors=True)
+    print(f"Exported in {round(perf_counter() - start_time, 2)}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the training and testing sets from the parquet files in two scans.")
+    parser.add_argument("--seed", type=int, default=default_seed, help="Seed of the random samples.")
+    parser.add_argument("--workers", type=int, default=workers, help="Number of worker processes reading parquet files.")
+    args = parser.parse_args()
+    export_training_sets(seed=args.seed, workers=args.workers)
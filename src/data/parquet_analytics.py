@@ -0,0 +1,139 @@
+# This file runs the analytics we used to run in PostgreSQL directly over the parquet files written by combinejson.py,
+# so no database is needed. DuckDB scans the parquet files with multiple threads, only reading the columns
+# a query uses and skipping row groups that cannot match its filters.
+#
+# It creates a video_data view over storepath/parq/*.parquet with the same rows and columns as the video table
+# (rows where like_dislike_ratio is inf or NaN are dropped, only the latest fetch of every id is kept, and the ratios
+# and dislike_like_ratio are calculated), then produces the fulldb_stats.py pickles and the psql_export_csv.sql exports from it.
+
+import argparse
+import os
+from time import perf_counter
+import duckdb
+import pyarrow as pa
+import yaml
+from archive_schema import archive_schema, db_col_names, db_col_renames
+
+ROOT_DIR = os.path.abspath(os.curdir)
+config_path = os.path.join(ROOT_DIR,"config.yml")
+config = yaml.safe_load(open(config_path))
+
+storagepath = config["config"]["storepath"]
+threads = config["config"].get("workers", os.cpu_count())
+
+save_stats_path = os.path.join(ROOT_DIR,"data/interim/fulldb_stats.pickle")
+save_stats_grouped_path = os.path.join(ROOT_DIR,"data/interim/fulldb_stats_grouped.pickle")
+processed_path = os.path.join(ROOT_DIR,"data/processed/")
+
+# Columns of the video table that are not stored in the parquet files.
+calculated_columns = {
+    "view_like_ratio": "CAST(CAST(view_count AS DOUBLE) / like_count AS REAL)",
+    "view_dislike_ratio": "CAST(CAST(view_count AS DOUBLE) / dislike_count AS REAL)",
+    "like_dislike_ratio": "CAST(CAST(like_count AS DOUBLE) / dislike_count AS REAL)",
+}
+
+# Same normalization as the generated dislike_like_ratio column of the video table.
+dislike_like_ratio_sql = "(CAST(dislike_count AS DOUBLE) + 1.00) / (CAST(like_count AS DOUBLE) + 1.00)"
+
+# Exports: file name mapped to the query, as in psql_export_csv.sql. id breaks ties so that the exports are the same on every run,
+# like export_training_sets.py.
+export_queries = {
+    "mostdisliked_500000.csv": "SELECT * FROM video_data ORDER BY dislike_like_ratio DESC, id LIMIT 500000",
+    "mostliked_500000.csv": "SELECT * FROM video_data ORDER BY dislike_like_ratio ASC, id LIMIT 500000",
+    "random_percent_1.csv": "SELECT * FROM video_data USING SAMPLE 1 PERCENT (bernoulli)",
+    "random_percent_point2.csv": "SELECT * FROM video_data USING SAMPLE 0.2 PERCENT (bernoulli)",
+}
+
+stat_columns = ["view_count", "like_count", "dislike_count", "average_rating", "dislike_like_ratio"]
+
+def stats_query(group_by=None):
+    """
+    Builds the fulldb_stats.py query, optionally grouped by a column.
+    """
+    aggregates = ["COUNT(*) AS row_count"]
+    for c in stat_columns:
+        aggregates += [f"MIN({c}) AS {c}_min", f"MAX({c}) AS {c}_max", f"AVG({c}) AS {c}_avg"]
+    if group_by is None:
+        return f"SELECT {', '.join(aggregates)} FROM video_data"
+    return f"SELECT {group_by}, {', '.join(aggregates)} FROM video_data GROUP BY {group_by}"
+
+def get_connection(dedupe=True, threads=threads):
+    """
+    Opens an in-memory DuckDB database with a video_data view over the parquet files.
+    With dedupe, only the latest fetch of each id is kept like the bulk build does, which costs a shuffle of the whole table.
+    Without it, a video fetched more than once has one row per fetch.
+    """
+    conn = duckdb.connect()
+    conn.execute(f"SET threads = {threads}")
+    # Divisions by zero give inf like in postgres and pandas instead of NULL
+    conn.execute("SET ieee_floating_point_ops = true")
+
+    source_names = {v: k for k, v in db_col_renames.items()}
+    columns = []
+    for name in db_col_names:
+        if name in calculated_columns:
+            columns.append(f"{calculated_columns[name]} AS {name}")
+        else:
+            columns.append(f"{source_names.get(name, name)} AS {name}")
+    columns.append(f"{dislike_like_ratio_sql} AS dislike_like_ratio")
+
+    dedupe_sql = "QUALIFY row_number() OVER (PARTITION BY id ORDER BY fetch_date DESC NULLS LAST) = 1" if dedupe else ""
+    conn.execute(f"""CREATE VIEW video_data AS
+    SELECT {", ".join(columns)}
+    FROM read_parquet('{storagepath}parq/*.parquet')
+    WHERE isfinite(CAST(like_count AS DOUBLE) / dislike_count)
+    {dedupe_sql}""")
+    return conn
+
+def csv_columns():
+    """
+    Select list converting video_data columns to the text psql writes: booleans as t/f, and nested columns as json text.
+    """
+    types = {f.name: f.type for f in archive_schema}
+    source_names = {v: k for k, v in db_col_renames.items()}
+    columns = []
+    for name in db_col_names + ["dislike_like_ratio"]:
+        column_type = types.get(source_names.get(name, name))
+        if column_type is not None and pa.types.is_boolean(column_type):
+            columns.append(f"CASE WHEN {name} THEN 't' WHEN NOT {name} THEN 'f' END AS {name}")
+        elif column_type is not None and pa.types.is_nested(column_type):
+            columns.append(f"CAST(to_json({name}) AS VARCHAR) AS {name}")
+        else:
+            columns.append(name)
+    return ", ".join(columns)
+
+def get_stats(conn):
+    """
+    Saves the overall and per category statistics pickles of fulldb_stats.py.
+    """
+    for query, save_path in [(stats_query(), save_stats_path), (stats_query("category"), save_stats_grouped_path)]:
+        start_time = perf_counter()
+        stats_df = conn.execute(query).df()
+        print(stats_df)
+        stats_df.to_pickle(save_path)
+        print(f"Saved {save_path} in {round(perf_counter() - start_time, 2)}s")
+
+def export_csvs(conn):
+    """
+    Writes the psql_export_csv.sql exports to the data/processed folder.
+    """
+    select_list = csv_columns()
+    for file_name, query in export_queries.items():
+        start_time = perf_counter()
+        save_path = os.path.join(processed_path, file_name)
+        conn.execute(f"COPY (SELECT {select_list} FROM ({query})) TO '{save_path}' (FORMAT csv, HEADER)")
+        print(f"Saved {save_path} in {round(perf_counter() - start_time, 2)}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the database statistics and exports directly over the parquet files.")
+    parser.add_argument("--stats", action="store_true", help="Save the fulldb_stats.py pickles.")
+    parser.add_argument("--export", action="store_true", help="Save the psql_export_csv.sql csv files.")
+    parser.add_argument("--no-dedupe", action="store_true", help="Keep every fetch of an id instead of only the latest one like the database. Faster, but repeat fetches are counted and exported more than once.")
+    parser.add_argument("--threads", type=int, default=threads, help="Number of threads used by DuckDB.")
+    args = parser.parse_args()
+
+    conn = get_connection(dedupe=not args.no_dedupe, threads=args.threads)
+    if args.stats or not args.export:
+        get_stats(conn)
+    if args.export or not args.stats:
+        export_csvs(conn)
@@ -1,7 +1,12 @@
 -- These scripts were entered through psql to export csv files for analysis and model training / testing purposes.
+-- export_training_sets.py now produces the same sets as parquet files in two passes over the parquet files (a key scan, then a row scan of the selected rows), and is what runpipeline.sh runs.
 -- If there is an issue with these commands, try replacing \copy with COPY
 -- Make sure your path to save the processed files is correct. Depending on where you run the file from, you may need to adjust it.
 
+-- If the video table is partitioned (partition_by in config.yml), the ORDER BY ... LIMIT exports read the dislike_like_ratio
+-- index of every partition in order and merge them, so they stop after 500k rows instead of sorting the table.
+-- Adding a WHERE on the partition key (see the scoped examples at the end) lets postgres skip the other partitions entirely.
+
 -- SQL Commands through psql are the following:
 -- Most disliked: 
 \copy (SELECT * FROM video_data ORDER BY dislike_like_ratio DESC LIMIT 500000) to './data/processed/mostliked500k_new.csv' csv header;
@@ -16,4 +21,9 @@
 \copy (SELECT * FROM video_data TABLESAMPLE BERNOULLI (0.2)) to './data/processed/random_percent_point2.csv' csv header;
 
 -- 10% Random Sample: Only used for exploration, not in the final pipeline.
--- \copy (SELECT * FROM video_data TABLESAMPLE BERNOULLI (10)) to './data/processed/random_percent_10.csv' csv header;
\ No newline at end of file
+-- \copy (SELECT * FROM video_data TABLESAMPLE BERNOULLI (10)) to './data/processed/random_percent_10.csv' csv header;
+
+-- Date or category scoped exports: Only used for exploration, not in the final pipeline.
+-- With partition_by: upload_date only the partitions of 2018 are read, with partition_by: category only the Music partition is read.
+-- \copy (SELECT * FROM video_data WHERE upload_date >= '2018-01-01' AND upload_date < '2019-01-01' ORDER BY dislike_like_ratio DESC LIMIT 500000) to './data/processed/mostdisliked_2018.csv' csv header;
+-- \copy (SELECT * FROM video_data TABLESAMPLE BERNOULLI (1) WHERE category = 'Music') to './data/processed/random_percent_1_music.csv' csv header;
@@ -0,0 +1,134 @@
+# This file builds the SQL for a partitioned video table.
+# With partition_by set in config.yml, the bulk build in dataentry_from_parq.py creates the video table partitioned by
+# upload_date (range partitions) or category (list partitions). Indexes are created on the parent table, so every partition
+# gets its own, and postgres can skip partitions for date or category scoped queries and aggregate each partition on its own.
+#
+# upload_date partitions hold one year each, except for the latest year which has one partition per month, so that
+# adding a new month of data only means attaching one more partition (dataentry_from_parq.py --attach-month YYYY-MM).
+# Rows that fit no partition (for example a null upload_date or a new category) go to the default partition.
+
+import re
+from datetime import date
+
+# Partition method used for each supported partition key.
+partition_methods = {"upload_date": "RANGE", "category": "LIST"}
+
+def check_partition_by(partition_by):
+    if partition_by is not None and partition_by not in partition_methods:
+        raise ValueError(f"partition_by must be one of {list(partition_methods)}, not {partition_by}")
+
+def partition_clause(partition_by):
+    """
+    returns:
+        str - PARTITION BY clause for CREATE TABLE, or an empty string if the table is not partitioned
+    """
+    if partition_by is None:
+        return ""
+    return f"PARTITION BY {partition_methods[partition_by]} ({partition_by})"
+
+def unique_key_sql(table_name, partition_by):
+    """
+    Constraints replacing the row_id primary key and unique id of create_video_table.sql.
+    Unique constraints of a partitioned table must include the partition key, so the key is added to both.
+    A primary key would also make the partition key NOT NULL, so plain UNIQUE constraints are used instead.
+
+    returns:
+        list - ALTER TABLE statements
+    """
+    if partition_by is None:
+        return [
+            f"ALTER TABLE {table_name} ADD CONSTRAINT {table_name}_pkey PRIMARY KEY (row_id)",
+            f"ALTER TABLE {table_name} ADD CONSTRAINT {table_name}_id_key UNIQUE (id)",
+        ]
+    return [
+        f"ALTER TABLE {table_name} ADD CONSTRAINT {table_name}_row_id_key UNIQUE (row_id, {partition_by})",
+        f"ALTER TABLE {table_name} ADD CONSTRAINT {table_name}_id_key UNIQUE (id, {partition_by})",
+    ]
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def month_partition(month):
+    """
+    returns:
+        tuple - (suffix, FOR VALUES bound, params) of the partition holding the month of the given date
+    """
+    start = date(month.year, month.month, 1)
+    return (f"m{start:%Y_%m}", f"FOR VALUES FROM ('{start}') TO ('{next_month(start)}')", None)
+
+def date_partitions(min_date, max_date):
+    """
+    One partition per year up to the year of max_date, then one per month of that year.
+    """
+    partitions = []
+    if min_date is not None:
+        for year in range(min_date.year, max_date.year):
+            partitions.append((f"y{year}", f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')", None))
+        for m in range(1, max_date.month + 1):
+            partitions.append(month_partition(date(max_date.year, m, 1)))
+    return partitions
+
+def category_partitions(categories):
+    """
+    One partition per category. Suffixes are the category in lower case with anything but letters and numbers replaced.
+    """
+    partitions = []
+    suffixes = set()
+    for category in sorted(categories):
+        suffix = "c_" + re.sub(r"[^a-z0-9]+", "_", category.lower()).strip("_")
+        while suffix in suffixes:
+            suffix += "_"
+        suffixes.add(suffix)
+        partitions.append((suffix, "FOR VALUES IN (%s)", (category,)))
+    return partitions
+
+def get_partitions(conn, source_table, partition_by):
+    """
+    Works out the partitions needed to hold every row of source_table.
+
+    returns:
+        list - (suffix, FOR VALUES bound, params) tuples, ending with the default partition
+    """
+    with conn.cursor() as cur:
+        if partition_by == "upload_date":
+            cur.execute(f"SELECT MIN(upload_date), MAX(upload_date) FROM {source_table}")
+            partitions = date_partitions(*cur.fetchone())
+        else:
+            cur.execute(f"SELECT DISTINCT category FROM {source_table} WHERE category IS NOT NULL")
+            partitions = category_partitions([row[0] for row in cur.fetchall()])
+    conn.commit()
+    partitions.append(("default", "DEFAULT", None))
+    return partitions
+
+def get_partition_names(conn, table_name):
+    """
+    returns:
+        list - names of the partitions attached to table_name
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass ORDER BY 1", (table_name,))
+        names = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return names
+
+def attach_month_sql(table_name, month):
+    """
+    Statements that add the partition for one month to a table partitioned by upload_date.
+
+    The partition is created as a separate table with the indexes of the parent, then attached. A CHECK constraint
+    matching the bounds lets postgres skip scanning the partition while attaching, and the matching indexes are
+    taken over as partitions of the parent indexes, so no index of the rest of the table is touched.
+
+    returns:
+        list - sql statements
+    """
+    suffix, bound, params = month_partition(month)
+    start = date(month.year, month.month, 1)
+    partition = f"{table_name}_{suffix}"
+    return [
+        f"CREATE TABLE {partition} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING INDEXES)",
+        f"""ALTER TABLE {partition} ADD CONSTRAINT {partition}_bounds
+    CHECK (upload_date IS NOT NULL AND upload_date >= '{start}' AND upload_date < '{next_month(start)}')""",
+        f"ALTER TABLE {table_name} ATTACH PARTITION {partition} {bound}",
+        f"ALTER TABLE {partition} DROP CONSTRAINT {partition}_bounds",
+    ]
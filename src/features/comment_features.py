@@ -0,0 +1,105 @@
+# This file turns comments into the per-video comment features: the mean votes and mean neg, neu, pos and compound sentiment
+# of the comments of each video. Comments are cleaned and scored a batch at a time and added to running per-video sums and counts,
+# so comment files are streamed from the csv cache (input_loader.py) and memory grows with the number of videos,
+# not the number of comments. The means are the same as grouping all the comments by video_id and taking the mean.
+
+import numpy as np
+import pandas as pd
+from feature_transforms import normalize_text
+from input_loader import comment_types, iter_csv_cached
+from sentiment_engine import polarity_scores
+
+# Comments cleaned and scored at a time
+comment_batch_rows = 500000
+
+# Per-video features, each the mean over the comments of the video
+feature_columns = ["votes", "comment_neg", "comment_neu", "comment_pos", "comment_compound"]
+score_columns = {"comment_neg": "neg", "comment_neu": "neu", "comment_pos": "pos", "comment_compound": "compound"}
+
+def empty_aggregate(capacity=1024):
+    """
+    Running sums and counts of the comment values of every video. index maps each video_id to its row in sums and counts.
+    """
+    return {
+        "index": {},
+        "sums": np.zeros((capacity, len(feature_columns))),
+        "counts": np.zeros((capacity, len(feature_columns)), dtype=np.int64),
+    }
+
+def comment_values(text_cleaned, votes):
+    """
+    Scores cleaned comment text and converts votes to numbers.
+
+    returns:
+        np.ndarray - float64 array with one row per comment and one column per feature_columns entry
+    """
+    scores = polarity_scores(text_cleaned)
+    values = np.empty((len(scores["neg"]), len(feature_columns)))
+    values[:, 0] = pd.to_numeric(votes, errors='coerce')
+    for j, column in enumerate(feature_columns[1:], start=1):
+        values[:, j] = scores[score_columns[column]]
+    return values
+
+def add_comments(aggregate, video_ids, values):
+    """
+    Adds the values of a batch of comments to the sums and counts of their videos. Comments without a video_id are skipped
+    and missing values are not counted, like groupby().mean().
+    """
+    codes, uniques = pd.factorize(np.asarray(video_ids, dtype=object))
+    has_video = codes >= 0
+    codes, values = codes[has_video], values[has_video]
+
+    index = aggregate["index"]
+    positions = np.fromiter((index.setdefault(video_id, len(index)) for video_id in uniques), dtype=np.int64, count=len(uniques))
+    capacity = len(aggregate["sums"])
+    if len(index) > capacity:
+        capacity = max(2 * capacity, len(index))
+        for part in ["sums", "counts"]:
+            grown = np.zeros((capacity, len(feature_columns)), dtype=aggregate[part].dtype)
+            grown[:len(aggregate[part])] = aggregate[part]
+            aggregate[part] = grown
+
+    # Sum the batch per video first, so every video of the batch is updated once
+    valid = ~np.isnan(values)
+    for j in range(len(feature_columns)):
+        aggregate["sums"][positions, j] += np.bincount(codes, weights=np.where(valid[:, j], values[:, j], 0), minlength=len(uniques))
+        aggregate["counts"][positions, j] += np.bincount(codes[valid[:, j]], minlength=len(uniques))
+
+def aggregate_features(aggregate):
+    """
+    returns:
+        df - one row per video_id, sorted by video_id, with the mean of every feature_columns entry
+    """
+    videos = len(aggregate["index"])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = aggregate["sums"][:videos] / aggregate["counts"][:videos]
+    df = pd.DataFrame({"video_id": list(aggregate["index"])})
+    for j, column in enumerate(feature_columns):
+        # Sentiment scores are float32 like the scores of sentiment_engine.py
+        df[column] = means[:, j].astype(np.float32) if column in score_columns else means[:, j]
+    return df.sort_values("video_id").reset_index(drop=True)
+
+def mean_by_video(video_ids, values):
+    """
+    Per-video features of comments that are all in memory.
+    """
+    aggregate = empty_aggregate()
+    add_comments(aggregate, video_ids, values)
+    return aggregate_features(aggregate)
+
+def comment_features_from_files(paths, batch_rows=comment_batch_rows):
+    """
+    Streams comment csv files a batch at a time, cleaning and scoring every comment, into the per-video features.
+
+    returns:
+        df - one row per video_id, sorted by video_id, with the mean of every feature_columns entry
+    """
+    aggregate = empty_aggregate()
+    comments = 0
+    for path in paths:
+        for table in iter_csv_cached(path, comment_types, batch_rows):
+            df = table.to_pandas()
+            add_comments(aggregate, df["video_id"], comment_values(normalize_text(df["text"], lower_first=False), df["votes"]))
+            comments += len(df)
+        print(f"{path} aggregated, {comments} comments of {len(aggregate['index'])} videos so far")
+    return aggregate_features(aggregate)
@@ -1,21 +1,35 @@
 # This script takes in our csv files that were exported as a training and test set from our main dataset from our database.
 # It processes the data and prepares it for model training including type casting, handling NaN or null values, and sentiment analysis features.
 # It will also process comment data that was scraped, perform sentiment analysis on them, and join them with the main dataset as extra features.
+#
+# With --chunked the video exports are processed out of core, in chunks of rows sized to stay under --memory-limit megabytes,
+# and the processed dataframes are appended to parquet files instead of pickled. The training rows are shuffled by seeded random keys
+# in both modes: the chunked mode splits the rows into bucket files by key range and processes the buckets in key order,
+# so both modes give the same rows in the same order.
 
+import argparse
 import pandas as pd
 import numpy as np
-import pickle
 import os
+import resource
+import shutil
 from pathlib import Path
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from input_loader import video_types, read_video_export, iter_video_export, video_table_to_pandas
+from feature_transforms import bool_cols, tf_to_int, category_codes, smooth_view_like_ratio, ohe_ld_score, no_comments_binary, normalize_text
 
 # Vader for sentiment analysis
 import nltk
 nltk.download('vader_lexicon')
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
+from sentiment_engine import polarity_scores
+from comment_features import comment_values, mean_by_video, comment_features_from_files
 
 ROOT_DIR = os.path.abspath(os.curdir)
 
-# Video info csvs. 500K most liked, 500K most disliked, and a 1% random sample.
+# Video info exports. 500K most liked, 500K most disliked, and a 1% random sample.
+# The parquet files written by export_training_sets.py are used if they exist, otherwise the csv files exported with psql.
 mostliked=os.path.join(ROOT_DIR,"data/processed/mostliked_500000.csv")
 mostdisliked=os.path.join(ROOT_DIR,"data/processed/mostdisliked_500000.csv")
 randompct=os.path.join(ROOT_DIR,"data/processed/random_percent_1.csv")
@@ -36,41 +50,29 @@ random_csv_paths = sorted(Path(os.path.join(ROOT_DIR,"data/processed/comments_cs
 training_df_pickle_path = os.path.join(ROOT_DIR,"data/processed/training_df.pkl")
 testing_df_pickle_path = os.path.join(ROOT_DIR,"data/processed/testing_df.pkl")
 
-# Category codes from the Youtube API
-cat_code_dict = {1: 'Film & Animation',
- 2: 'Autos & Vehicles',
- 10: 'Music',
- 15: 'Pets & Animals',
- 17: 'Sports',
- 18: 'Short Movies',
- 19: 'Travel & Events',
- 20: 'Gaming',
- 21: 'Videoblogging',
- 22: 'People & Blogs',
- 23: 'Comedy',
- 24: 'Entertainment',
- 25: 'News & Politics',
- 26: 'Howto & Style',
- 27: 'Education',
- 28: 'Science & Technology',
- 29: 'Nonprofits & Activism',
- 30: 'Movies',
- 31: 'Anime/Animation',
- 32: 'Action/Adventure',
- 33: 'Classics',
- 34: 'Comedy',
- 35: 'Documentary',
- 36: 'Drama',
- 37: 'Family',
- 38: 'Foreign',
- 39: 'Horror',
- 40: 'Sci-Fi/Fantasy',
- 41: 'Thriller',
- 42: 'Shorts',
- 43: 'Shows',
- 44: 'Trailers'}
-
-inv_cat_code_dict = {v: k for k, v in cat_code_dict.items()}
+# Parquet save paths of the chunked mode
+training_df_parquet_path = os.path.join(ROOT_DIR,"data/processed/training_df.parquet")
+testing_df_parquet_path = os.path.join(ROOT_DIR,"data/processed/testing_df.parquet")
+
+# Shuffle buckets of the chunked mode
+bucket_path = os.path.join(ROOT_DIR,"data/interim/data_prep_buckets/")
+
+random_state = 42
+
+# Memory limit of the chunked mode in megabytes
+memory_limit_mb = 4096
+
+# Peak memory of processing a row as a multiple of its size in arrow, measured at 5 to 6 on the exports and rounded up.
+# Covers the pandas copies of the text, the sentiment scores and the merge.
+row_memory_factor = 8
+
+# Rows read at a time when scanning and bucketing the exports
+scan_batch_rows = 100000
+
+
+# Video columns used by prepare_data_for_model. Only these are read from the exports,
+# so bulky columns such as formats and recommended_videos are never parsed.
+video_cols = list(video_types)
 
 def get_main_dfs():
     """
@@ -81,50 +83,53 @@ def get_main_dfs():
     """
     print("Getting dataframes...")
     # Load data into dataframes
-    liked=pd.read_csv(mostliked,engine="python")
-    disliked=pd.read_csv(mostdisliked,engine="python")
-    randompct_df = pd.read_csv(randompct,engine="python")
+    liked=read_video_export(mostliked)
+    disliked=read_video_export(mostdisliked)
+    randompct_df = read_video_export(randompct)
 
     # Combine liked, disliked, and random 1% into one df
     combined_df = pd.concat([liked,disliked,randompct_df])
     
-    # Shuffle combined df
-    combined_df = combined_df.sample(frac=1).reset_index(drop=True)
+    # Shuffle combined df by seeded random keys, drawn in the same order as the chunked mode draws them
+    keys = np.random.default_rng(random_state).random(len(combined_df))
+    combined_df = combined_df.iloc[np.argsort(keys, kind="stable")].reset_index(drop=True)
 
     # Load 0.2% random sample for final testing of models
-    randompctpoint2_df = pd.read_csv(randompctpoint2,engine="python")
+    randompctpoint2_df = read_video_export(randompctpoint2)
 
-    # Load comments df
-    comments_liked_df = pd.read_csv(comments_liked_path,lineterminator='\n')
-    comments_disliked_df = pd.read_csv(comments_disliked_path,lineterminator='\n')
-    comments_random_df = pd.concat([pd.read_csv(r_csv,lineterminator='\n') for r_csv in random_csv_paths],ignore_index=True)
+    print("Dataframes loaded")
 
-    comments_train=pd.concat([comments_liked_df,comments_disliked_df,comments_random_df],ignore_index=True)
+    return combined_df, randompctpoint2_df
 
-    comments_test = pd.read_csv(comments_randompoint2_path,lineterminator='\n')
+def get_comment_features():
+    """
+    Streams the comment csv files into per-video comment features, without loading all the comments at once.
 
-    print("Dataframes loaded")
+    returns:
+        df, df - per-video comment features of the training data and final testing data
+    """
+    print("Processing comments...")
+    comments_train = comment_features_from_files([comments_liked_path,comments_disliked_path] + random_csv_paths)
+
+    comments_test = comment_features_from_files([comments_randompoint2_path])
+
+    print("Comments processed.")
 
-    return combined_df, randompctpoint2_df, comments_train, comments_test
+    return comments_train, comments_test
 
 def find_english(df,only_eng=True):
     """
     Takes in a dataframe, performs vader sentiment analysis on it and outputs sentiment, and filters for english only.
     """
-    df['desc_text'] = df['desc_text'].str.lower()                                                 #Remove capitalization                                            
-    df['desc_text'] = df['desc_text'].str.replace('[^\w\s]','')                                   #Removes extra whitespaces
-    df['desc_text'] = df['desc_text'].str.replace('@[A-Za-z0-9]+', '')                            #Removes any tags using @
-    df['desc_text'] = df['desc_text'].str.replace('\n', '')                                       #Remove newline 
+    df['desc_text'] = normalize_text(df['desc_text'])                                             #Remove capitalization, punctuation, tags using @ and newlines in one pass
 
-    data=pd.DataFrame((df.desc_text)).astype(str)
-    data['scores']=data['desc_text'].apply(SentimentIntensityAnalyzer().polarity_scores)          #Apply Vader Sentiment Analysis
+    scores=polarity_scores(df['desc_text'])                                                       #Apply Vader Sentiment Analysis across worker processes, missing text is scored as "nan"
 
-    data['desc_neu']=data['scores'].apply(lambda score_dict: score_dict['neu'])                        #Extract Neutral Values from dictionary
-    data['desc_neg']=data['scores'].apply(lambda score_dict: score_dict['neg'])                        #Extract Negative Values from dictionary
-    data['desc_pos']=data['scores'].apply(lambda score_dict: score_dict['pos'])                        #Extract Positive Values from dictionary
-    data['desc_compound']=data['scores'].apply(lambda score_dict: score_dict['compound'])              #Extract Compound Values from dictionary
-
-    combined_data=pd.concat([df,data], axis=1).reindex(df.index)                    #Add values back to original dataframe
+    combined_data=df.assign(
+        desc_neu=scores['neu'],                                                                   #Neutral Values
+        desc_neg=scores['neg'],                                                                   #Negative Values
+        desc_pos=scores['pos'],                                                                   #Positive Values
+        desc_compound=scores['compound'])                                                         #Compound Values
 
     # If only eng is true, filter for only english, else return all the data
     if only_eng:
@@ -140,10 +145,7 @@ def clean_comments(df):
     """
     
     df_clean=df[['video_id','votes','text']].copy()                                                #Select necessary columns
-    df_clean['text_cleaned'] = df_clean['text'].str.replace('[^\w\s]','')                    #Removes extra whitespaces
-    df_clean['text_cleaned'] = df_clean['text_cleaned'].str.replace('@[A-Za-z0-9]+', '')     #Removes any tags using @
-    df_clean['text_cleaned'] = df_clean['text_cleaned'].str.replace('\n', '')                #Remove newline punctuation 
-    df_clean['text_cleaned'] = df_clean['text_cleaned'].str.lower()                          #Removes Capitalization             
+    df_clean['text_cleaned'] = normalize_text(df_clean['text'], lower_first=False)          #Removes punctuation, tags using @, newlines and capitalization in one pass
 
     return df_clean
 
@@ -154,94 +156,39 @@ def comment_sentiment(df_clean):
     Groups by video_id using mean and returns the dataframe.
     """
     
-    #Designate Sentiment Analyzer
-    sid = SentimentIntensityAnalyzer()
-    
-    #Ensure Text is in string format
-    text = df_clean['text_cleaned']
-    text = str(text).encode('utf-8')
-    
-    #Apply Sentiment Analyzer to text data, parse out dictionary value to columns
-    df_clean['scores']=df_clean['text_cleaned'].apply(lambda text:sid.polarity_scores(str(text)))
-    df_clean['comment_neg']=df_clean['scores'].apply(lambda score_dict: score_dict['neg'])
-    df_clean['comment_neu']=df_clean['scores'].apply(lambda score_dict: score_dict['neu'])
-    df_clean['comment_pos']=df_clean['scores'].apply(lambda score_dict: score_dict['pos'])
-    df_clean['comment_compound']=df_clean['scores'].apply(lambda score_dict: score_dict['compound'])
-  
-    #Ensure values are in numeric format select necessary columns for analysis 
-    df_clean["votes"] = pd.to_numeric(df_clean["votes"], errors='coerce')
-    df_comm=df_clean[['video_id','votes','comment_neg','comment_neu','comment_pos','comment_compound']]
-  
-    #Group dataframe by video ID taking the mean of the comment values
-    df_comments_all=df_comm.groupby(['video_id']).mean().reset_index()
+    #Apply Sentiment Analyzer to text data across worker processes and convert votes to numbers
+    values = comment_values(df_clean['text_cleaned'], df_clean['votes'])
+
+    #Take the mean of the comment values of every video ID
+    df_comments_all = mean_by_video(df_clean['video_id'], values)
   
     return df_comments_all
 
-def ohe_ld_score(score):
-    """
-    Converts decimal ld_score into categorical -1,0,1
-    """
-    if score <= 0.5:
-        return -1
-    elif score < 0.75:
-        return 0
-    else:
-        return 1
-
-def conv_category(cat_name):
-    """
-    Converts category string to number based on our mapping dict from the youtube api.
-    """
-    try:
-        cat_code = inv_cat_code_dict[cat_name]
-    except:
-        cat_code = 0
-    return cat_code
-
-def smooth_if_0(row):
-    """
-    Creates a smoothed view_like ratio feature to avoid division by zero for a more accurate reflection of the ratio.
-    """
-    if row["like_count"] == 0:
-        vl_ratio = (row["view_count"]+1) / (row["like_count"]+1)
-    else:
-        vl_ratio = row["view_count"] / row["like_count"]
-    return round(vl_ratio,2)
-
 def prepare_data_for_model(df,only_eng=True):
     """
     Takes in a dataframe and performs processing on it to prepare for model training.
     """
     
     # Select columns we are interested in and replace NaN with 0
-    df=df[['id','fetch_date','uploader','upload_date','title','desc_text','category',
-        'duration','age_limit', 'view_count', 'like_count','dislike_count', 
-        'average_rating', 'allow_embed', 'is_crawlable','allow_sub_contrib', 
-        'is_live_content', 'is_ads_enabled','is_comments_enabled',
-        'view_like_ratio', 'view_dislike_ratio','like_dislike_ratio',"dislike_like_ratio"]].replace(np.nan, 0)
-
-    # Convert t,f to 0,1 booleans.
-    df.allow_embed=df.allow_embed.map(dict(t=1, f=0))
-    df.is_crawlable=df.is_crawlable.map(dict(t=1, f=0))
-    df.allow_sub_contrib=df.allow_sub_contrib.map(dict(t=1, f=0))
-    df.is_live_content=df.is_live_content.map(dict(t=1, f=0))
-    df.is_ads_enabled=df.is_ads_enabled.map(dict(t=1, f=0))
-    df.is_comments_enabled=df.is_comments_enabled.map(dict(t=1, f=0))
+    df=df[video_cols].replace(np.nan, 0)
+
+    # Convert t,f (csv exports) or True,False (parquet exports) to 0,1 booleans.
+    for col in bool_cols:
+        df[col] = tf_to_int(df[col])
     df.replace([np.inf, -np.inf], np.nan,inplace=True)
 
-    # Convert category column to pandas category type and then take the code to convert it to a numeric value
-    df["category"] = df["category"].astype('category')
-    df["cat_codes"] = df["category"].apply(conv_category)
+    # Convert category to a numeric value. The column is kept as text since pandas categories would depend on the rows of the dataframe.
+    df["cat_codes"] = category_codes(df["category"])
 
     # Smooth view_like_ratio which helps avoid division by zero.
-    df["view_like_ratio_smoothed"] = df.apply(lambda row: smooth_if_0(row),axis=1)
+    df["view_like_ratio_smoothed"] = smooth_view_like_ratio(df["view_count"], df["like_count"])
 
     # Create like_dislike_score
     df["ld_score"]=(df.like_count/(df.like_count + df.dislike_count))
 
     # Convert like_dislike_score into -1,0,1 categories for negative, neutral, and positive
     # These will be our y values for the models
-    df["ld_score_ohe"] = df["ld_score"].apply(ohe_ld_score)
+    df["ld_score_ohe"] = ohe_ld_score(df["ld_score"])
     
     # Adds sentiment and filters for english
     df = find_english(df,only_eng=only_eng)
@@ -256,16 +203,12 @@ def prepare_data_for_model(df,only_eng=True):
     
     return df
 
-def create_final_dataframe(comment_df,archive_df,only_eng=True):
+def create_final_dataframe(df_comments_all,archive_df,only_eng=True):
     """
-    Processes comment df and archive df into one merged dataframe.
+    Processes archive df and merges it with the per-video comment features (get_comment_features or comment_sentiment).
     
     Returns final merged dataframe
     """
-    df_clean= clean_comments(comment_df)
-    print("Comments cleaned.")
-    df_comments_all= comment_sentiment(df_clean)
-    print("Comments processed.")
     df_archive_all= prepare_data_for_model(archive_df,only_eng=only_eng)
     final_df=df_archive_all.merge(
         df_comments_all,
@@ -273,19 +216,151 @@ def create_final_dataframe(comment_df,archive_df,only_eng=True):
         left_on="id",
         right_on="video_id")
     final_df["NoComments"] = pd.isnull(final_df["comment_compound"])
-    final_df["NoCommentsBinary"] = final_df["NoComments"].apply(lambda x: 1 if x==True else 0)
+    final_df["NoCommentsBinary"] = no_comments_binary(final_df["comment_compound"])
     final_df = final_df.replace(np.nan, 0)
     print("Comments and Archive data merged.")
 
     return final_df
 
+def scan_exports(csv_paths):
+    """
+    Reads the video exports once to count their rows and bytes and find the columns with nulls.
+
+    returns:
+        int, int, set - rows, arrow bytes and columns that have nulls in any of the exports
+    """
+    rows, nbytes, null_cols = 0, 0, set()
+    for csv_path in csv_paths:
+        for table in iter_video_export(csv_path, scan_batch_rows):
+            rows += table.num_rows
+            nbytes += table.nbytes
+            null_cols.update(c for c in table.column_names if table.column(c).null_count)
+    return rows, nbytes, null_cols
+
+def peak_memory_mb():
+    """
+    Peak resident memory of this process in megabytes.
+    """
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+def chunk_rows_for_limit(memory_limit_mb, bytes_per_row):
+    """
+    Rows per chunk that keep the peak memory under the limit, on top of the memory already used (mostly the comment features).
+    """
+    available_mb = memory_limit_mb - peak_memory_mb()
+    if available_mb <= 0:
+        print(f"Already using {peak_memory_mb()}MB, more than the {memory_limit_mb}MB memory limit. Using the smallest chunks.")
+    return max(1000, int(max(available_mb, 0) * 2**20 / (max(bytes_per_row, 1) * row_memory_factor)))
+
+def write_buckets(csv_paths, buckets, bucket_dir, batch_rows=scan_batch_rows):
+    """
+    Draws a shuffle key for every row of the exports, in the same order as get_main_dfs, and writes each row to the bucket
+    file of its key range. Bucket i holds the keys in [i / buckets, (i + 1) / buckets).
+
+    returns:
+        list - bucket file paths in key order
+    """
+    os.makedirs(bucket_dir, exist_ok=True)
+    paths = [os.path.join(bucket_dir, f"bucket_{i}.arrow") for i in range(buckets)]
+    rng = np.random.default_rng(random_state)
+    writers, schema = None, None
+    try:
+        for csv_path in csv_paths:
+            for table in iter_video_export(csv_path, batch_rows):
+                keys = rng.random(table.num_rows)
+                if writers is None:
+                    schema = table.schema.append(pa.field("shuffle_key", pa.float64()))
+                    writers = [pa.ipc.new_file(path, schema) for path in paths]
+                table = table.cast(schema.remove(schema.get_field_index("shuffle_key"))).append_column("shuffle_key", pa.array(keys))
+
+                # Sort the rows by bucket and write each bucket's slice
+                bucket = np.minimum((keys * buckets).astype(np.int64), buckets - 1)
+                order = np.argsort(bucket, kind="stable")
+                bounds = np.searchsorted(bucket[order], np.arange(buckets + 1))
+                table = table.take(order)
+                for i in range(buckets):
+                    if bounds[i + 1] > bounds[i]:
+                        writers[i].write_table(table.slice(bounds[i], bounds[i + 1] - bounds[i]))
+    finally:
+        for writer in writers or []:
+            writer.close()
+    return paths if writers else []
+
+def iter_shuffled_chunks(bucket_paths):
+    """
+    Yields the rows of every bucket sorted by shuffle key, one bucket at a time, removing each bucket file once read.
+    """
+    for path in bucket_paths:
+        table = pa.ipc.open_file(path).read_all()
+        table = table.take(pc.sort_indices(table, sort_keys=[("shuffle_key", "ascending")])).drop_columns(["shuffle_key"])
+        os.remove(path)
+        yield table
+
+def output_schema(table):
+    """
+    Parquet schema of the processed dataframes, from the first chunk. Text columns that are all missing in it are stored as text.
+    """
+    return pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in table.schema], metadata=table.schema.metadata)
+
+def parquet_frame(df):
+    """
+    Missing text is 0 in the processed dataframes. Parquet cannot store it in a text column, so it is stored as a missing value,
+    which read_processed_df in train_model.py turns back into 0.
+    """
+    return df.assign(**{col: df[col].where(df[col].ne(0), None) for col in df.columns[df.dtypes == object]})
+
+def create_final_parquet(df_comments_all, csv_paths, save_path, only_eng=True, shuffle=True, memory_limit_mb=memory_limit_mb):
+    """
+    Processes the video exports in chunks like create_final_dataframe and appends every processed chunk to a parquet file,
+    so only one chunk of the exports is in memory at a time. The rows are shuffled like get_main_dfs if shuffle is True.
+    """
+    rows, nbytes, null_cols = scan_exports(csv_paths)
+    chunk_rows = chunk_rows_for_limit(memory_limit_mb, nbytes / max(rows, 1))
+    print(f"{rows} rows ({round(nbytes / 2**20)}MB in arrow) processed in chunks of {chunk_rows} rows")
+
+    if shuffle:
+        bucket_dir = os.path.join(bucket_path, os.path.splitext(os.path.basename(save_path))[0])
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+        buckets = max(1, -(-rows // chunk_rows))
+        chunks = iter_shuffled_chunks(write_buckets(csv_paths, buckets, bucket_dir, batch_rows=min(chunk_rows, scan_batch_rows)))
+        print(f"Rows shuffled into {buckets} buckets in {bucket_dir}")
+    else:
+        chunks = (table for csv_path in csv_paths for table in iter_video_export(csv_path, chunk_rows))
+
+    tmp_path = save_path + ".tmp"
+    writer = None
+    try:
+        for table in chunks:
+            final_df = create_final_dataframe(df_comments_all, video_table_to_pandas(table, null_cols), only_eng=only_eng)
+            final_table = pa.Table.from_pandas(parquet_frame(final_df), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, output_schema(final_table), compression="zstd")
+            writer.write_table(final_table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        print(f"No rows in {csv_paths}, nothing saved")
+        return
+    os.replace(tmp_path, save_path)
+    if shuffle:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+
+def remove_stale_output(path):
+    """
+    Removes the output of the other mode, so train_model.py never reads a stale file.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
 def data_prep():
     """
     Runs data loading and processing pipeline.
     """
 
     # Get main dfs
-    combined_df, randompctpoint2_df, comments_training_df, comments_testing_df = get_main_dfs()
+    combined_df, randompctpoint2_df = get_main_dfs()
+    comments_training_df, comments_testing_df = get_comment_features()
     print("Retrieved initial dataframes.")
 
     # Process main dfs
@@ -295,15 +370,40 @@ def data_prep():
     print("Processing training data...")
     training_df = create_final_dataframe(comments_training_df,combined_df)
     training_df.to_pickle(training_df_pickle_path)
+    remove_stale_output(training_df_parquet_path)
     print(f"Training dataframe saved to {training_df_pickle_path}")
 
     print("Processing testing data...")
     testing_df = create_final_dataframe(comments_testing_df,randompctpoint2_df,only_eng=False)
     testing_df.to_pickle(testing_df_pickle_path)
+    remove_stale_output(testing_df_parquet_path)
     print(f"Testing dataframe saved to {testing_df_pickle_path}")
 
+def data_prep_chunked(memory_limit_mb=memory_limit_mb):
+    """
+    Runs the data loading and processing pipeline out of core, writing the processed dataframes as parquet files.
+    """
+    comments_training_df, comments_testing_df = get_comment_features()
+
+    print("Processing training data in chunks...")
+    create_final_parquet(comments_training_df, [mostliked, mostdisliked, randompct], training_df_parquet_path, memory_limit_mb=memory_limit_mb)
+    remove_stale_output(training_df_pickle_path)
+    print(f"Training dataframe saved to {training_df_parquet_path}")
+
+    print("Processing testing data in chunks...")
+    create_final_parquet(comments_testing_df, [randompctpoint2], testing_df_parquet_path, only_eng=False, shuffle=False, memory_limit_mb=memory_limit_mb)
+    remove_stale_output(testing_df_pickle_path)
+    print(f"Testing dataframe saved to {testing_df_parquet_path}")
+    print(f"Peak memory: {peak_memory_mb()}MB of the {memory_limit_mb}MB limit")
+
 
 if __name__ == "__main__":
-    data_prep()
+    parser = argparse.ArgumentParser(description="Process the video exports and comments into the training and testing dataframes.")
+    parser.add_argument("--chunked", action="store_true", help="Process the exports out of core in chunks and write parquet files.")
+    parser.add_argument("--memory-limit", type=int, default=memory_limit_mb, help="Memory limit of --chunked in megabytes.")
+    args = parser.parse_args()
+    if args.chunked:
+        data_prep_chunked(memory_limit_mb=args.memory_limit)
+    else:
+        data_prep()
     print("Dataframes ready for model training exported.")
-
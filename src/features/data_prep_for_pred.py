@@ -4,40 +4,29 @@ import pickle
 import os
 from pathlib import Path
 import joblib
+from feature_transforms import smooth_view_like_ratio, normalize_text
 
 random_state = 42
 
 # Vader for sentiment analysis
 import nltk
 nltk.download('vader_lexicon')
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-
-def smooth_if_0(row):
-    """
-    Creates a smoothed view_like ratio feature to avoid division by zero for a more accurate reflection of the ratio.
-    """
-    if row["like_count"] == 0:
-        vl_ratio = (row["view_count"]+1) / (row["like_count"]+1)
-    else:
-        vl_ratio = row["view_count"] / row["like_count"]
-    return round(vl_ratio,2)
+from sentiment_engine import polarity_scores
+from comment_features import comment_values, mean_by_video
 
 def desc_sentiment(df):
     """
     Takes in a dataframe, performs vader sentiment analysis on it and outputs sentiment.
     """
-    df['desc_text'] = df['desc_text'].str.lower()                                                 #Remove capitalization                                            
-    df['desc_text'] = df['desc_text'].str.replace('[^\w\s]','')                                   #Removes extra whitespaces
-    df['desc_text'] = df['desc_text'].str.replace('@[A-Za-z0-9]+', '')                            #Removes any tags using @
-    df['desc_text'] = df['desc_text'].str.replace('\n', '')                                       #Remove newline 
+    df['desc_text'] = normalize_text(df['desc_text'])                                             #Remove capitalization, punctuation, tags using @ and newlines in one pass
 
     data=pd.DataFrame((df.desc_text)).astype(str)
-    data['scores']=data['desc_text'].apply(SentimentIntensityAnalyzer().polarity_scores)          #Apply Vader Sentiment Analysis
+    scores=polarity_scores(data['desc_text'])                                                     #Apply Vader Sentiment Analysis across worker processes
 
-    data['desc_neu']=data['scores'].apply(lambda score_dict: score_dict['neu'])                        #Extract Neutral Values from dictionary
-    data['desc_neg']=data['scores'].apply(lambda score_dict: score_dict['neg'])                        #Extract Negative Values from dictionary
-    data['desc_pos']=data['scores'].apply(lambda score_dict: score_dict['pos'])                        #Extract Positive Values from dictionary
-    data['desc_compound']=data['scores'].apply(lambda score_dict: score_dict['compound'])              #Extract Compound Values from dictionary
+    data['desc_neu']=scores['neu']                                                                #Neutral Values
+    data['desc_neg']=scores['neg']                                                                #Negative Values
+    data['desc_pos']=scores['pos']                                                                #Positive Values
+    data['desc_compound']=scores['compound']                                                      #Compound Values
 
     combined_data=pd.concat([df,data], axis=1).reindex(df.index)                    #Add values back to original dataframe
 
@@ -50,10 +39,7 @@ def clean_comments(df):
     """
     
     df_clean=df[['video_id','votes','text']].copy()                                                #Select necessary columns
-    df_clean['text_cleaned'] = df_clean['text'].str.replace('[^\w\s]','')                    #Removes extra whitespaces
-    df_clean['text_cleaned'] = df_clean['text_cleaned'].str.replace('@[A-Za-z0-9]+', '')     #Removes any tags using @
-    df_clean['text_cleaned'] = df_clean['text_cleaned'].str.replace('\n', '')                #Remove newline punctuation 
-    df_clean['text_cleaned'] = df_clean['text_cleaned'].str.lower()                          #Removes Capitalization             
+    df_clean['text_cleaned'] = normalize_text(df_clean['text'], lower_first=False)          #Removes punctuation, tags using @, newlines and capitalization in one pass
 
     return df_clean
 
@@ -64,26 +50,11 @@ def comment_sentiment(df_clean):
     Groups by video_id using mean and returns the dataframe.
     """
     
-    #Designate Sentiment Analyzer
-    sid = SentimentIntensityAnalyzer()
-    
-    #Ensure Text is in string format
-    text = df_clean['text_cleaned']
-    text = str(text).encode('utf-8')
-    
-    #Apply Sentiment Analyzer to text data, parse out dictionary value to columns
-    df_clean['scores']=df_clean['text_cleaned'].apply(lambda text:sid.polarity_scores(str(text)))
-    df_clean['comment_neg']=df_clean['scores'].apply(lambda score_dict: score_dict['neg'])
-    df_clean['comment_neu']=df_clean['scores'].apply(lambda score_dict: score_dict['neu'])
-    df_clean['comment_pos']=df_clean['scores'].apply(lambda score_dict: score_dict['pos'])
-    df_clean['comment_compound']=df_clean['scores'].apply(lambda score_dict: score_dict['compound'])
-  
-    #Ensure values are in numeric format select necessary columns for analysis 
-    df_clean["votes"] = pd.to_numeric(df_clean["votes"], errors='coerce')
-    df_comm=df_clean[['video_id','votes','comment_neg','comment_neu','comment_pos','comment_compound']]
-  
-    #Group dataframe by video ID taking the mean of the comment values
-    df_comments_all=df_comm.groupby(['video_id']).mean().reset_index()
+    #Apply Sentiment Analyzer to text data across worker processes and convert votes to numbers
+    values = comment_values(df_clean['text_cleaned'], df_clean['votes'])
+
+    #Take the mean of the comment values of every video ID
+    df_comments_all = mean_by_video(df_clean['video_id'], values)
   
     return df_comments_all
 
@@ -97,7 +68,7 @@ def prepare_data_for_pred(df):
     df.replace([np.inf, -np.inf], np.nan,inplace=True)
 
     # Smooth view_like_ratio which helps avoid division by zero.
-    df["view_like_ratio_smoothed"] = df.apply(lambda row: smooth_if_0(row),axis=1)
+    df["view_like_ratio_smoothed"] = smooth_view_like_ratio(df["view_count"], df["like_count"])
     
     # Adds sentiment and filters for english
     df = desc_sentiment(df)
@@ -0,0 +1,120 @@
+# This file holds the feature transforms shared by model training (data_prep_for_model.py), offline prediction
+# (data_prep_for_pred.py) and the webapp (webapp/main_app/prediction_helper.py), so all of them build the same features.
+# Every transform works on whole columns at once with numpy instead of calling a python function per row.
+# The webapp imports this file from src/features (webapp/main_app/__init__.py), so there is one copy of it.
+
+import re
+import numpy as np
+import pandas as pd
+
+# Category codes from the Youtube API
+cat_code_dict = {1: 'Film & Animation',
+ 2: 'Autos & Vehicles',
+ 10: 'Music',
+ 15: 'Pets & Animals',
+ 17: 'Sports',
+ 18: 'Short Movies',
+ 19: 'Travel & Events',
+ 20: 'Gaming',
+ 21: 'Videoblogging',
+ 22: 'People & Blogs',
+ 23: 'Comedy',
+ 24: 'Entertainment',
+ 25: 'News & Politics',
+ 26: 'Howto & Style',
+ 27: 'Education',
+ 28: 'Science & Technology',
+ 29: 'Nonprofits & Activism',
+ 30: 'Movies',
+ 31: 'Anime/Animation',
+ 32: 'Action/Adventure',
+ 33: 'Classics',
+ 34: 'Comedy',
+ 35: 'Documentary',
+ 36: 'Drama',
+ 37: 'Family',
+ 38: 'Foreign',
+ 39: 'Horror',
+ 40: 'Sci-Fi/Fantasy',
+ 41: 'Thriller',
+ 42: 'Shorts',
+ 43: 'Shows',
+ 44: 'Trailers'}
+
+inv_cat_code_dict = {v: k for k, v in cat_code_dict.items()}
+
+# Boolean video columns. The psql csv exports hold them as t/f and the parquet exports as True/False.
+bool_cols = ['allow_embed', 'is_crawlable', 'allow_sub_contrib', 'is_live_content', 'is_ads_enabled', 'is_comments_enabled']
+tf_map = {"t": 1, "f": 0, True: 1, False: 0}
+
+# Characters removed by normalize_text: anything that is not a word character or whitespace, and newlines
+removed_chars = re.compile(r"[^\w\s]|\n")
+
+def round_like_python(values, decimals):
+    """
+    Rounds an array the same way as python's round().
+    np.round scales the values before rounding, which can put a value that is almost exactly halfway on the other side,
+    so those few values are rounded again with round() on python floats.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rounded = np.round(values, decimals)
+    scaled = values * 10 ** decimals
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_half.any():
+        rounded[near_half] = [round(float(v), decimals) for v in values[near_half]]
+    return rounded
+
+def smooth_view_like_ratio(view_count, like_count):
+    """
+    Creates a smoothed view_like ratio feature to avoid division by zero for a more accurate reflection of the ratio.
+    Adds 1 to both counts when there are no likes, rounded to 2 decimals.
+    """
+    view_count = np.asarray(view_count, dtype=np.float64)
+    like_count = np.asarray(like_count, dtype=np.float64)
+    no_likes = like_count == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(no_likes, (view_count + 1) / (like_count + 1), view_count / np.where(no_likes, 1, like_count))
+    return round_like_python(ratio, 2)
+
+def ohe_ld_score(score):
+    """
+    Converts decimal ld_score into categorical -1,0,1. NaN scores are 1.
+    """
+    score = np.asarray(score, dtype=np.float64)
+    return np.select([score <= 0.5, score < 0.75], [-1, 0], default=1)
+
+def category_codes(category):
+    """
+    Converts category strings to numbers based on our mapping dict from the youtube api. Unknown categories are 0.
+    """
+    return pd.Series(category).map(inv_cat_code_dict).fillna(0).astype(np.int64).to_numpy()
+
+def tf_to_int(values):
+    """
+    Converts t,f or True,False booleans to 1,0. Anything else becomes NaN.
+    """
+    return pd.Series(values).map(tf_map).to_numpy()
+
+def no_comments_binary(comment_compound):
+    """
+    1 for videos without any comments (no comment sentiment after the merge), else 0.
+    """
+    return pd.isnull(np.asarray(comment_compound, dtype=np.float64)).astype(np.int64)
+
+def normalize_text(values, lower_first=True):
+    """
+    Cleans text for sentiment analysis: lowercases it and removes punctuation (anything that is not a word character or
+    whitespace) and newlines. The @ of tags goes with the punctuation. Values that are not strings become NaN.
+    Descriptions are lowercased before the punctuation is removed and comments after (lower_first=False),
+    which only differs for the few characters that lowercase to characters that are removed.
+
+    returns:
+        np.ndarray - object array of the normalized texts
+    """
+    if lower_first:
+        texts = [removed_chars.sub("", v.lower()) if isinstance(v, str) else np.nan for v in values]
+    else:
+        texts = [removed_chars.sub("", v).lower() if isinstance(v, str) else np.nan for v in values]
+    normalized = np.empty(len(texts), dtype=object)
+    normalized[:] = texts
+    return normalized
@@ -0,0 +1,210 @@
+# This file loads the input files of data_prep_for_model.py.
+# Only the columns prepare_data_for_model and the comment functions use are read, with declared types,
+# and csv files are parsed with the multithreaded pyarrow csv reader.
+# Every parsed csv file is cached as a feather file in data/interim/load_cache, keyed on the path, size and modification
+# time of the csv, so later runs read the cache in seconds and a changed csv is parsed again.
+# Csv files are parsed into the cache a block at a time, and the cache can be read back a batch at a time (iter_csv_cached),
+# so files larger than memory can be streamed. Video exports can be streamed the same way from their parquet or csv file (iter_video_export).
+
+import glob
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+ROOT_DIR = os.path.abspath(os.curdir)
+cache_path = os.path.join(ROOT_DIR,"data/interim/load_cache/")
+
+# Bytes of csv parsed at a time by the pyarrow reader, and rows at a time by the pandas reader
+csv_block_size = 16 << 20
+pandas_chunk_rows = 200000
+
+# Video columns used by prepare_data_for_model and their types.
+# Booleans are exported by psql as t/f. Dates are kept as text like the csv files.
+video_types = {
+    'id': pa.string(),
+    'fetch_date': pa.string(),
+    'uploader': pa.string(),
+    'upload_date': pa.string(),
+    'title': pa.string(),
+    'desc_text': pa.string(),
+    'category': pa.string(),
+    'duration': pa.int64(),
+    'age_limit': pa.int64(),
+    'view_count': pa.int64(),
+    'like_count': pa.int64(),
+    'dislike_count': pa.int64(),
+    'average_rating': pa.float64(),
+    'allow_embed': pa.bool_(),
+    'is_crawlable': pa.bool_(),
+    'allow_sub_contrib': pa.bool_(),
+    'is_live_content': pa.bool_(),
+    'is_ads_enabled': pa.bool_(),
+    'is_comments_enabled': pa.bool_(),
+    'view_like_ratio': pa.float64(),
+    'view_dislike_ratio': pa.float64(),
+    'like_dislike_ratio': pa.float64(),
+    'dislike_like_ratio': pa.float64(),
+}
+
+# Comment columns used by clean_comments and comment_features.py. votes is converted to numbers later on.
+comment_types = {
+    'video_id': pa.string(),
+    'votes': pa.string(),
+    'text': pa.string(),
+}
+
+def arrow_csv_batches(path, column_types):
+    """
+    Parses the columns of column_types from a csv file one block at a time with the pyarrow reader.
+    """
+    reader = pacsv.open_csv(path,
+        read_options=pacsv.ReadOptions(block_size=csv_block_size),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types=column_types,
+            include_columns=list(column_types),
+            true_values=["t"],
+            false_values=["f"],
+            strings_can_be_null=True))
+    for batch in reader:
+        yield batch
+
+def pandas_csv_batches(path, column_types):
+    """
+    Parses the columns of column_types from a csv file in chunks with the pandas reader, using only newlines as line terminators.
+    """
+    bool_cols = [c for c, t in column_types.items() if pa.types.is_boolean(t)]
+    chunks = pd.read_csv(path, lineterminator='\n', usecols=list(column_types), chunksize=pandas_chunk_rows,
+        dtype={c: str for c, t in column_types.items() if pa.types.is_string(t) or pa.types.is_boolean(t)})
+    for df in chunks:
+        for col in bool_cols:
+            df[col] = df[col].map({"t": True, "f": False})
+        yield from pa.Table.from_pandas(df[list(column_types)], schema=pa.schema(column_types.items()), preserve_index=False).to_batches()
+
+def write_batches(file_path, column_types, batches):
+    with pa.ipc.new_file(file_path, pa.schema(column_types.items()), options=pa.ipc.IpcWriteOptions(compression="lz4")) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+def get_csv_cache(path, column_types):
+    """
+    Returns the cache file of a csv file, parsing it into the cache first if the csv is new or has changed.
+    The csv is parsed and written one block at a time, so it never has to fit in memory.
+
+    Comment text can hold carriage returns outside of quotes, which the pyarrow reader treats as line breaks,
+    so files it cannot parse are read with the pandas reader using only newlines as line terminators.
+    """
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{sorted((c, str(t)) for c, t in column_types.items())}"
+    name = os.path.basename(path)
+    cache_file = os.path.join(cache_path, f"{name}.{hashlib.sha1(key.encode()).hexdigest()[:16]}.feather")
+    if os.path.exists(cache_file):
+        return cache_file
+
+    # Remove caches of older versions of the file
+    os.makedirs(cache_path, exist_ok=True)
+    for old_file in glob.glob(os.path.join(cache_path, glob.escape(name) + ".*.feather")):
+        os.remove(old_file)
+    tmp_file = cache_file + ".tmp"
+    try:
+        write_batches(tmp_file, column_types, arrow_csv_batches(path, column_types))
+    except pa.ArrowInvalid as e:
+        print(f"Reading {path} with the pandas reader: {e}")
+        write_batches(tmp_file, column_types, pandas_csv_batches(path, column_types))
+    os.replace(tmp_file, cache_file)
+    return cache_file
+
+def read_csv_cached(path, column_types):
+    """
+    Returns the cached table of a csv file, parsing and caching it first if the csv is new or has changed.
+    """
+    return feather.read_table(get_csv_cache(path, column_types))
+
+def iter_csv_cached(path, column_types, batch_rows):
+    """
+    Yields the cached table of a csv file in tables of about batch_rows rows, reading one record batch of the cache at a time.
+    """
+    with pa.memory_map(get_csv_cache(path, column_types)) as source:
+        reader = pa.ipc.open_file(source)
+        batches, rows = [], 0
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= batch_rows:
+                yield pa.Table.from_batches(batches, schema=reader.schema)
+                batches, rows = [], 0
+        if batches:
+            yield pa.Table.from_batches(batches, schema=reader.schema)
+
+def video_parquet_path(csv_path):
+    """
+    Parquet file of an export written by export_training_sets.py, or None if there is none next to the csv path.
+    """
+    parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+    return parquet_path if os.path.exists(parquet_path) else None
+
+def decode_dictionaries(table):
+    """
+    Turns dictionary encoded columns of the parquet exports, such as category, into plain columns of their values like the csv files.
+    """
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    return table
+
+def read_video_table(csv_path):
+    """
+    Reads the video columns of an export into an arrow table, from its parquet file if there is one next to the csv path.
+    """
+    parquet_path = video_parquet_path(csv_path)
+    if parquet_path:
+        return decode_dictionaries(pq.read_table(parquet_path, columns=list(video_types)))
+    return read_csv_cached(csv_path, video_types)
+
+def iter_video_export(csv_path, batch_rows):
+    """
+    Yields the video columns of an export in tables of about batch_rows rows, from its parquet file if there is one next to the csv path.
+    """
+    parquet_path = video_parquet_path(csv_path)
+    if parquet_path:
+        for batch in pq.ParquetFile(parquet_path).iter_batches(batch_size=batch_rows, columns=list(video_types)):
+            yield decode_dictionaries(pa.Table.from_batches([batch]))
+    else:
+        yield from iter_csv_cached(csv_path, video_types, batch_rows)
+
+def video_table_to_pandas(table, null_cols=()):
+    """
+    Converts video columns to a dataframe. Integer and boolean columns with nulls become float and object columns in pandas,
+    so the columns in null_cols are converted that way even where this table has no nulls. With the columns that have nulls
+    anywhere in an export, every chunk of the export gets the dtypes of the whole export.
+    """
+    df = table.to_pandas()
+    for col in null_cols:
+        col_type = table.schema.field(col).type
+        if pa.types.is_integer(col_type) and df[col].dtype.kind in "iu":
+            df[col] = df[col].astype(np.float64)
+        elif pa.types.is_boolean(col_type) and df[col].dtype == bool:
+            df[col] = df[col].astype(object)
+    return df
+
+def read_video_export(csv_path):
+    """
+    Reads the video columns of an export, from its parquet file if there is one next to the csv path.
+
+    returns:
+        df - dataframe with the columns of video_types
+    """
+    return video_table_to_pandas(read_video_table(csv_path))
+
+def read_comment_csvs(paths):
+    """
+    Reads the comment columns of one or more comment csv files into one dataframe.
+    """
+    tables = [read_csv_cached(p, comment_types) for p in paths]
+    return pa.concat_tables(tables).to_pandas()
@@ -0,0 +1,136 @@
+# This file holds the sentiment cache shared by model training (sentiment_engine.py) and the webapp (webapp/main_app/prediction_helper.py).
+# VADER scores are stored in a sqlite file keyed by a hash of the analyzer version and the cleaned text, so text that was
+# already scored, in an earlier run of data_prep_for_model.py or an earlier webapp request, is read back instead of scored again.
+# Every lookup marks the entries it used, and once the cache holds more than max_entries texts the least recently used ones are removed.
+# The number of entries is kept up to date by triggers in the sentiment_count table, so adding scores does not count the whole cache.
+#
+# The cache file is data/interim/sentiment_cache.sqlite under the current folder, or the SENTIMENT_CACHE_PATH environment variable,
+# so the pipeline and the webapp can point at the same file. Scores of different analyzers (nltk in the pipeline and vaderSentiment
+# in the webapp) never mix since the analyzer version is part of the key.
+# The webapp imports this file from src/features (webapp/main_app/__init__.py), so there is one copy of it.
+
+import hashlib
+import importlib.metadata
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.abspath(os.curdir)
+cache_path = os.environ.get("SENTIMENT_CACHE_PATH", os.path.join(ROOT_DIR, "data/interim/sentiment_cache.sqlite"))
+max_entries = int(os.environ.get("SENTIMENT_CACHE_MAX_ENTRIES", 10000000))
+
+score_keys = ["neg", "neu", "pos", "compound"]
+
+# Keys per select, below the sqlite limit on query parameters
+lookup_batch_size = 900
+
+def as_text(text):
+    """
+    Text that is scored for a value of a text column. Missing values are scored as "nan" like astype(str) does.
+    """
+    if isinstance(text, str):
+        return text
+    return "nan" if pd.isna(text) else str(text)
+
+def analyzer_version(analyzer_class):
+    """
+    Name and installed version of the package of a sentiment analyzer class, such as nltk-3.8.1.
+    """
+    package = analyzer_class.__module__.split(".")[0]
+    return f"{package}-{importlib.metadata.version(package)}"
+
+def text_key(text, version):
+    return hashlib.blake2b(f"{version}\0{text}".encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+def open_cache(path=cache_path):
+    """
+    Opens the cache file, creating it if needed.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS sentiment (
+        key BLOB PRIMARY KEY,
+        neg REAL,
+        neu REAL,
+        pos REAL,
+        compound REAL,
+        last_used INTEGER)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS sentiment_last_used ON sentiment (last_used)")
+
+    # Entries are counted by the triggers once sentiment_count has its row. Caches written before it existed are counted once.
+    conn.execute("CREATE TABLE IF NOT EXISTS sentiment_count (entries INTEGER)")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS sentiment_added AFTER INSERT ON sentiment BEGIN UPDATE sentiment_count SET entries = entries + 1; END")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS sentiment_removed AFTER DELETE ON sentiment BEGIN UPDATE sentiment_count SET entries = entries - 1; END")
+    if conn.execute("SELECT entries FROM sentiment_count").fetchone() is None:
+        with conn:
+            conn.execute("INSERT INTO sentiment_count SELECT COUNT(*) FROM sentiment WHERE NOT EXISTS (SELECT 1 FROM sentiment_count)")
+    return conn
+
+def get_scores(conn, keys):
+    """
+    Looks up keys in the cache and marks the ones found as used.
+
+    returns:
+        dict - key mapped to its (neg, neu, pos, compound) scores, for the keys in the cache
+    """
+    found = {}
+    keys = list(dict.fromkeys(keys))
+    for start in range(0, len(keys), lookup_batch_size):
+        batch = keys[start:start + lookup_batch_size]
+        rows = conn.execute(f"SELECT key, neg, neu, pos, compound FROM sentiment WHERE key IN ({','.join('?' * len(batch))})", batch)
+        for row in rows:
+            found[row[0]] = row[1:]
+    now = time.time_ns()
+    conn.executemany("UPDATE sentiment SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+    return found
+
+def put_scores(conn, keys, scores):
+    """
+    Adds scored keys to the cache, then removes the least recently used entries above max_entries.
+    Keys added by another process in the meantime are kept, they hold the same scores.
+    """
+    now = time.time_ns()
+    conn.executemany("INSERT OR IGNORE INTO sentiment VALUES (?, ?, ?, ?, ?, ?)",
+        [(key, *(float(scores[name][i]) for name in score_keys), now) for i, key in enumerate(keys)])
+    entries = conn.execute("SELECT entries FROM sentiment_count").fetchone()[0]
+    if entries > max_entries:
+        conn.execute("DELETE FROM sentiment WHERE key IN (SELECT key FROM sentiment ORDER BY last_used LIMIT ?)", (entries - max_entries,))
+
+def cached_polarity_scores(texts, score_texts, version, path=cache_path):
+    """
+    Scores texts, only calling score_texts for distinct texts that are not in the cache.
+    score_texts takes a list of texts and returns a dict of score_keys entry to an array of scores.
+    If the cache file cannot be used, every text is scored.
+
+    returns:
+        dict - score_keys entry mapped to a float32 array with the score of every text, in the order of texts
+    """
+    texts = [as_text(text) for text in texts]
+    try:
+        conn = open_cache(path)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Sentiment cache {path} not available, scoring without it: {e}")
+        return {name: np.asarray(values, dtype=np.float32) for name, values in score_texts(texts).items()}
+
+    try:
+        keys = [text_key(text, version) for text in texts]
+        with conn:
+            found = get_scores(conn, keys)
+
+        # Score every distinct text that is not cached once
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            new_scores = score_texts(list(missing.values()))
+            with conn:
+                put_scores(conn, list(missing), new_scores)
+            for i, key in enumerate(missing):
+                found[key] = tuple(new_scores[name][i] for name in score_keys)
+        print(f"Sentiment cache: {len(texts) - sum(key in missing for key in keys)} of {len(texts)} texts cached, {len(missing)} scored")
+    finally:
+        conn.close()
+
+    scores = np.array([found[key] for key in keys], dtype=np.float32).reshape(len(keys), len(score_keys))
+    return {name: scores[:, i].copy() for i, name in enumerate(score_keys)}
@@ -0,0 +1,115 @@
+# This file scores text with VADER sentiment analysis across a pool of worker processes.
+# The texts are split into chunks that are handed out to the workers, each holding its own SentimentIntensityAnalyzer,
+# and the scores of every chunk are written straight into preallocated float32 arrays of neg, neu, pos and compound.
+# Inputs of a single chunk, such as the comments of one video, are scored in the calling process.
+# The pool is created on first use and kept for later calls, such as the chunks of data_prep_for_model.py --chunked,
+# so every worker loads the lexicon once per run instead of once per call.
+# Texts scored before are read from the sentiment cache (sentiment_cache.py) and only the rest are sent to the workers.
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+import numpy as np
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+from sentiment_cache import score_keys, as_text, analyzer_version, cached_polarity_scores
+
+sentiment_workers = os.cpu_count()
+
+# Texts per chunk sent to a worker. Large enough that sending the texts costs little next to scoring them.
+chunk_size = 20000
+
+version = analyzer_version(SentimentIntensityAnalyzer)
+
+# Analyzer of this process, created by init_worker
+analyzer = None
+
+# Worker pool of this process and its number of workers, created by get_pool
+pool = None
+pool_workers = None
+
+def init_worker():
+    """
+    Creates the analyzer of a worker process, which loads the VADER lexicon once per worker.
+    """
+    global analyzer
+    analyzer = SentimentIntensityAnalyzer()
+
+def score_chunk(texts):
+    """
+    Scores a list of texts with the analyzer of this process.
+
+    returns:
+        np.ndarray - float32 array with one row per text and one column per score_keys entry
+    """
+    scores = np.empty((len(texts), len(score_keys)), dtype=np.float32)
+    for i, text in enumerate(texts):
+        score_dict = analyzer.polarity_scores(as_text(text))
+        scores[i] = [score_dict[key] for key in score_keys]
+    return scores
+
+def get_pool(workers):
+    """
+    Returns the worker pool, creating it on first use or when another number of workers is asked for.
+    """
+    global pool, pool_workers
+    if pool is None or pool_workers != workers:
+        shutdown_pool()
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        pool_workers = workers
+    return pool
+
+def shutdown_pool():
+    """
+    Stops the worker pool. The next call that needs it starts a new one.
+    """
+    global pool, pool_workers
+    if pool is not None:
+        pool.shutdown()
+    pool, pool_workers = None, None
+
+def score_texts(texts, workers=sentiment_workers, chunk_size=chunk_size):
+    """
+    Scores every text of a list or series, in chunks across workers processes.
+
+    returns:
+        dict - score_keys entry mapped to a float32 array with the score of every text, in the order of texts
+    """
+    texts = list(texts)
+    scores = {key: np.empty(len(texts), dtype=np.float32) for key in score_keys}
+    starts = range(0, len(texts), chunk_size)
+
+    def write_chunk(start, chunk_scores):
+        for i, key in enumerate(score_keys):
+            scores[key][start:start + len(chunk_scores)] = chunk_scores[:, i]
+
+    start_time = perf_counter()
+    if workers <= 1 or len(starts) <= 1:
+        if analyzer is None:
+            init_worker()
+        for start in starts:
+            write_chunk(start, score_chunk(texts[start:start + chunk_size]))
+        return scores
+
+    executor = get_pool(workers)
+    try:
+        futures = {executor.submit(score_chunk, texts[start:start + chunk_size]): start for start in starts}
+        for future in as_completed(futures):
+            write_chunk(futures[future], future.result())
+    except BrokenProcessPool:
+        # A worker died, start a new pool on the next call
+        shutdown_pool()
+        raise
+    print(f"Scored {len(texts)} texts using {workers} workers in {round(perf_counter() - start_time, 2)}s")
+    return scores
+
+def polarity_scores(texts, workers=sentiment_workers, chunk_size=chunk_size, use_cache=True):
+    """
+    Scores every text of a list or series, reading texts scored before from the sentiment cache.
+
+    returns:
+        dict - score_keys entry mapped to a float32 array with the score of every text, in the order of texts
+    """
+    if not use_cache:
+        return score_texts(texts, workers=workers, chunk_size=chunk_size)
+    return cached_polarity_scores(texts, lambda missing: score_texts(missing, workers=workers, chunk_size=chunk_size), version)
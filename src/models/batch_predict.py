@@ -0,0 +1,259 @@
+# This script scores a whole file of videos with the trained model, such as the full archive.
+# The input is a parquet or csv file of videos with an id column: a video export (the columns of input_loader.py), a file
+# with the X_cols features of train_model.py (the processed dataframes), or a mix of both. Features the file does not hold are
+# built from the video columns with the transforms of data_prep_for_model.py (feature_transforms.py and description sentiment
+# through the sentiment cache). Videos without comment features are scored as videos without comments, like in training.
+# The file is read a chunk of rows at a time, so files larger than memory can be scored, and the chunks are built
+# and scored by a pool of worker processes that each load the model once when they start.
+# Forest arrays saved by train_model.py --mmap-export are memory mapped, so the workers share one copy of the model
+# in the page cache. A pickled classifier is loaded into every worker and predicts with n_jobs=1.
+#
+# The predicted class and the probability of every class are written to a parquet file in the order of the input rows,
+# with the id of each row, or its row number if the input has no id column. Throughput is printed as the chunks are written.
+
+import argparse
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import forest_arrays
+from train_model import X_cols, model_pickle_path, model_arrays_path
+
+# The feature transforms and input loaders are in src/features
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "features"))
+from feature_transforms import tf_to_int, category_codes, smooth_view_like_ratio, no_comments_binary, normalize_text
+from input_loader import arrow_csv_batches, decode_dictionaries
+
+# Vader for sentiment analysis
+import nltk
+nltk.download('vader_lexicon')
+from sentiment_engine import polarity_scores
+
+ROOT_DIR = os.path.abspath(os.curdir)
+
+# Predictions of the full archive
+predictions_path = os.path.join(ROOT_DIR,"data/processed/predictions.parquet")
+
+# Rows read and scored at a time
+chunk_rows = 100000
+
+scoring_workers = os.cpu_count()
+
+# Chunks read ahead of the chunk being written, per worker. Bounds the memory of chunks waiting to be scored or written.
+chunks_ahead_per_worker = 2
+
+# Seconds between throughput reports
+progress_seconds = 30
+
+# Video columns that the features missing from the input are built from
+feature_sources = {
+    "view_like_ratio_smoothed": ["view_count", "like_count"],
+    "cat_codes": ["category"],
+    "desc_neu": ["desc_text"],
+    "desc_neg": ["desc_text"],
+    "desc_pos": ["desc_text"],
+    "desc_compound": ["desc_text"],
+}
+
+# Comment features. Inputs without them are scored as videos without comments.
+comment_feature_cols = ["comment_neu", "comment_neg", "comment_pos", "comment_compound", "votes"]
+
+# Boolean features, written as t/f by psql, True/False by pandas or 1/0 in the processed dataframes. Read from csv files as text.
+bool_feature_cols = ["is_comments_enabled", "is_live_content"]
+text_cols = ["category", "desc_text"] + bool_feature_cols
+
+# Model of this worker process, loaded by init_worker
+model = None
+
+def init_worker(model_path):
+    """
+    Loads the model of a worker process.
+    """
+    global model
+    model = forest_arrays.read_model_file(model_path)
+    if hasattr(model, "n_jobs"):
+        model.n_jobs = 1
+
+def model_classes(clf):
+    return clf["classes"] if forest_arrays.is_forest_arrays(clf) else clf.classes_
+
+def build_features(df, id_col):
+    """
+    Builds the X_cols features of a chunk in the steps of prepare_data_for_model and create_final_dataframe,
+    keeping the features the chunk already holds.
+
+    returns:
+        df - float32 dataframe of the X_cols features
+    """
+    df = df.copy()
+    # Videos without comment features have no comments
+    if "NoCommentsBinary" not in df:
+        df["NoCommentsBinary"] = no_comments_binary(df["comment_compound"]) if "comment_compound" in df else 1
+    df = df.fillna({c: 0 for c in df.columns if c != id_col})
+
+    # Convert t,f or True,False to 1,0. Numbers, such as the 1,0 of the processed dataframes, are kept.
+    for col in bool_feature_cols:
+        converted = tf_to_int(df[col]).astype(np.float64)
+        df[col] = np.where(np.isnan(converted), pd.to_numeric(df[col], errors="coerce"), converted)
+    df.replace([np.inf, -np.inf], np.nan, inplace=True)
+
+    if "cat_codes" not in df:
+        df["cat_codes"] = category_codes(df["category"])
+    if "view_like_ratio_smoothed" not in df:
+        df["view_like_ratio_smoothed"] = smooth_view_like_ratio(df["view_count"], df["like_count"])
+    if "desc_compound" not in df:
+        # The workers of this script already run in parallel, so the descriptions are scored in this process
+        scores = polarity_scores(normalize_text(df["desc_text"]), workers=1)
+        for key in ["neu", "neg", "pos", "compound"]:
+            df[f"desc_{key}"] = scores[key]
+    for col in comment_feature_cols:
+        if col not in df:
+            df[col] = 0
+
+    X = np.array(df[X_cols].apply(pd.to_numeric, errors="coerce"), dtype=np.float32)
+    X[~np.isfinite(X)] = 0
+    return pd.DataFrame(X, columns=X_cols)
+
+def score_chunk(table, id_col):
+    """
+    Builds the features of a chunk of rows and scores them with the model of this process.
+
+    returns:
+        np.ndarray, np.ndarray, np.ndarray - the predicted class of every row, its float64 class probabilities and the classes they are in the order of
+    """
+    X = build_features(table.to_pandas(), id_col)
+    if forest_arrays.is_forest_arrays(model):
+        proba = forest_arrays.predict_proba(model, X)
+    else:
+        proba = model.predict_proba(X)
+    classes = np.asarray(model_classes(model))
+    return classes.take(np.argmax(proba, axis=1), axis=0), proba, classes
+
+def input_chunks(input_path, id_col, batch_rows=chunk_rows):
+    """
+    Yields the id column, the features and the video columns of the missing features of a parquet or csv file,
+    in tables of about batch_rows rows. The id column is optional.
+    """
+    if input_path.endswith(".parquet"):
+        names = pq.ParquetFile(input_path).schema_arrow.names
+    else:
+        names = pacsv.open_csv(input_path, parse_options=pacsv.ParseOptions(newlines_in_values=True)).schema.names
+    columns = [id_col] if id_col in names else []
+    missing = []
+    for col in X_cols:
+        if col in names:
+            columns.append(col)
+        elif col in feature_sources and all(source in names for source in feature_sources[col]):
+            columns += [source for source in feature_sources[col] if source not in columns]
+        elif col not in comment_feature_cols + ["NoCommentsBinary"]:
+            missing.append(col + (f" (or {', '.join(feature_sources[col])})" if col in feature_sources else ""))
+    if missing:
+        raise ValueError(f"{input_path} is missing the feature columns {missing}")
+
+    if input_path.endswith(".parquet"):
+        parquet_file = pq.ParquetFile(input_path)
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns):
+            yield decode_dictionaries(pa.Table.from_batches([batch]))
+        return
+
+    # Declared types, so every block of the csv is parsed the same way
+    column_types = {c: pa.string() if c in text_cols or c == id_col else pa.float64() for c in columns}
+    batches, rows = [], 0
+    for batch in arrow_csv_batches(input_path, column_types):
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= batch_rows:
+            yield pa.Table.from_batches(batches)
+            batches, rows = [], 0
+    if batches:
+        yield pa.Table.from_batches(batches)
+
+def output_table(ids, pred, proba, classes):
+    columns = {"id": ids, "prediction": pred}
+    for j, label in enumerate(classes):
+        columns[f"proba_{label}"] = proba[:, j]
+    return pa.table(columns)
+
+def batch_predict(input_path, output_path, model_path, id_col="id", workers=scoring_workers, batch_rows=chunk_rows):
+    """
+    Scores every row of input_path with the model at model_path and writes the predictions to output_path.
+    Chunks are scored in workers processes, or in this process with a single worker.
+
+    returns:
+        int, float - the number of rows scored and the rows per second
+    """
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model {model_path} not found, train it with train_model.py")
+    tmp_path = output_path + ".tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    rows, row_number = 0, 0
+    start_time = perf_counter()
+    last_report = start_time
+    writer = None
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(model_path,)) if workers > 1 else None
+    if executor is None:
+        init_worker(model_path)
+    # Chunks in input order with their ids, scored in the workers while the oldest is written
+    pending = deque()
+    try:
+        def write_oldest():
+            nonlocal writer, rows, last_report
+            ids, result = pending.popleft()
+            pred, proba, classes = result.result() if executor is not None else result
+            table = output_table(ids, pred, proba, classes)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+            rows += len(table)
+            if perf_counter() - last_report >= progress_seconds:
+                last_report = perf_counter()
+                print(f"{rows} rows scored, {round(rows / (last_report - start_time))} rows/s")
+
+        for table in input_chunks(input_path, id_col, batch_rows):
+            if id_col in table.column_names:
+                ids = table.column(id_col).cast(pa.string())
+            else:
+                ids = pa.array(np.arange(row_number, row_number + table.num_rows)).cast(pa.string())
+            row_number += table.num_rows
+            pending.append((ids, executor.submit(score_chunk, table, id_col) if executor is not None else score_chunk(table, id_col)))
+            while len(pending) > chunks_ahead_per_worker * workers:
+                write_oldest()
+        while pending:
+            write_oldest()
+    finally:
+        if executor is not None:
+            # Chunks not scored yet are only left after an error. Drop them instead of scoring them before shutting down.
+            for ids, future in pending:
+                future.cancel()
+            executor.shutdown()
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        pq.write_table(pa.table({"id": pa.array([], pa.string())}), tmp_path)
+    os.replace(tmp_path, output_path)
+    seconds = perf_counter() - start_time
+    print(f"Scored {rows} rows in {round(seconds, 2)}s using {workers} workers ({round(rows / seconds)} rows/s), predictions saved to {output_path}")
+    return rows, rows / seconds
+
+
+if __name__ == "__main__":
+    default_model_path = model_arrays_path if os.path.exists(model_arrays_path) else model_pickle_path
+    parser = argparse.ArgumentParser(description="Score a parquet or csv file of videos with the trained model and save the predictions to parquet.")
+    parser.add_argument("input_path", help="Parquet or csv file of videos: a video export, the X_cols features of train_model.py or a mix of both, with an id column.")
+    parser.add_argument("--output", default=predictions_path, help=f"Parquet file of the predictions. Defaults to {predictions_path}.")
+    parser.add_argument("--model", default=default_model_path,
+        help="Model file. Defaults to the --mmap-export arrays of train_model.py if they exist, else the pickled classifier.")
+    parser.add_argument("--id-column", default="id", help="Column identifying the rows, written with their predictions.")
+    parser.add_argument("--workers", type=int, default=scoring_workers, help="Number of worker processes.")
+    parser.add_argument("--chunk-rows", type=int, default=chunk_rows, help="Rows read and scored at a time.")
+    args = parser.parse_args()
+
+    batch_predict(args.input_path, args.output, args.model, id_col=args.id_column, workers=args.workers, batch_rows=args.chunk_rows)
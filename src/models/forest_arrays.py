@@ -0,0 +1,217 @@
+# This file compiles a trained random forest into compact numpy arrays and predicts from them without scikit-learn.
+# Only the split nodes of the trees are stored, all trees together in one array per field (structure of arrays):
+# the feature (int16) and threshold (float32) of each split and its two children (int32), which point to another split,
+# or for a leaf, to its row of a table of the distinct class distributions of the leaves. A fully grown tree has
+# about as many leaves as splits, so this takes about 15 bytes per split against 88 bytes per node in a pickled forest.
+#
+# The arrays are saved uncompressed with joblib.dump. joblib.load(path, mmap_mode='r') then memory maps them instead of
+# reading them, so the webapp workers share one copy in the page cache and a worker starts without copying the model.
+# A pickled RandomForestClassifier cannot be shared this way: its trees copy the node arrays into their own memory when unpickled.
+#
+# Rows are predicted in batches, walking every (row, tree) pair down one level per step with numpy, so a prediction
+# takes as many steps as the deepest tree instead of a python call per tree. A single row takes well under a millisecond.
+# Large batches walk a few trees at a time so their splits stay in the cpu cache. Predictions are the same as the forest's
+# predict and predict_proba with n_jobs=1, bit for bit:
+# - scikit-learn compares float32 features to float64 thresholds. The float32 threshold is the largest float32 at or
+#   below the float64 one, which splits every float32 value the same way.
+# - The class distributions are kept as float64 and added up in tree order, then divided by the number of trees.
+#
+# The webapp and batch_predict.py load model files with read_model_file. The webapp imports this file from src/models
+# (webapp/main_app/__init__.py), so there is one copy of it.
+
+import joblib
+import numpy as np
+
+forest_format = "forest_arrays"
+forest_format_version = 2
+
+# Rows predicted at a time. Bounds the memory of the (row, tree) arrays.
+predict_batch_rows = 10000
+
+# (row, tree) pairs walked together in a batch
+walk_pairs = 65536
+
+def leaf_distributions(clf, tree):
+    """
+    Class distribution that the predict_proba of a tree returns for each of its nodes.
+    Before scikit-learn 1.4 trees hold weighted class counts, which predict_proba divides by their sum.
+    """
+    import sklearn
+    value = tree.value[:, 0, :clf.n_classes_]
+    if tuple(int(v) for v in sklearn.__version__.split(".")[:2]) >= (1, 4):
+        return value.copy()
+    normalizer = value.sum(axis=1)[:, np.newaxis]
+    normalizer[normalizer == 0.0] = 1.0
+    return value / normalizer
+
+def float32_at_or_below(threshold):
+    """
+    Largest float32 value at or below every float64 threshold.
+    """
+    rounded = threshold.astype(np.float32)
+    above = rounded.astype(np.float64) > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+def compile_forest(clf):
+    """
+    Compiles a fitted single output RandomForestClassifier into arrays. Node references are split indexes,
+    or -1 - i for the leaf class distribution in row i of leaf_proba.
+
+    returns:
+        dict - format fields, classes, feature names, the root of every tree and the split and leaf arrays
+    """
+    trees = [estimator.tree_ for estimator in clf.estimators_]
+    nodes = [tree.__getstate__()["nodes"] for tree in trees]
+    is_split = [n["left_child"] >= 0 for n in nodes]
+    distributions = [leaf_distributions(clf, tree)[~split] for tree, split in zip(trees, is_split)]
+    leaf_proba, leaf_ids = np.unique(np.concatenate(distributions), axis=0, return_inverse=True)
+    leaf_ids = leaf_ids.ravel()
+
+    # Number splits and leaves across all trees, then map every tree's node ids to references
+    split_offsets = np.concatenate([[0], np.cumsum([split.sum() for split in is_split])])
+    leaf_offsets = np.concatenate([[0], np.cumsum([len(d) for d in distributions])])
+    refs = []
+    for split, split_offset, leaf_offset in zip(is_split, split_offsets, leaf_offsets):
+        ref = np.empty(len(split), dtype=np.int64)
+        ref[split] = split_offset + np.arange(split.sum())
+        ref[~split] = -1 - leaf_ids[leaf_offset:leaf_offset + (~split).sum()]
+        refs.append(ref)
+
+    def concat_splits(name):
+        return np.concatenate([n[name][split] for n, split in zip(nodes, is_split)])
+
+    # Left and right child of split i are children[2 * i] and children[2 * i + 1].
+    # The last split is the sink, where apply_forest parks pairs that reached a leaf: it sends every value, even NaN, back to itself.
+    sink = split_offsets[-1]
+    children = np.empty(2 * sink + 2, dtype=np.int32)
+    children[0:-2:2] = np.concatenate([ref[n["left_child"][split]] for n, split, ref in zip(nodes, is_split, refs)])
+    children[1:-2:2] = np.concatenate([ref[n["right_child"][split]] for n, split, ref in zip(nodes, is_split, refs)])
+    children[-2:] = sink
+
+    # Trees fitted before scikit-learn 1.3 have no missing value support, their rows with NaN go right
+    if "missing_go_to_left" in nodes[0].dtype.names:
+        missing_go_to_left = concat_splits("missing_go_to_left").astype(bool)
+    else:
+        missing_go_to_left = np.zeros(sink, dtype=bool)
+
+    return {
+        "format": forest_format,
+        "version": forest_format_version,
+        "classes": np.asarray(clf.classes_),
+        "n_features": int(clf.n_features_in_),
+        "feature_names": list(getattr(clf, "feature_names_in_", [])) or None,
+        "roots": np.array([ref[0] for ref in refs], dtype=np.int32),
+        "sink": int(sink),
+        "feature": np.append(concat_splits("feature"), 0).astype(np.int16),
+        "threshold": np.append(float32_at_or_below(concat_splits("threshold")), np.float32(np.inf)),
+        "children": children,
+        "missing_go_to_left": np.append(missing_go_to_left, True),
+        "leaf_proba": leaf_proba,
+    }
+
+def save_forest_arrays(clf, save_path):
+    """
+    Compiles a forest and saves its arrays uncompressed, so they can be memory mapped.
+    """
+    joblib.dump(compile_forest(clf), save_path)
+
+def load_forest_arrays(path):
+    """
+    Loads saved forest arrays, memory mapping them read only.
+    """
+    forest = joblib.load(path, mmap_mode="r")
+    if not is_forest_arrays(forest):
+        raise ValueError(f"{path} is not a forest arrays file of version {forest_format_version}, export the model again")
+    return forest
+
+def read_model_file(path):
+    """
+    Loads a model file saved by train_model.py: a pickled classifier, or forest arrays, which are memory mapped.
+    joblib only writes uncompressed files, such as the forest arrays, starting with the pickle protocol byte.
+    """
+    with open(path, "rb") as f:
+        uncompressed = f.read(1) == b"\x80"
+    return joblib.load(path, mmap_mode="r" if uncompressed else None)
+
+def is_forest_arrays(model):
+    return isinstance(model, dict) and model.get("format") == forest_format and model.get("version") == forest_format_version
+
+def feature_matrix(forest, X):
+    """
+    Converts the rows to predict to float32 like scikit-learn does. Dataframe columns are put in the order of the training columns.
+    """
+    if forest["feature_names"] is not None and hasattr(X, "columns"):
+        X = X[forest["feature_names"]]
+    X = np.asarray(X, dtype=np.float32)
+    if X.ndim != 2 or X.shape[1] != forest["n_features"]:
+        raise ValueError(f"Expected rows of {forest['n_features']} features, got an array of shape {X.shape}")
+    return X
+
+def plain_arrays(forest):
+    """
+    The forest with its memory mapped arrays viewed as plain arrays, which numpy indexes faster. Nothing is copied.
+    """
+    return {name: np.asarray(value) if isinstance(value, np.ndarray) else value for name, value in forest.items()}
+
+def apply_forest(forest, X, roots):
+    """
+    Walks every row of X down every tree starting at roots, one level per step for all (row, tree) pairs that have not reached a leaf.
+
+    returns:
+        np.ndarray - int array of shape (rows, trees) with the leaf_proba row of the leaf each row reaches in each tree
+    """
+    n_pairs = len(X) * len(roots)
+    leaves = np.empty(n_pairs, dtype=np.int64)
+    values = np.ascontiguousarray(X).ravel()
+    has_nan = np.isnan(values).any()
+    sink = forest["sink"]
+
+    # Pairs being walked: their split, their position in leaves and the offset of their row in values.
+    # Pairs that reach a leaf wait in the sink, and are dropped once they are half of the pairs.
+    split = np.tile(roots, len(X)).astype(np.int64)
+    pair = np.arange(n_pairs)
+    row_offset = np.repeat(np.arange(len(X)) * X.shape[1], len(roots))
+    walking = n_pairs
+    while walking:
+        at_leaf = np.flatnonzero(split < 0)
+        if len(at_leaf):
+            leaves[pair.take(at_leaf)] = -1 - split.take(at_leaf)
+            split[at_leaf] = sink
+            walking -= len(at_leaf)
+            if walking < len(split) // 2:
+                keep = split != sink
+                split, pair, row_offset = split[keep], pair[keep], row_offset[keep]
+            if not walking:
+                break
+        value = values.take(row_offset + forest["feature"].take(split))
+        go_right = value > forest["threshold"].take(split)
+        if has_nan:
+            go_right = np.where(np.isnan(value), ~forest["missing_go_to_left"].take(split), go_right)
+        split = forest["children"].take(2 * split + go_right).astype(np.int64)
+    return leaves.reshape(len(X), len(roots))
+
+def predict_proba(forest, X, batch_rows=predict_batch_rows):
+    """
+    returns:
+        np.ndarray - float64 class probabilities of every row, in the order of forest["classes"]
+    """
+    forest = plain_arrays(forest)
+    X = feature_matrix(forest, X)
+    roots = forest["roots"]
+    proba = np.empty((len(X), len(forest["classes"])), dtype=np.float64)
+    for start in range(0, len(X), batch_rows):
+        batch = X[start:start + batch_rows]
+        # Large batches walk a few trees at a time, whose splits stay in the cpu cache. A single row walks all trees at once.
+        group = max(1, walk_pairs // len(batch))
+        leaves = np.concatenate([apply_forest(forest, batch, roots[i:i + group]) for i in range(0, len(roots), group)], axis=1)
+        # cumsum adds the trees one after the other like the forest does
+        proba[start:start + batch_rows] = np.cumsum(forest["leaf_proba"][leaves], axis=1)[:, -1] / len(roots)
+    return proba
+
+def predict(forest, X, batch_rows=predict_batch_rows):
+    """
+    returns:
+        np.ndarray - predicted class of every row
+    """
+    return forest["classes"].take(np.argmax(predict_proba(forest, X, batch_rows), axis=1), axis=0)
@@ -1,10 +1,10 @@
-import pandas as pd
 import numpy as np
 import pickle
 import os
 from pathlib import Path
 import joblib
 from time import perf_counter
+from train_model import read_processed_df
 
 # For local testing
 X_cols = [
@@ -41,7 +41,7 @@ model_pickle_path = os.path.join(ROOT_DIR,"models/rfclf_nocompression.joblib.pkl
 
 # Test pred df
 testing_df_pickle_path = os.path.join(ROOT_DIR,"data/processed/testing_df.pkl")
-test_pred_df = pd.read_pickle(testing_df_pickle_path).iloc[0].to_frame().T
+test_pred_df = read_processed_df(testing_df_pickle_path).iloc[0].to_frame().T
 test_pred_row = test_pred_df[X_cols]
 test_pred_actual = test_pred_df["ld_score_ohe"].values
 
@@ -7,6 +7,11 @@ import pickle
 import os
 from pathlib import Path
 import joblib
+import argparse
+import itertools
+import tempfile
+from time import perf_counter
+from forest_arrays import save_forest_arrays
 
 from sklearn.metrics import accuracy_score, f1_score, matthews_corrcoef
 from sklearn.ensemble import RandomForestClassifier
@@ -15,13 +20,16 @@ random_state = 42
 
 ROOT_DIR = os.path.abspath(os.curdir)
 
-# Pickle load paths for processed dataframes
+# Pickle load paths for processed dataframes. The parquet files written by data_prep_for_model.py --chunked are used instead if they exist.
 training_df_pickle_path = os.path.join(ROOT_DIR,"data/processed/training_df.pkl")
 testing_df_pickle_path = os.path.join(ROOT_DIR,"data/processed/testing_df.pkl")
 
 # Path to save the model
 model_pickle_path = os.path.join(ROOT_DIR,"models/rfclf.joblib.pkl")
 
+# Path to save the model as memory mappable arrays (--mmap-export), see forest_arrays.py
+model_arrays_path = os.path.join(ROOT_DIR,"models/rfclf_arrays.joblib.pkl")
+
 # Columns of interest
 # Based on what we can get at inference time from the Youtube API or scraping
 X_cols = [
@@ -47,6 +55,37 @@ X_cols = [
 
 y_col = "ld_score_ohe"
 
+# Helps tune the RF to be more accurate for negative videos since that is our main goal.
+class_weight_dict = {-1:0.1,0:1,1:2}
+
+# Forest settings of the saved model, on top of the scikit-learn defaults, such as a variant picked from the --sweep results
+model_params = {}
+
+# Forest settings trained by --sweep, every combination of them. max_depth None grows trees until their leaves are pure,
+# and ccp_alpha prunes every grown tree back with minimal cost-complexity pruning (0.0 keeps the whole tree).
+sweep_grid = {
+    "max_depth": [None, 24, 16],
+    "min_samples_leaf": [1, 5, 20],
+    "n_estimators": [100, 50],
+    "ccp_alpha": [0.0, 1e-5],
+}
+
+# Single rows predicted by --sweep to measure the latency of each model, with n_jobs=1 like the webapp
+sweep_latency_rows = 500
+
+# Table of the --sweep results
+sweep_report_path = os.path.join(ROOT_DIR,"reports/model_sweep.csv")
+
+def read_processed_df(pickle_path):
+    """
+    Reads a processed dataframe, from the parquet file written by data_prep_for_model.py --chunked if there is one next to the pickle path.
+    Missing text is stored as a missing value in the parquet file and turned back into 0 like in the pickled dataframes.
+    """
+    parquet_path = os.path.splitext(pickle_path)[0] + ".parquet"
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path).replace(np.nan, 0)
+    return pd.read_pickle(pickle_path)
+
 def test_model_metrics(clf, model_name,X_test,y_test):
     testpreds = clf.predict(X_test)
     acc = accuracy_score(y_test,testpreds)
@@ -67,6 +106,17 @@ def test_model_metrics(clf, model_name,X_test,y_test):
     print(f"MCC: {mcc}")
     return acc,f1_scores_dict,mcc
 
+def make_classifier(**params):
+    """
+    Random Forest Classifier with our class weights, with params overriding the scikit-learn defaults.
+    """
+    return RandomForestClassifier(
+        n_jobs=-1,
+        random_state=random_state,
+        class_weight = class_weight_dict,
+        **params,
+        )
+
 def train_model(training_df_pickle_path,testing_df_pickle_path,X_cols,y_col):
     """
     Trains a Random Forest Classifier on our training data. Prints out test metrics.
@@ -75,19 +125,12 @@ def train_model(training_df_pickle_path,testing_df_pickle_path,X_cols,y_col):
         RandomForestClassifier - Fit to training data
     """
     print("Loading training and testing dataframes...")
-    training_df = pd.read_pickle(training_df_pickle_path)
-    testing_df = pd.read_pickle(testing_df_pickle_path)
-
-    # Helps tune the RF to be more accurate for negative videos since that is our main goal.
-    class_weight_dict = {-1:0.1,0:1,1:2}
+    training_df = read_processed_df(training_df_pickle_path)
+    testing_df = read_processed_df(testing_df_pickle_path)
 
     print("Training model...")
     # Training model
-    rf_clf = RandomForestClassifier(
-        n_jobs=-1,
-        random_state=random_state,
-        class_weight = class_weight_dict,
-        )
+    rf_clf = make_classifier(**model_params)
     rf_clf.fit(training_df[X_cols],training_df[y_col])
 
     print("Testing performance...")
@@ -96,17 +139,124 @@ def train_model(training_df_pickle_path,testing_df_pickle_path,X_cols,y_col):
 
     return rf_clf
 
-def save_model(clf,save_path):
+def save_model(clf,save_path,mmap_export=False):
     """
     Takes in a classifier object and saves it via joblib.pkl.
     This model can then be loaded to be used at inference time.
+    With mmap_export the forest is saved as uncompressed node arrays instead, which joblib.load(mmap_mode='r')
+    memory maps so every webapp worker shares one copy.
+    """
+    if mmap_export:
+        save_forest_arrays(clf, save_path)
+    else:
+        joblib.dump(clf, save_path, compress=3)
+
+def measure_model(clf,X_test,latency_rows=sweep_latency_rows):
+    """
+    Saves a classifier like save_model and measures what serving it costs: the size of the file and of its --mmap-export arrays,
+    the time to load the file and the latency of single row predictions with n_jobs=1.
+
+    returns:
+        dict - pickle_mb, arrays_mb, load_seconds, p50_ms and p99_ms
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pickle_path = os.path.join(tmp_dir, "model.joblib.pkl")
+        arrays_path = os.path.join(tmp_dir, "arrays.joblib.pkl")
+        save_model(clf,pickle_path)
+        save_model(clf,arrays_path,mmap_export=True)
+        start_time = perf_counter()
+        loaded_clf = joblib.load(pickle_path)
+        load_seconds = perf_counter() - start_time
+        sizes = {"pickle_mb": os.path.getsize(pickle_path) / 1e6, "arrays_mb": os.path.getsize(arrays_path) / 1e6}
+
+    loaded_clf.n_jobs = 1
+    rows = X_test.sample(min(latency_rows, len(X_test)), random_state=random_state)
+    latencies = []
+    for i in range(len(rows)):
+        start_time = perf_counter()
+        loaded_clf.predict(rows.iloc[i:i + 1])
+        latencies.append(perf_counter() - start_time)
+    latencies = np.array(latencies) * 1000
+    return {**sizes, "load_seconds": load_seconds, "p50_ms": np.percentile(latencies, 50), "p99_ms": np.percentile(latencies, 99)}
+
+def pareto_front(results_df, smaller=("pickle_mb", "p99_ms"), larger=("mcc",)):
+    """
+    Marks the variants that no other variant beats: none is as small and fast with an MCC at least as high, and better on one of them.
+
+    returns:
+        np.ndarray - bool array, True for the variants on the Pareto front
+    """
+    costs = np.column_stack([results_df[c] for c in smaller] + [-results_df[c] for c in larger])
+    at_least_as_good = (costs[:, np.newaxis, :] <= costs[np.newaxis, :, :]).all(axis=2)
+    better = (costs[:, np.newaxis, :] < costs[np.newaxis, :, :]).any(axis=2)
+    # dominated[j] if some variant i is at least as good on every column and better on one
+    dominated = (at_least_as_good & better).any(axis=0)
+    return ~dominated
+
+def sweep_models(training_df_pickle_path,testing_df_pickle_path,X_cols,y_col,grid=sweep_grid):
+    """
+    Trains a forest for every combination of the settings in grid and measures its size, load time, latency and test metrics.
+    The combination of the scikit-learn defaults, or else the first one, is the baseline that sizes are compared with.
+
+    returns:
+        df - one row per variant with its settings, measures and test metrics, the size relative to the baseline and whether it is on the Pareto front
     """
-    joblib.dump(clf, save_path, compress=3)
+    print("Loading training and testing dataframes...")
+    training_df = read_processed_df(training_df_pickle_path)
+    testing_df = read_processed_df(testing_df_pickle_path)
+    X_test, y_test = testing_df[X_cols], testing_df[y_col]
+
+    defaults = RandomForestClassifier().get_params()
+    combinations = list(itertools.product(*grid.values()))
+    baseline = next((i for i, values in enumerate(combinations) if all(defaults[name] == value for name, value in zip(grid, values))), 0)
+    results = []
+    for i, values in enumerate(combinations):
+        params = dict(zip(grid, values))
+        print(f"Training variant {i + 1}/{len(combinations)}: {params}")
+        clf = make_classifier(**params)
+        start_time = perf_counter()
+        clf.fit(training_df[X_cols],training_df[y_col])
+        train_seconds = perf_counter() - start_time
+        acc,f1_scores_dict,mcc = test_model_metrics(clf,f"Random Forest {params}",X_test,y_test)
+        results.append({
+            **params,
+            "nodes": sum(estimator.tree_.node_count for estimator in clf.estimators_),
+            "train_seconds": train_seconds,
+            **measure_model(clf,X_test),
+            "accuracy": acc,
+            "f1_weighted": f1_scores_dict.get("f1_weighted", f1_scores_dict.get("f1_binary")),
+            "mcc": mcc,
+        })
+
+    results_df = pd.DataFrame(results)
+    # Keep max_depth None as None instead of NaN
+    for name in grid:
+        results_df[name] = pd.Series([result[name] for result in results], dtype=object)
+    results_df["size_ratio"] = results_df["pickle_mb"][baseline] / results_df["pickle_mb"]
+    results_df["mcc_loss"] = results_df["mcc"][baseline] - results_df["mcc"]
+    results_df["pareto"] = pareto_front(results_df)
+    return results_df.sort_values("pickle_mb").reset_index(drop=True)
 
 
 if __name__ == "__main__":
-    rf_clf = train_model(training_df_pickle_path,testing_df_pickle_path,X_cols,y_col)
-    print("Model finished trained.")
-    print("Saving model...")
-    save_model(rf_clf,model_pickle_path)
-    print("Model saved.")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Train the Random Forest Classifier on the processed dataframes and save it.")
+    parser.add_argument("--mmap-export", action="store_true", help=f"Also save the model as memory mappable arrays to {model_arrays_path}.")
+    parser.add_argument("--sweep", action="store_true",
+        help=f"Instead of saving a model, train every combination of sweep_grid and write their size, latency and test metrics to {sweep_report_path}.")
+    args = parser.parse_args()
+
+    if args.sweep:
+        results_df = sweep_models(training_df_pickle_path,testing_df_pickle_path,X_cols,y_col)
+        os.makedirs(os.path.dirname(sweep_report_path), exist_ok=True)
+        results_df.to_csv(sweep_report_path, index=False)
+        print("Pareto front (smallest file, lowest p99 latency, highest MCC):")
+        print(results_df[results_df["pareto"]].drop(columns="pareto").to_string(index=False, float_format=lambda v: f"{v:.4g}"))
+        print(f"All variants saved to {sweep_report_path}")
+    else:
+        rf_clf = train_model(training_df_pickle_path,testing_df_pickle_path,X_cols,y_col)
+        print("Model finished trained.")
+        print("Saving model...")
+        save_model(rf_clf,model_pickle_path)
+        if args.mmap_export:
+            save_model(rf_clf,model_arrays_path,mmap_export=True)
+        print("Model saved.")
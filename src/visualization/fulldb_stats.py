@@ -1,9 +1,19 @@
 import pandas as pd
 from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
-import psycopg2
 import os
+import sys
 import yaml
+import glob
+import hashlib
+import pickle
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from video_stats import file_state, merge_category_states, stats_dataframes
+
+# The ledger of loaded files is written by dataentry_from_parq.py in src/data
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+from dataentry_from_parq import ledger_table_name
 
 ROOT_DIR = os.path.abspath(os.curdir)
 config_path = os.path.join(ROOT_DIR,"config.yml")
@@ -14,14 +24,74 @@ database = config["config"]["dbname"]
 user = config["config"]["dbuser"]
 pw = config["config"]["dbpw"]
 video_table_name = config["config"]["dbvideotable"]
+port = config["config"].get("dbport", 5432)
 
 save_stats_path = os.path.join(ROOT_DIR,"data/interim/fulldb_stats.pickle")
 save_stats_grouped_path = os.path.join(ROOT_DIR,"data/interim/fulldb_stats_grouped.pickle")
 
+# Partial statistics state of every parquet file, reused as long as the file has not changed.
+states_path = os.path.join(ROOT_DIR,"data/interim/fulldb_stats_states/")
+
+workers = config["config"].get("workers", os.cpu_count())
+
+def get_loaded_paths():
+    """
+    returns:
+        list - parquet paths in the ledger table written by dataentry_from_parq.py, i.e. the files in the video table
+    """
+    engine = create_engine(f'postgresql+psycopg2://{user}:{pw}@{host}:{port}/{database}')
+    with engine.connect() as con:
+        return sorted(pd.read_sql(f"SELECT path FROM {ledger_table_name}", con=con)["path"])
+
+def load_file_state(path):
+    """
+    Returns the saved state of a parquet file, or computes and saves it if the file is new or has changed since.
+    """
+    stat = os.stat(path)
+    state_file = os.path.join(states_path, hashlib.sha1(path.encode()).hexdigest() + ".pickle")
+    try:
+        saved = pickle.load(open(state_file, "rb"))
+        if saved["path"] == path and saved["size"] == stat.st_size and saved["mtime"] == stat.st_mtime:
+            return saved["state"]
+    except (OSError, IOError, EOFError, pickle.UnpicklingError) as e:
+        pass
+
+    state = file_state(path)
+    tmp_file = state_file + ".tmp"
+    pickle.dump({"path": path, "size": stat.st_size, "mtime": stat.st_mtime, "state": state}, open(tmp_file, "wb"))
+    os.replace(tmp_file, state_file)
+    return state
+
+def get_stats(all_files=False, workers=workers):
+    """
+    Computes the same statistics as get_stats_sql in one pass over the parquet files instead of the database,
+    adding quantiles and distinct counts. Only files without a saved state are read, so after loading new files
+    only those are scanned and their states merged with the saved ones.
+    """
+    os.makedirs(states_path, exist_ok=True)
+    if all_files:
+        paths = sorted(glob.glob(config["config"]["storepath"] + "parq/*.parquet"))
+    else:
+        paths = get_loaded_paths()
+    print(f"Merging statistics of {len(paths)} files using {workers} workers")
+
+    category_states = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for state in tqdm(executor.map(load_file_state, paths), total=len(paths)):
+            category_states = merge_category_states(category_states, state)
+
+    stats_df, stats_grouped_df = stats_dataframes(category_states)
+    print(stats_df.T)
+    stats_df.to_pickle(save_stats_path)
+    print("Saved standard stats")
+    print(stats_grouped_df)
+    stats_grouped_df.to_pickle(save_stats_grouped_path)
+    print("Saved grouped by category")
+
 def get_stats_sql():
 
     # Open database connection session
-    engine = create_engine(f'postgresql+psycopg2://{user}:{pw}@{host}:5432/{database}')
+    engine = create_engine(f'postgresql+psycopg2://{user}:{pw}@{host}:{port}/{database}')
 
     query_standard_stats = """
     SELECT COUNT(*) AS row_count, 
@@ -64,12 +134,15 @@ def get_stats_sql():
     FROM video_data
     GROUP BY category;
     """
-    # Open session and read data
+    # Open connection and read data
     print("Attempting to read DB...")
-    with Session(engine) as session:
+    with engine.connect() as con:
+        # If the video table is partitioned (partition_by in config.yml), aggregate each partition separately and combine the results.
+        # With partitions by category the grouped query is answered entirely per partition.
+        con.exec_driver_sql("SET enable_partitionwise_aggregate = on")
         try:
             print("Reading standard stats")
-            stats_df = pd.read_sql(query_standard_stats,con=engine)
+            stats_df = pd.read_sql(query_standard_stats,con=con)
             print(stats_df)
             stats_df.to_pickle(save_stats_path)
             print("Saved standard stats")
@@ -80,7 +153,7 @@ def get_stats_sql():
 
         try:
             print("Reading stats grouped by category")
-            stats_grouped_df = pd.read_sql(query_standard_stats_group_by_category,con=engine)
+            stats_grouped_df = pd.read_sql(query_standard_stats_group_by_category,con=con)
             print(stats_grouped_df)
             stats_grouped_df.to_pickle(save_stats_grouped_path)
             print("Saved grouped by category")
@@ -90,5 +163,14 @@ def get_stats_sql():
             print(e)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate basic statistics on the dataset.")
+    parser.add_argument("--sql", action="store_true", help="Scan the whole video table with sql queries instead of merging per file statistics.")
+    parser.add_argument("--all-files", action="store_true", help="Use every parquet file in the storepath instead of the files in the load_ledger table.")
+    parser.add_argument("--workers", type=int, default=workers, help="Number of worker processes reading parquet files.")
+    args = parser.parse_args()
+
     print("Starting script to generate basic statistics on dataset")
-    get_stats_sql()
+    if args.sql:
+        get_stats_sql()
+    else:
+        get_stats(all_files=args.all_files, workers=args.workers)
@@ -0,0 +1,220 @@
+# This file computes the fulldb_stats.py statistics from the parquet files as mergeable partial states.
+# Each parquet file is read once (only the columns needed) into a state per category holding count/min/max/sum of every metric,
+# a quantile sketch and HyperLogLog registers for distinct counts. States of different files and categories are merged by
+# adding or taking the max of their parts, so the statistics of the whole table come from merging the states of its files,
+# and loading a new file only needs the state of that file.
+#
+# Rows are filtered the same way as dataentry_from_parq.py (rows where like_dislike_ratio is inf or NaN are dropped),
+# but ids are not deduplicated. The video table holds one row per id, while a video fetched more than once is counted here
+# once per fetch, so row_count and the averages and quantiles can differ from the video table. The id_distinct estimate
+# is close to the number of rows of the video table. parquet_analytics.py --stats computes the statistics of one row per id.
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Columns summarized with count/min/max/sum and a quantile sketch, as in the fulldb_stats.py queries.
+metric_columns = ["view_count", "like_count", "dislike_count", "average_rating", "dislike_like_ratio"]
+
+# Columns with an approximate distinct count.
+distinct_columns = ["id", "uploader"]
+
+# Quantiles reported for every metric.
+quantiles = [0.5, 0.9, 0.99]
+
+# Parquet columns read per file.
+stats_source_columns = ["id", "uploader", "category", "view_count", "like_count", "dislike_count", "average_rating"]
+
+# Relative accuracy of the quantile sketch. Values are counted in buckets growing by a factor of gamma,
+# so any quantile is returned within 1% of its true value.
+sketch_accuracy = 0.01
+sketch_gamma = (1 + sketch_accuracy) / (1 - sketch_accuracy)
+sketch_log_gamma = np.log(sketch_gamma)
+
+# HyperLogLog registers per distinct count is 2 ** hll_precision, about 0.8% standard error.
+hll_precision = 14
+
+def empty_state():
+    return {
+        "row_count": 0,
+        "metrics": {c: {"count": 0, "min": np.nan, "max": np.nan, "sum": 0.0, "zeros": 0, "bins": {}} for c in metric_columns},
+        "distinct": {c: np.zeros(2 ** hll_precision, dtype=np.uint8) for c in distinct_columns},
+    }
+
+def bit_length(x):
+    """
+    Number of bits needed to hold each value of a uint64 array.
+    """
+    n = np.zeros(len(x), dtype=np.int64)
+    for s in (32, 16, 8, 4, 2, 1):
+        big = x >= np.uint64(1 << s)
+        n[big] += s
+        x = np.where(big, x >> np.uint64(s), x)
+    return n + (x > 0)
+
+def hll_registers(values):
+    """
+    HyperLogLog registers of an array of strings. The first hll_precision bits of the hash pick the register,
+    which keeps the longest run of leading zeros seen in the remaining bits.
+    """
+    registers = np.zeros(2 ** hll_precision, dtype=np.uint8)
+    if len(values):
+        hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+        rest_bits = 64 - hll_precision
+        index = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        rank = (rest_bits - bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(registers, index, rank)
+    return registers
+
+def hll_estimate(registers):
+    """
+    returns:
+        int - estimated number of distinct values, with the linear counting correction for small counts
+    """
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+def summarize(values):
+    """
+    State of one metric from a float array without nulls.
+    """
+    positive = values[values > 0]
+    bins = {}
+    if len(positive):
+        index, counts = np.unique(np.ceil(np.log(positive) / sketch_log_gamma).astype(np.int64), return_counts=True)
+        bins = dict(zip(index.tolist(), counts.tolist()))
+    return {
+        "count": len(values),
+        "min": values.min() if len(values) else np.nan,
+        "max": values.max() if len(values) else np.nan,
+        "sum": float(values.sum()),
+        "zeros": len(values) - len(positive),
+        "bins": bins,
+    }
+
+def sketch_quantile(metric, q):
+    """
+    Estimated q quantile of a metric state.
+    """
+    if metric["count"] == 0:
+        return np.nan
+    rank = q * (metric["count"] - 1)
+    if rank < metric["zeros"]:
+        return 0.0
+    seen = metric["zeros"]
+    for index in sorted(metric["bins"]):
+        seen += metric["bins"][index]
+        if seen > rank:
+            # Middle of the bucket, clipped to the values actually seen
+            value = 2 * sketch_gamma ** index / (sketch_gamma + 1)
+            return float(min(max(value, metric["min"]), metric["max"]))
+    return float(metric["max"])
+
+def merge_states(a, b):
+    """
+    Merges two states into a new state.
+    """
+    merged = {"row_count": a["row_count"] + b["row_count"], "metrics": {}, "distinct": {}}
+    for c in metric_columns:
+        ma, mb = a["metrics"][c], b["metrics"][c]
+        bins = dict(ma["bins"])
+        for index, count in mb["bins"].items():
+            bins[index] = bins.get(index, 0) + count
+        merged["metrics"][c] = {
+            "count": ma["count"] + mb["count"],
+            "min": np.fmin(ma["min"], mb["min"]),
+            "max": np.fmax(ma["max"], mb["max"]),
+            "sum": ma["sum"] + mb["sum"],
+            "zeros": ma["zeros"] + mb["zeros"],
+            "bins": bins,
+        }
+    for c in distinct_columns:
+        merged["distinct"][c] = np.maximum(a["distinct"][c], b["distinct"][c])
+    return merged
+
+def merge_category_states(a, b):
+    """
+    Merges two dicts of category to state.
+    """
+    merged = dict(a)
+    for category, state in b.items():
+        merged[category] = merge_states(merged[category], state) if category in merged else state
+    return merged
+
+def table_state(table):
+    """
+    Computes the states of an Arrow table with stats_source_columns, after dropping the rows dataentry_from_parq.py drops.
+    Every row is counted, including ids that appear more than once.
+
+    returns:
+        dict - category (None for rows without one) mapped to its state
+    """
+    like_count = pc.cast(table["like_count"], pa.float64())
+    dislike_count = pc.cast(table["dislike_count"], pa.float64())
+    table = table.filter(pc.is_finite(pc.divide(like_count, dislike_count)))
+
+    # Same normalization as the generated dislike_like_ratio column of the video table
+    ratio = pc.divide(pc.add(pc.cast(table["dislike_count"], pa.float64()), 1.0), pc.add(pc.cast(table["like_count"], pa.float64()), 1.0))
+    metrics = {c: ratio if c == "dislike_like_ratio" else pc.cast(table[c], pa.float64()) for c in metric_columns}
+    metrics = {c: v.to_numpy(zero_copy_only=False) for c, v in metrics.items()}
+    distinct = {c: table[c].to_numpy(zero_copy_only=False) for c in distinct_columns}
+
+    categories = pc.cast(table["category"], pa.string()).to_numpy(zero_copy_only=False)
+    codes, names = pd.factorize(categories, use_na_sentinel=True)
+
+    states = {}
+    for code in range(-1, len(names)):
+        rows = codes == code
+        if not rows.any():
+            continue
+        state = {"row_count": int(rows.sum()), "metrics": {}, "distinct": {}}
+        for c in metric_columns:
+            values = metrics[c][rows]
+            state["metrics"][c] = summarize(values[~np.isnan(values)])
+        for c in distinct_columns:
+            values = distinct[c][rows]
+            state["distinct"][c] = hll_registers(values[pd.notna(values)])
+        states[names[code] if code >= 0 else None] = state
+    return states
+
+def file_state(path):
+    """
+    Reads one parquet file and computes its states.
+    """
+    return table_state(pq.read_table(path, columns=stats_source_columns))
+
+def state_row(state):
+    """
+    Flattens a state into the columns of the fulldb_stats.py queries, plus quantiles and distinct counts.
+    """
+    row = {"row_count": state["row_count"]}
+    for c in metric_columns:
+        metric = state["metrics"][c]
+        row[f"{c}_min"] = metric["min"]
+        row[f"{c}_max"] = metric["max"]
+        row[f"{c}_avg"] = metric["sum"] / metric["count"] if metric["count"] else np.nan
+    for c in metric_columns:
+        for q in quantiles:
+            row[f"{c}_p{round(q * 100)}"] = sketch_quantile(state["metrics"][c], q)
+    for c in distinct_columns:
+        row[f"{c}_distinct"] = hll_estimate(state["distinct"][c])
+    return row
+
+def stats_dataframes(category_states):
+    """
+    returns:
+        tuple - (overall stats df with one row, stats df with one row per category)
+    """
+    overall = empty_state()
+    for state in category_states.values():
+        overall = merge_states(overall, state)
+    stats_df = pd.DataFrame([state_row(overall)])
+    stats_grouped_df = pd.DataFrame([{"category": category, **state_row(state)} for category, state in category_states.items()])
+    return stats_df, stats_grouped_df
@@ -0,0 +1,13 @@
+# The webapp builds its features and predicts with modules of the data pipeline, feature_transforms.py and sentiment_cache.py
+# in src/features and forest_arrays.py in src/models, so training and prediction share a single copy of the code.
+# They are imported by name like the pipeline scripts import them.
+
+import os
+import sys
+
+src_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src")
+
+for shared_dir in ["features", "models"]:
+    shared_path = os.path.join(src_path, shared_dir)
+    if shared_path not in sys.path:
+        sys.path.append(shared_path)
@@ -0,0 +1,161 @@
+# This file keeps the random forest in memory so requests do not load it from disk.
+# The model is loaded once per worker process, at startup by warm_up() (called from project_configuration/wsgi.py),
+# and one prediction is made on a row of zeros so the first request does not pay for the first call into sklearn.
+#
+# Every prediction checks the size and modification time of the model file. When a new file appears it is loaded
+# while the old model keeps serving, then swapped in with a single assignment, so requests always see a whole model.
+# A file that cannot be loaded, such as one that is still being copied, is logged and the old model is kept.
+# Copy new models next to the path and rename them over it (mv) so the change is seen once the file is complete.
+#
+# Models saved by train_model.py --mmap-export (forest_arrays.py) are memory mapped instead of read, so all the worker
+# processes share one copy of the node arrays in the page cache and a new worker starts without copying the model.
+#
+# Load and prediction latencies are recorded in metrics and returned by the /model_metrics view.
+
+import os
+import threading
+from collections import deque
+from time import perf_counter, time
+import numpy as np
+import pandas as pd
+import forest_arrays
+
+model_path = os.environ.get("MODEL_PATH", "./models/rfclf.joblib.pkl")
+
+# Trees are evaluated in this many threads per prediction. Requests predict a single row, where starting threads costs more than it saves.
+serving_jobs = 1
+
+# Prediction latencies kept for the percentiles of metrics_summary
+latency_window = 1000
+
+# Loaded model of this process, replaced as a whole when a new model file is loaded
+model_state = {"clf": None, "path": None, "file_id": None, "loaded_at": None}
+load_lock = threading.Lock()
+
+metrics = {
+    "loads": 0,
+    "failed_loads": 0,
+    "last_load_seconds": None,
+    "last_warmup_seconds": None,
+    "predictions": 0,
+    "prediction_seconds": deque(maxlen=latency_window),
+}
+
+def file_id(path):
+    """
+    Size and modification time of a file, which change when a new model is written, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+def predict_rows(clf, pred_df):
+    """
+    Predicts with a scikit-learn model or forest arrays.
+    """
+    if forest_arrays.is_forest_arrays(clf):
+        return forest_arrays.predict(clf, pred_df)
+    return clf.predict(pred_df)
+
+def warm_up_model(clf):
+    """
+    Predicts one row of zeros so the code paths of predict are loaded before the first request.
+    """
+    if forest_arrays.is_forest_arrays(clf):
+        columns, n_features = clf["feature_names"], clf["n_features"]
+    else:
+        columns, n_features = getattr(clf, "feature_names_in_", None), clf.n_features_in_
+    predict_rows(clf, pd.DataFrame(np.zeros((1, n_features)), columns=columns))
+
+def load_model(path):
+    """
+    Loads and warms up the model file at path and swaps it in as the model of this process.
+    """
+    current_id = file_id(path)
+    start_time = perf_counter()
+    clf = forest_arrays.read_model_file(path)
+    load_seconds = perf_counter() - start_time
+    if hasattr(clf, "n_jobs"):
+        clf.n_jobs = serving_jobs
+
+    start_time = perf_counter()
+    warm_up_model(clf)
+    warmup_seconds = perf_counter() - start_time
+
+    global model_state
+    model_state = {"clf": clf, "path": path, "file_id": current_id, "loaded_at": time()}
+    metrics["loads"] += 1
+    metrics["last_load_seconds"] = load_seconds
+    metrics["last_warmup_seconds"] = warmup_seconds
+    print(f"Model {path} loaded in {round(load_seconds, 3)}s and warmed up in {round(warmup_seconds, 3)}s")
+
+def get_model(path=model_path):
+    """
+    Returns the model of this process, loading it first if it is not loaded or the file at path has changed.
+    Only one thread loads at a time. While a new file is loaded, other threads keep using the current model.
+    """
+    global model_state
+    state = model_state
+    if state["clf"] is not None and state["path"] == path and state["file_id"] == file_id(path):
+        return state["clf"]
+
+    # Wait for the load if there is no model to serve, else skip it if another thread is already loading
+    if not load_lock.acquire(blocking=state["clf"] is None or state["path"] != path):
+        return state["clf"]
+    try:
+        state = model_state
+        new_id = file_id(path)
+        if state["clf"] is None or state["path"] != path or state["file_id"] != new_id:
+            try:
+                load_model(path)
+            except Exception as e:
+                metrics["failed_loads"] += 1
+                if state["clf"] is None or state["path"] != path:
+                    raise
+                print(f"Could not load model {path}, keeping the model loaded at {state['loaded_at']}: {e}")
+                # Try again once the file changes, not on every request
+                model_state = {**state, "file_id": new_id}
+        return model_state["clf"]
+    finally:
+        load_lock.release()
+
+def predict(pred_df, path=model_path):
+    """
+    Predicts the rows of pred_df with the model of this process.
+    """
+    clf = get_model(path)
+    start_time = perf_counter()
+    pred = predict_rows(clf, pred_df)
+    metrics["prediction_seconds"].append(perf_counter() - start_time)
+    metrics["predictions"] += 1
+    return pred
+
+def warm_up(path=model_path):
+    """
+    Loads the model at startup. Startup goes on without it if the file is missing, and the first request loads it.
+    """
+    try:
+        get_model(path)
+    except Exception as e:
+        print(f"Model {path} not loaded at startup: {e}")
+
+def metrics_summary():
+    """
+    returns:
+        dict - the model loaded, load and warm-up times in seconds and prediction latency percentiles in milliseconds
+    """
+    latencies = np.array(metrics["prediction_seconds"]) * 1000
+    summary = {
+        "model_path": model_state["path"],
+        "loaded_at": model_state["loaded_at"],
+        "loads": metrics["loads"],
+        "failed_loads": metrics["failed_loads"],
+        "last_load_seconds": metrics["last_load_seconds"],
+        "last_warmup_seconds": metrics["last_warmup_seconds"],
+        "predictions": metrics["predictions"],
+    }
+    for q in [50, 95, 99]:
+        summary[f"prediction_ms_p{q}"] = float(np.percentile(latencies, q)) if len(latencies) else None
+    return summary
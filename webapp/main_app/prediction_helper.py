@@ -1,39 +1,43 @@
 import pandas as pd
 import numpy as np
-import joblib
-from time import perf_counter
+from main_app import model_server
+from feature_transforms import smooth_view_like_ratio, normalize_text
+from sentiment_cache import score_keys, analyzer_version, cached_polarity_scores
 
 random_state = 42
 
 # Vader for sentiment analysis
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
-def smooth_if_0(row):
+analyzer = SentimentIntensityAnalyzer()
+version = analyzer_version(SentimentIntensityAnalyzer)
+
+def score_texts(texts):
     """
-    Creates a smoothed view_like ratio feature to avoid division by zero for a more accurate reflection of the ratio.
+    Scores a list of texts with vader.
     """
-    if row["like_count"] == 0:
-        vl_ratio = (row["view_count"]+1) / (row["like_count"]+1)
-    else:
-        vl_ratio = row["view_count"] / row["like_count"]
-    return round(vl_ratio,2)
+    score_dicts = [analyzer.polarity_scores(text) for text in texts]
+    return {key: np.array([score_dict[key] for score_dict in score_dicts], dtype=np.float32) for key in score_keys}
+
+def polarity_scores(texts):
+    """
+    Scores texts, reading texts scored before from the sentiment cache.
+    """
+    return cached_polarity_scores(texts, score_texts, version)
 
 def desc_sentiment(df):
     """
     Takes in a dataframe, performs vader sentiment analysis on it and outputs sentiment.
     """
-    df['desc_text'] = df['desc_text'].str.lower()                                                 #Remove capitalization                                            
-    df['desc_text'] = df['desc_text'].str.replace('[^\w\s]','')                                   #Removes extra whitespaces
-    df['desc_text'] = df['desc_text'].str.replace('@[A-Za-z0-9]+', '')                            #Removes any tags using @
-    df['desc_text'] = df['desc_text'].str.replace('\n', '')                                       #Remove newline 
+    df['desc_text'] = normalize_text(df['desc_text'])                                             #Remove capitalization, punctuation, tags using @ and newlines in one pass
 
     data=pd.DataFrame((df.desc_text)).astype(str)
-    data['scores']=data['desc_text'].apply(SentimentIntensityAnalyzer().polarity_scores)          #Apply Vader Sentiment Analysis
+    scores=polarity_scores(data['desc_text'])                                                     #Apply Vader Sentiment Analysis, or read it from the cache
 
-    data['desc_neu']=data['scores'].apply(lambda score_dict: score_dict['neu'])                        #Extract Neutral Values from dictionary
-    data['desc_neg']=data['scores'].apply(lambda score_dict: score_dict['neg'])                        #Extract Negative Values from dictionary
-    data['desc_pos']=data['scores'].apply(lambda score_dict: score_dict['pos'])                        #Extract Positive Values from dictionary
-    data['desc_compound']=data['scores'].apply(lambda score_dict: score_dict['compound'])              #Extract Compound Values from dictionary
+    data['desc_neu']=scores['neu']                                                                #Neutral Values
+    data['desc_neg']=scores['neg']                                                                #Negative Values
+    data['desc_pos']=scores['pos']                                                                #Positive Values
+    data['desc_compound']=scores['compound']                                                      #Compound Values
 
     combined_data=pd.concat([df,data], axis=1).reindex(df.index)                    #Add values back to original dataframe
 
@@ -45,10 +49,7 @@ def clean_comments(df):
     """
     
     df_clean=df[['video_id','votes','text']].copy()                                                #Select necessary columns
-    df_clean['text_cleaned'] = df_clean['text'].str.replace('[^\w\s]','')                    #Removes extra whitespaces
-    df_clean['text_cleaned'] = df_clean['text_cleaned'].str.replace('@[A-Za-z0-9]+', '')     #Removes any tags using @
-    df_clean['text_cleaned'] = df_clean['text_cleaned'].str.replace('\n', '')                #Remove newline punctuation 
-    df_clean['text_cleaned'] = df_clean['text_cleaned'].str.lower()                          #Removes Capitalization             
+    df_clean['text_cleaned'] = normalize_text(df_clean['text'], lower_first=False)          #Removes punctuation, tags using @, newlines and capitalization in one pass
 
     return df_clean
 
@@ -58,19 +59,12 @@ def comment_sentiment(df_clean):
     Groups by video_id using mean and returns the dataframe.
     """
     
-    #Designate Sentiment Analyzer
-    sid = SentimentIntensityAnalyzer()
-    
-    #Ensure Text is in string format
-    text = df_clean['text_cleaned']
-    text = str(text).encode('utf-8')
-    
-    #Apply Sentiment Analyzer to text data, parse out dictionary value to columns
-    df_clean['scores']=df_clean['text_cleaned'].apply(lambda text:sid.polarity_scores(str(text)))
-    df_clean['comment_neg']=df_clean['scores'].apply(lambda score_dict: score_dict['neg'])
-    df_clean['comment_neu']=df_clean['scores'].apply(lambda score_dict: score_dict['neu'])
-    df_clean['comment_pos']=df_clean['scores'].apply(lambda score_dict: score_dict['pos'])
-    df_clean['comment_compound']=df_clean['scores'].apply(lambda score_dict: score_dict['compound'])
+    #Apply Sentiment Analyzer to text data, comments scored before are read from the cache
+    scores = polarity_scores(df_clean['text_cleaned'])
+    df_clean['comment_neg']=scores['neg']
+    df_clean['comment_neu']=scores['neu']
+    df_clean['comment_pos']=scores['pos']
+    df_clean['comment_compound']=scores['compound']
 
     #Ensure values are in numeric format select necessary columns for analysis 
     df_clean["votes"] = pd.to_numeric(df_clean["votes"], errors='coerce')
@@ -91,7 +85,7 @@ def prepare_data_for_pred(df):
     df.replace([np.inf, -np.inf], np.nan,inplace=True)
 
     # Smooth view_like_ratio which helps avoid division by zero.
-    df["view_like_ratio_smoothed"] = df.apply(lambda row: smooth_if_0(row),axis=1)
+    df["view_like_ratio_smoothed"] = smooth_view_like_ratio(df["view_count"], df["like_count"])
     
     # Adds sentiment and filters for english
     df = desc_sentiment(df)
@@ -174,9 +168,7 @@ def create_final_dataframe(json_data, comment_df=None, archive_df=None):
     return final_df, json_data
 
 def make_pred(pred_df,clf_path):
-    start_load_time = perf_counter()
-    rf_clf = joblib.load(clf_path)
-    print(f"Time taken to load model: {(perf_counter() - start_load_time) }" )
-    pred = rf_clf.predict(pred_df)
+    # The model is loaded once per process and kept in memory by model_server.py
+    pred = model_server.predict(pred_df, clf_path)
     
     return pred
\ No newline at end of file
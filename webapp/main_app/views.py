@@ -3,11 +3,12 @@ from django.http import JsonResponse
 from main_app import data_generator
 from main_app import prediction_helper
 from main_app import database_helper
+from main_app import model_server
 
 # Create your views here.
 
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/79.0.3945.130 Safari/537.36'
-MODEL_PATH = './models/rfclf.joblib.pkl'
+MODEL_PATH = model_server.model_path
 
 
 def index(request):
@@ -67,6 +68,10 @@ def process_url(request):
 
         return JsonResponse(json_data)
 
+def model_metrics(request):
+    # Load time of the model in memory and latency of recent predictions
+    return JsonResponse(model_server.metrics_summary())
+
 def user_select_positive(request):
     if request.method=='GET':
         video_id = request.session['video_id']
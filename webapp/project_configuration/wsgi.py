@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project_configuration.settings')
 
 application = get_wsgi_application()
+
+# Load the model into this worker process before the first request
+from main_app import model_server
+model_server.warm_up()